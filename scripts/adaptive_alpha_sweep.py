@@ -0,0 +1,270 @@
+DESC='''Adaptive alpha_S x alpha_LD sweep for the model analysis.
+
+Instead of running the simulator and the intervention LP on every point of the
+alpha_S x alpha_LD grid of a model config file (e.g. bdconfig_model.json, 676
+points), the sweep starts from a coarse sub-grid and only refines the grid
+cells in which the infections (infections_mean of the simulation summary) or
+the LP objective (lp_obj_value, for any budget/delay) change by more than
+--tolerance, relative to the range of that quantity over the points evaluated
+so far. A refined cell is split in four by evaluating its edge midpoints and
+its centre. Refinement stops at the resolution of the config file grid.
+
+Points are run through the usual pipeline (run_spread_v2.py with the DAG
+output, then algorithm_groupint_general_v2.py) and write to the usual work
+folders, so gather_outputs_model.py picks them up; its contour plots
+interpolate the scattered points. The sweep is resumable: points whose outputs
+exist are not run again.
+
+By default each round is run locally with --jobs processes. With --slurm, the
+commands of the next round are written to --run_file instead (as
+generate_pipelines_model.py does); run it, wait for the jobs to finish, and
+call this script again to plan the following round.
+
+Example:
+python adaptive_alpha_sweep.py ../input/config_files/bdconfig_model.json --coarse_step 5 --jobs 8
+'''
+
+import argparse
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from create_batch_configs import generateConfigs
+# config file generator; make sure create_batch_configs.py is in the same folder
+from generate_pipelines_model import MEM_VALUES, parse_budget_int
+
+HOMEPATH="../scripts"
+WORKPATH="../work"
+CONFIG_PATH=f"{WORKPATH}/configs"
+DAG_PATH=f"{WORKPATH}/dags"
+SUMMARY_PATH=f"{WORKPATH}/summaries"
+INTERVENTION_PATH=f"{WORKPATH}/interventions"
+SIM_SUMMARY_PATH=f"{WORKPATH}/sim_summaries"
+OUTPATH="../results"
+
+def point_prefix(master_config, alpha_S, alpha_LD):
+    # Single-batch name, as expected by gather_outputs_model.py and by
+    # pipe_sim.sbatch/pipe_int.sbatch with single=1
+    return f"{master_config['prefix']}as{alpha_S}_ald{alpha_LD}"
+
+def coarse_indices(n, step):
+    '''Every step-th index of a grid axis of length n, always including the last.'''
+    indices = list(range(0, n, step))
+    if indices[-1] != n-1:
+        indices.append(n-1)
+    return indices
+
+class AdaptiveGrid:
+    '''Quadtree refinement over the index grid of two alpha lists.'''
+
+    def __init__(self, master_config, coarse_step=5, tolerance=0.1):
+        self.master_config = master_config
+        model_parameters = master_config['parameters']['model_parameters']
+        self.alpha_S = model_parameters['alpha_S']
+        self.alpha_LD = model_parameters['alpha_LD']
+        self.budgets = master_config['budget'] if type(master_config['budget'])==list else [master_config['budget']]
+        self.delays = master_config['intervention_time'] if type(master_config['intervention_time'])==list else [master_config['intervention_time']]
+        self.tolerance = tolerance
+        xs = coarse_indices(len(self.alpha_S), coarse_step)
+        ys = coarse_indices(len(self.alpha_LD), coarse_step)
+        # cells are (i0, i1, j0, j1): corners of a rectangle of grid indices
+        self.coarse_cells = [(i0, i1, j0, j1) for (i0, i1), (j0, j1)
+                in itertools.product(zip(xs, xs[1:]), zip(ys, ys[1:]))]
+        self.coarse_points = set(itertools.product(xs, ys))
+
+    def prefix(self, i, j):
+        return point_prefix(self.master_config, self.alpha_S[i], self.alpha_LD[j])
+
+    def read_point(self, i, j):
+        '''Results of one grid point as a dict of metrics, or None if the
+        simulation or any of the LP solves has not finished.'''
+        prefix = self.prefix(i, j)
+        sim_file = f'{SIM_SUMMARY_PATH}/{prefix}_summary.csv'
+        if not os.path.isfile(sim_file):
+            return None
+        sim_header = pd.read_csv(f'{SIM_SUMMARY_PATH}/0header.csv', nrows=0).columns
+        df = pd.read_csv(sim_file, names=sim_header)
+        out = {'infections_mean': df.sort_values('time_step').infections_mean.iloc[-1]}
+        lp_header = pd.read_csv(f'{SUMMARY_PATH}/0header.csv', nrows=0).columns
+        for b, d in itertools.product(self.budgets, self.delays):
+            lp_file = f'{SUMMARY_PATH}/{prefix}_I{d}B{b}_summary.csv'
+            if not os.path.isfile(lp_file):
+                return None
+            out[f'lp_obj_value_I{d}B{b}'] = pd.read_csv(lp_file, names=lp_header).lp_obj_value.iloc[0]
+        return out
+
+    def read_points(self, points):
+        results = {}
+        for p in points:
+            r = self.read_point(*p)
+            if r is not None:
+                results[p] = r
+        return results
+
+    def children(self, cell):
+        '''New points and sub-cells of a refined cell; None if the cell is at
+        the resolution of the grid.'''
+        i0, i1, j0, j1 = cell
+        if i1-i0 <= 1 and j1-j0 <= 1:
+            return None
+        xs = [i0, (i0+i1)//2, i1] if i1-i0 > 1 else [i0, i1]
+        ys = [j0, (j0+j1)//2, j1] if j1-j0 > 1 else [j0, j1]
+        points = set(itertools.product(xs, ys)) - {(i0,j0),(i0,j1),(i1,j0),(i1,j1)}
+        cells = [(a0, a1, b0, b1) for (a0, a1), (b0, b1)
+                 in itertools.product(zip(xs, xs[1:]), zip(ys, ys[1:]))]
+        return points, cells
+
+    def needs_refinement(self, cell, results, ranges):
+        i0, i1, j0, j1 = cell
+        corners = [results[p] for p in [(i0,j0),(i0,j1),(i1,j0),(i1,j1)]]
+        for metric, r in ranges.items():
+            values = [c[metric] for c in corners]
+            if r > 0 and (max(values)-min(values))/r > self.tolerance:
+                return True
+        return False
+
+    def plan(self, results):
+        '''Walks the refinement tree implied by the evaluated points. Returns
+        the points still to be evaluated: missing corners of the current cells
+        and midpoints of cells that change sharply.'''
+        missing = {p for p in self.coarse_points if p not in results}
+        if missing:
+            return missing
+        df = pd.DataFrame(results.values())
+        ranges = (df.max()-df.min()).to_dict()
+        todo = set()
+        stack = list(self.coarse_cells)
+        while stack:
+            cell = stack.pop()
+            split = self.children(cell)
+            if split is None or not self.needs_refinement(cell, results, ranges):
+                continue
+            points, cells = split
+            new = {p for p in points if p not in results}
+            if new:
+                todo |= new
+            else:
+                stack.extend(cells) # already refined; descend
+        return todo
+
+    def points_table(self, results):
+        '''Scattered points evaluated so far, one row per point.'''
+        rows = []
+        for (i, j), r in sorted(results.items()):
+            rows.append({'alpha_S': self.alpha_S[i], 'alpha_LD': self.alpha_LD[j],
+                         'input_code': self.prefix(i, j), **r})
+        return pd.DataFrame(rows)
+
+def write_configs(grid, points):
+    os.makedirs(CONFIG_PATH, exist_ok=True)
+    for i, j in points:
+        c = generateConfigs(grid.master_config, alpha_S=grid.alpha_S[i], alpha_LD=grid.alpha_LD[j])[0]
+        c['simulation_output_prefix'] = grid.prefix(i, j) # single batch; drop the batch index
+        with open(f"{CONFIG_PATH}/{c['simulation_output_prefix']}.json", 'w') as file:
+            json.dump(c, file)
+
+def run_point(grid, point):
+    '''Runs the simulator and the LP for one grid point, as pipe_sim.sbatch
+    and pipe_int.sbatch do.'''
+    prefix = grid.prefix(*point)
+    if not os.path.isfile(f'{SIM_SUMMARY_PATH}/{prefix}_summary.csv'):
+        subprocess.run([sys.executable, f'{HOMEPATH}/run_spread_v2.py', f'{CONFIG_PATH}/{prefix}.json',
+                '--dag_type', '1', '-s', '-p', DAG_PATH, '--summary_out', SIM_SUMMARY_PATH,
+                '--suppress_outfile', '-q'], check=True, stdout=subprocess.DEVNULL)
+    os.makedirs(f'{INTERVENTION_PATH}/{prefix}', exist_ok=True)
+    budgets, ints = parse_budget_int(grid.master_config)
+    env = dict(os.environ)
+    env.setdefault('SLURM_NTASKS', '1')
+    subprocess.run([sys.executable, f'{HOMEPATH}/algorithm_groupint_general_v2.py',
+            f'{DAG_PATH}/{prefix}_dag.csv', grid.master_config['input']['hierarchy'],
+            '-b', *budgets.split(), '-i', *ints.split(),
+            '--summary_path', SUMMARY_PATH, '--intervention_path', INTERVENTION_PATH,
+            '--input_code', prefix], check=True, stdout=subprocess.DEVNULL, env=env)
+    return point
+
+def write_slurm(grid, points, slurmFile):
+    '''Same submission commands as generate_pipelines_model.job_single_write_model,
+    restricted to the given points.'''
+    network = grid.master_config['input']['network']
+    network_name = network[network.rindex('/')+1:]
+    s = grid.master_config['simulations']
+    for i, j in sorted(points):
+        aS, aLD = grid.alpha_S[i], grid.alpha_LD[j]
+        prefix = grid.prefix(i, j)
+        logpath = f"{WORKPATH}/logs/{prefix}"
+        slurmFile.write(f'''\
+mkdir -p {logpath}
+jid=$(sbatch \
+-o {logpath}/as{aS}_ald{aLD}_log.txt \
+--export=ALL,prefix={prefix},single=1 \
+./pipe_sim.sbatch | awk '{{print $NF}}' )
+echo "Submitted batch job $jid"; ./qreg_single \n''')
+        for b, d in itertools.product(grid.budgets, grid.delays):
+            cpu_limit = min(max(math.ceil(MEM_VALUES.get(network_name, 0) * int(s) * int(d) / 815), 1), 20)
+            slurmFile.write(f'''\
+sbatch -o {logpath}/I{d}B{b}_log.txt \
+--dependency=afterok:$jid \
+--ntasks={cpu_limit} --mem={cpu_limit*8}G \
+--export=ALL,prefix={prefix},single=1,\
+hierarchy={grid.master_config['input']['hierarchy']},budget={b},\
+int_time={d} \
+./pipe_int.sbatch; \
+./qreg_single \n''')
+
+if __name__=="__main__":
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("config_file", help="Model config file with lists of alpha_S and alpha_LD values")
+    parser.add_argument("-k", "--coarse_step", type=int, default=5,
+            help="Initial grid: every k-th alpha value along each axis (default 5)")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1,
+            help="Refine a cell if a quantity changes across it by more than this fraction of its range")
+    parser.add_argument("--max_rounds", type=int, default=10,
+            help="Maximum number of refinement rounds")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+            help="Number of grid points run in parallel (local runs)")
+    parser.add_argument("--slurm", action="store_true",
+            help="Write the next round to --run_file instead of running it")
+    parser.add_argument("-r", "--run_file", default="run.sh",
+            help="SLURM script written with --slurm")
+    parser.add_argument("-o", "--out_file",
+            help="Csv file of evaluated points. Default: ../results/<prefix>adaptive_points.csv")
+    args = parser.parse_args()
+
+    with open(args.config_file) as f:
+        master_config = json.load(f)
+    grid = AdaptiveGrid(master_config, args.coarse_step, args.tolerance)
+    total = len(grid.alpha_S)*len(grid.alpha_LD)
+    out_file = args.out_file if args.out_file is not None else f"{OUTPATH}/{master_config['prefix']}adaptive_points.csv"
+    for d in [SUMMARY_PATH, SIM_SUMMARY_PATH, DAG_PATH, INTERVENTION_PATH]:
+        os.makedirs(d, exist_ok=True)
+
+    all_points = itertools.product(range(len(grid.alpha_S)), range(len(grid.alpha_LD)))
+    results = grid.read_points(all_points)
+    for round_number in range(args.max_rounds):
+        todo = grid.plan(results)
+        print(f"Round {round_number}: {len(results)} points evaluated, {len(todo)} to run")
+        if not todo:
+            break
+        write_configs(grid, todo)
+        if args.slurm:
+            with open(args.run_file, 'w') as slurmFile:
+                slurmFile.write('#!/bin/bash\n')
+                slurmFile.write('start=$SECONDS\n')
+                write_slurm(grid, todo, slurmFile)
+                slurmFile.write('echo "Total time" $(($SECONDS-$start))\n')
+            print(f"Wrote {args.run_file}; run it and call this script again once the jobs finish.")
+            break
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            for point in pool.map(lambda p: run_point(grid, p), sorted(todo)):
+                print(grid.prefix(*point), flush=True)
+        results.update(grid.read_points(todo))
+
+    points = grid.points_table(results)
+    points.to_csv(out_file, index=False)
+    print(f"{len(points)} of {total} grid points evaluated ({len(points)/total:.0%}): {out_file}")
@@ -1,9 +1,19 @@
 import os
-import networkx as nx
-from gurobipy import Model, GRB, quicksum # gurobi installation required
+import json
+import time
+import shutil
+import hashlib
+import resource
+from contextlib import contextmanager
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import breadth_first_order
+from collections import namedtuple
+from lp_backends import BACKENDS, makeBackend # make sure lp_backends.py is in the same folder
 import argparse
-from itertools import product
 from gm_compute import gm # make sure gm_compute.py is in the same folder
+import msc_network as msc # make sure msc_network.py is in the same folder
+from cascade_dag import CascadeDAG # make sure cascade_dag.py is in the same folder
 import pandas as pd
 
 DESC="""Intervention Algorithm: Given a set of cascade simulations, runs LP \
@@ -11,166 +21,511 @@ to determine ideal intervention groups.
 
 This is an updated version of algorithm_groupint_general from MULTIPATHWAY_SIMULATOR"""
 
-def parseOneSimulation(lines, sim_id, m, unique_groups, x, y, z, int_time, no_action, l, group):
-    print("Simulation: "+str(sim_id))
-    G = nx.DiGraph()
-    infectednodes = set([]) # records nodes that are infected if no action is taken
-    edge_labels = {}
-    sources = set([])
-    for line in lines:
-        cols = line.split(",")
-        # Column names from simulation files: simulation_step,source,source_time_step,source_index,
-        # target,target_time_step,target_index,level_0_intervention,level_1_intervention,pathway,event
-        edgetype = cols[len(cols)-1]
-        if edgetype == "EtoE":
-           continue
-        u = ""
-        u_t = int(cols[2])
-           
-        if cols[3] == "-1":
-           u = cols[1]+","+cols[2]
-        else: #bypassing the EtoE edges: e.g., u,i,2 -> u,i+3,-1 is replaced by u,i,0 -> u,i+3,-1
-           u = cols[1]+","+cols[2]+",0"
-        infectednodes.add(cols[1])
-       
-        v = ""
-        v_t = int(cols[5])
-        if cols[6] == "-1":
-           v = cols[4]+","+cols[5]
-        else:
-           v = cols[4]+","+cols[5]+","+cols[6]
-        infectednodes.add(cols[4])
-        G.add_edge(u,v)
-        edge_labels[u+","+v] = edgetype
-        #create ids for y and z variables
-        y_id_u = u+","+str(sim_id) # u,i,(j,)id
-        y_id_v = v+","+str(sim_id) # v,i,(j),id
-        z_id_u = cols[1]+","+str(sim_id)
-        z_id_v = cols[4]+","+str(sim_id)
-        #setup z variables
-        if z_id_u not in z:
-           z[z_id_u] = m.addVar(vtype = GRB.CONTINUOUS, lb = 0.0, ub = 1.0, name = "z["+z_id_u+"]")
-        if z_id_v not in z:
-           z[z_id_v] = m.addVar(vtype = GRB.CONTINUOUS, lb = 0.0, ub = 1.0, name = "z["+z_id_v+"]")
-        #setup y variables
-        if y_id_u not in y:
-           y[y_id_u] = m.addVar(vtype = GRB.CONTINUOUS, lb = 0.0, ub = 1.0, name = "y["+y_id_u+"]")
-           m.addConstr(z[z_id_u] >= y[y_id_u], name = "node_infected_or_exposed_at_some_timestep_"+str(z_id_u)+","+str(y_id_u))
-           if u_t < int_time:
-              m.addConstr(y[y_id_u] == 1, name = "initially_infected_"+str(y_id_u))
-        if y_id_v not in y:
-           y[y_id_v] = m.addVar(vtype = GRB.CONTINUOUS, lb = 0.0, ub = 1.0, name = "y["+y_id_v+"]")
-           m.addConstr(z[z_id_v] >= y[y_id_v], name = "node_infected_or_exposed_at_some_timestep_"+str(z_id_v)+","+str(y_id_v))
-           if v_t < int_time:
-              m.addConstr(y[y_id_v] == 1, name = "initially_infected_"+str(y_id_v))
-        
-        if cols[1] in group:
-           g_u = group[cols[1]]
-        else:
-           group[cols[1]] = -1
-           g_u = group[cols[1]]
-        if cols[4] in group:
-           g_v = group[cols[4]]
-        else:
-           group[cols[4]] = -1
-           g_v = group[cols[4]]
-        if g_u not in unique_groups:
-           x[g_u] = m.addVar(vtype = GRB.CONTINUOUS, lb = 0.0, ub = 1.0, name = "x["+str(g_u)+"]")
-           unique_groups.add(g_u)
-        if g_v not in unique_groups:
-           x[g_v] = m.addVar(vtype = GRB.CONTINUOUS, lb = 0.0, ub = 1.0, name = "x["+str(g_v)+"]")
-           unique_groups.add(g_v)
-       
-    print("DAG (nodes, edges) "+str(len(G.nodes()))+","+str(len(G.edges())))
-    #find sources in G (nodes with in_degree 0)   
-    for w in G.nodes():
-        if G.in_degree(w) == 0:
-           sources.add(w)
-           m.addConstr(y[w+","+str(sim_id)] == 1, name = "sources_are_infected_"+str(w)+","+str(sim_id))
-    print("Sources: "+str(sources))     
-    #edge constraints
-    for edge in G.edges():
-        v1 = edge[0]
-        v2 = edge[1]
-        cols_v2 = v2.split(",")
-        t_v2 = int(cols_v2[1])
-        v2_v = cols_v2[0]
-        if v2_v not in group:
-           print(v2_v, "not in any group ")
-           
-        g = group[v2_v]
-        if t_v2 < int_time:
-           continue
-        if edge_labels[v1+","+v2] == "StoE":
-           m.addConstr(y[v2+","+str(sim_id)] >= y[v1+","+str(sim_id)] - x[g], name = "(StoE) "+str(v1)+","+str(v2))
-        elif edge_labels[v1+","+v2] == "EtoI":
-           m.addConstr(y[v2+","+str(sim_id)] >= y[v1+","+str(sim_id)] - x[g], name = "(EtoI) "+str(v1)+","+str(v2))
-        elif edge_labels[v1+","+v2] == "ItoI":
-           m.addConstr(y[v2+","+str(sim_id)] >= y[v1+","+str(sim_id)] - x[g], name = "(ItoI) "+str(v1)+","+str(v2))
-        else:
-           continue
-       
-    for key in y:
-        cols_y = key.split(",")
-        if int(cols_y[-1]) != sim_id:
-            continue # reduces redundancy, by skipping if not current simulation
-        vertex = cols_y[0]
-        t_y = int(cols_y[1])
-        g_key = group[vertex]
-        if t_y >= int_time:
-            m.addConstr(y[key] <= 1 - x[g_key], name = "not_infected_if_vaccinated_on_time_"+str(key))
-    no_action += len(infectednodes)
-
-    return m, unique_groups, x, y, z, no_action
+# DAG events whose target is not infected if its group is intervened on in
+# time. EtoE edges are bypassed; StoI edges only count towards in-degrees.
+CONSTRAINED_EVENTS = ("StoE", "EtoI", "ItoI")
+# relative slack of the objective in the second solve of canonicalSolve, and
+# scale of the weighted sum of x added to it: small, so that the slack is not
+# used up for a (slightly) smaller sum of x
+CANONICAL_TOLERANCE = 1e-7
+CANONICAL_SCALE = 1e-3
+# with canonical: LP values within this of a rounding threshold are rounded up
+# (x and z of the canonical solution are often exactly at the threshold, e.g.
+# z = 0.5, up to rounding errors that depend on the formulation)
+ROUNDING_TOLERANCE = 1e-6
+# summary columns between delay and input_file, as stored by --cache_path
+SUMMARY_FIELDS = ['budget_used', 'lp_budget', 'obj_value', 'lp_obj_value', 'gm_value', 'lp_runtime', 'lp_work']
+# options that change the result of an instance (part of the cache key)
+CACHE_OPTIONS = ['no_gm', 'fixed_budget', 'reduce', 'screen', 'method', 'greedy_start', 'solver', 'generate',
+                 'decompose', 'block_size', 'tolerance', 'replay', 'lp_method', 'canonical']
+
+class Timer:
+    """Wall time of named phases (seconds), accumulated over calls:
+    with timer('solve'): ..."""
+
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def __call__(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[phase] = self.times.get(phase, 0.0) + time.perf_counter()-start
+
+class LPBuilder:
+    """The group-intervention LP as a sparse matrix, assembled block by block.
+    Columns (x, y, z variables) are numbered in the order in which the
+    per-variable construction (one m.addVar each) created them. Variable and
+    constraint names are only generated if names is set. Columns and rows
+    added after load are added to the model by the next load."""
+
+    def __init__(self, names=False):
+        self.names = names
+        self.num_cols = 0
+        self.num_rows = 0
+        self.x = {} # group -> column, in order of first appearance
+        self.z = [] # column arrays of the z variables, one per simulation (-1: constant)
+        self.z_const = [] # values of the constant z (see addReducedCascade)
+        self.z_weight = [] # number of simulations of each z (see cascadeScenarios)
+        self.x_zero = set() # groups whose x is 0
+        # y columns and rows y + x[g] <= 1, with the time of their node; they
+        # depend on the intervention time (see GroupLP.set_int_time)
+        self.y, self.y_time = [], []
+        self.vaccinated, self.vaccinated_time = [], []
+        self.col_blocks = [] # (columns, names, lower bounds, upper bounds)
+        self.row_blocks = [] # (rows, columns, coefficients, sense, rhs, names)
+        self.loaded_cols = self.loaded_rows = self.loaded_blocks = 0
+
+    def add_cols(self, cols, names=None, lb=0.0, ub=1.0):
+        self.col_blocks.append((cols, names, lb, ub))
+        self.num_cols = max(self.num_cols, int(cols.max())+1) if len(cols) else self.num_cols
+
+    def add_rows(self, rows, cols, vals, sense, rhs, names=None):
+        """Adds rows at the given row indices; cols and vals are (rows x terms)
+        arrays of columns and coefficients."""
+        if len(rows) == 0:
+            return
+        self.row_blocks.append((rows, cols, vals, sense, rhs, names))
+        self.num_rows = max(self.num_rows, int(rows.max())+1)
+
+    def matrix(self, first_block=0):
+        """Constraint matrix (CSR), senses and right-hand sides (of the rows
+        from row block first_block on, which must be the last rows)."""
+        blocks = self.row_blocks[first_block:]
+        first_row = min([int(r.min()) for r,_,_,_,_,_ in blocks], default=self.num_rows)
+        num_rows = self.num_rows - first_row
+        rows = np.concatenate([np.repeat(r - first_row, c.shape[1]) for r,c,_,_,_,_ in blocks] or [np.zeros(0, dtype=np.int64)])
+        cols = np.concatenate([c.ravel() for _,c,_,_,_,_ in blocks] or [np.zeros(0, dtype=np.int64)])
+        vals = np.concatenate([v.ravel() for _,_,v,_,_,_ in blocks] or [np.zeros(0)])
+        A = sp.csr_matrix((vals, (rows, cols)), shape=(num_rows, self.num_cols))
+        A.eliminate_zeros()
+        sense = np.empty(num_rows, dtype='<U1')
+        rhs = np.empty(num_rows)
+        for r,_,_,se,b,_ in blocks:
+            sense[r - first_row] = se
+            rhs[r - first_row] = b
+        return A, sense, rhs
+
+    def col_names(self):
+        names = np.empty(self.num_cols, dtype=object)
+        for cols, n, _, _ in self.col_blocks:
+            names[cols] = n
+        return names.tolist()
+
+    def row_names(self):
+        names = np.empty(self.num_rows, dtype=object)
+        for r,_,_,_,_,n in self.row_blocks:
+            names[r] = n
+        return names.tolist()
+
+    def load(self, m, obj, timer=None):
+        """Adds the columns and rows not loaded yet (all on the first call)
+        to the LP m (see lp_backends), with objective coefficients obj of the
+        new columns. Columns keep their index; returns the indices of the new
+        rows in m. timer: optional Timer of the phases."""
+        timer = timer or Timer()
+        with timer('matrix'):
+            A, sense, rhs = self.matrix(self.loaded_blocks)
+        with timer('columns'):
+            lb, ub = np.zeros(self.num_cols), np.ones(self.num_cols)
+            for cols, _, l, u in self.col_blocks:
+                lb[cols], ub[cols] = l, u
+            ub[[self.x[g] for g in self.x_zero]] = 0.0
+            new = slice(self.loaded_cols, self.num_cols)
+            cols = m.add_cols(lb[new], ub[new], obj)
+        with timer('rows'):
+            rows = m.add_rows(A, sense, rhs)
+        if self.names:
+            with timer('names'):
+                m.set_names(cols, self.col_names()[new], rows, self.row_names()[self.num_rows-len(rhs):])
+        self.loaded_cols, self.loaded_rows, self.loaded_blocks = \
+            self.num_cols, self.num_rows, len(self.row_blocks)
+        return rows
+
+def first_appearance(keys):
+    """Numbers the distinct keys in order of first appearance. Returns the
+    number of each key and the position of the first appearance of each
+    number."""
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.ravel()], first[order]
+
+def node_names(cell, time, index, sim_id):
+    # "u,t" for nodes without index, "u,t,j" otherwise, followed by ",sim_id"
+    return [f"{c},{t},{sim_id}" if j == -1 else f"{c},{t},{j},{sim_id}"
+            for c, t, j in zip(cell.tolist(), time.tolist(), index.tolist())]
+
+# Time-expanded graph of one simulation; see cascadeGraph
+CascadeGraph = namedtuple('CascadeGraph', ['sim_id', 'cells', 'cell_group', 'cell_first', 'endpoint_cell',
+    'node_first', 'node_cell', 'n_cell', 'n_time', 'n_index', 'n_group', 'e_u', 'e_v', 'e_event', 'sources'])
+
+def cascadeGraph(cascade, verbose=True):
+    """Time-expanded graph of one simulation (a Cascade of its non-EtoE DAG
+    edges): nodes (cell, time, index) and cells, numbered in order of first
+    appearance along the edges (source before target), and distinct edges.
+    None if the simulation has no edges."""
+    sim_id, source, source_time, source_index, target, target_time, target_index, \
+        event, source_group, target_group = cascade
+    if len(source) == 0:
+        return None
+    # EtoE edges are bypassed: e.g., u,i,2 -> u,i+3,-1 is replaced by u,i,0 -> u,i+3,-1
+    source_index = np.where(source_index == -1, -1, 0)
+    cell = np.stack([source, target], axis=1).ravel()
+    time = np.stack([source_time, target_time], axis=1).ravel()
+    index = np.stack([source_index, target_index], axis=1).ravel()
+    span_t, span_j = int(time.max())+1, int(index.max())+2
+    node, node_first = first_appearance((cell*span_t + time)*span_j + index+1)
+    cell_num, cell_first = first_appearance(cell)
+    u, v = node[0::2], node[1::2]
+    n_nodes = len(node_first)
+    cell_group = np.stack([source_group, target_group], axis=1).ravel()[cell_first]
+    node_cell = cell_num[node_first]
+
+    # Distinct edges, grouped by source node (in node order) and otherwise in
+    # order of first appearance; a repeated edge keeps its last event
+    e_key = u*n_nodes + v
+    _, e_first = np.unique(e_key, return_index=True)
+    _, e_last = np.unique(e_key[::-1], return_index=True)
+    e_last = len(e_key)-1 - e_last
+    e_order = np.lexsort((e_first, u[e_first]))
+    e_u, e_v, e_event = u[e_first][e_order], v[e_first][e_order], event[e_last][e_order]
+    if verbose:
+        print("DAG (nodes, edges) "+str(n_nodes)+","+str(len(e_u)))
+
+    # Sources (in-degree 0) are infected
+    sources = np.flatnonzero(np.bincount(e_v, minlength=n_nodes) == 0)
+    if verbose:
+        print("Sources: "+str(len(sources)))
+    return CascadeGraph(sim_id, cell[cell_first], cell_group, cell_first, cell_num,
+                        node_first, node_cell, cell[node_first], time[node_first], index[node_first],
+                        cell_group[node_cell], e_u, e_v, e_event, sources)
+
+def newGroups(lp, graph):
+    """Groups of the simulation without an x column yet, in order of first
+    appearance, and the positions of these appearances."""
+    new_groups, group_pos = [], []
+    for p, g in enumerate(graph.cell_group[graph.endpoint_cell].tolist()):
+        if g not in lp.x and g not in new_groups:
+            new_groups.append(g)
+            group_pos.append(p)
+    return new_groups, np.array(group_pos, dtype=np.int64)
+
+def addCascade(lp, cascade, int_time, weight=1, verbose=True):
+    """Adds the variables and constraints of one simulation (a Cascade of its
+    non-EtoE DAG edges) to the LP, for intervention times >= int_time.
+    weight: number of simulations with this cascade; verbose: print the size
+    of its graph. Returns the number of infected cells."""
+    graph = cascadeGraph(cascade, verbose)
+    if graph is None:
+        return 0
+    sim_id, cells, cell_first, node_first = graph.sim_id, graph.cells, graph.cell_first, graph.node_first
+    node_cell, n_time, e_u, e_v, e_event, sources = \
+        graph.node_cell, graph.n_time, graph.e_u, graph.e_v, graph.e_event, graph.sources
+    n_nodes, n_cells = len(node_first), len(cell_first)
+
+    # Columns, in creation order: on each edge z(source), z(target),
+    # y(source), y(target), then x of new groups
+    new_groups, group_pos = newGroups(lp, graph)
+    position = np.concatenate([
+        6*(cell_first//2) + cell_first%2,
+        6*(node_first//2) + 2 + node_first%2,
+        6*(group_pos//2) + 4 + group_pos%2])
+    col = np.empty(len(position), dtype=np.int64)
+    col[np.argsort(position, kind='stable')] = lp.num_cols + np.arange(len(position))
+    z_col, y_col, x_new = col[:n_cells], col[n_cells:n_cells+n_nodes], col[n_cells+n_nodes:]
+    lp.x.update(zip(new_groups, x_new.tolist()))
+    x_col = np.array([lp.x[g] for g in graph.n_group.tolist()], dtype=np.int64)
+    lp.z.append(z_col)
+    lp.z_const.append(np.zeros(n_cells))
+    lp.z_weight.append(np.full(n_cells, weight))
+    if lp.names:
+        z_names = [f"{c},{sim_id}" for c in cells.tolist()]
+        y_names = node_names(graph.n_cell, n_time, graph.n_index, sim_id)
+        lp.add_cols(z_col, [f"z[{n}]" for n in z_names])
+        lp.add_cols(y_col, [f"y[{n}]" for n in y_names])
+        lp.add_cols(x_new, [f"x[{g}]" for g in new_groups])
+    else:
+        lp.add_cols(np.concatenate([z_col, y_col, x_new]))
+
+    # z >= y. y == 1 before the intervention time is a bound (set_int_time)
+    lp.y.append(y_col)
+    lp.y_time.append(n_time)
+    row = lp.num_rows
+    lp.add_rows(row + np.arange(n_nodes), np.stack([z_col[node_cell], y_col], axis=1),
+                np.tile([1.0, -1.0], (n_nodes, 1)), '>', np.zeros(n_nodes),
+                [f"node_infected_or_exposed_at_some_timestep_{z_names[c]},{y_names[n]}"
+                 for n, c in enumerate(node_cell.tolist())] if lp.names else None)
+    row += n_nodes
+
+    # Sources are infected
+    lp.add_rows(row + np.arange(len(sources)), y_col[sources][:, None], np.ones((len(sources), 1)),
+                '=', np.ones(len(sources)),
+                [f"sources_are_infected_{y_names[n]}" for n in sources] if lp.names else None)
+    row += len(sources)
+
+    # Edge constraints: y_v >= y_u - x[g(v)] after the intervention time
+    # (before it, y_v == 1 satisfies them)
+    active = (n_time[e_v] >= int_time) & np.isin(e_event, CONSTRAINED_EVENTS)
+    a_u, a_v = e_u[active], e_v[active]
+    lp.add_rows(row + np.arange(len(a_u)), np.stack([y_col[a_v], y_col[a_u], x_col[a_v]], axis=1),
+                np.tile([1.0, -1.0, 1.0], (len(a_u), 1)), '>', np.zeros(len(a_u)),
+                [f"({ev}) {y_names[a].rsplit(',',1)[0]},{y_names[b].rsplit(',',1)[0]}"
+                 for ev, a, b in zip(e_event[active], a_u, a_v)] if lp.names else None)
+    row += len(a_u)
+
+    # Not infected if the group is intervened on in time: y <= 1 - x[g]
+    # (right-hand side 2, i.e. inactive, before the intervention time)
+    after = np.flatnonzero(n_time >= int_time)
+    lp.add_rows(row + np.arange(len(after)), np.stack([y_col[after], x_col[after]], axis=1),
+                np.ones((len(after), 2)), '<', np.ones(len(after)),
+                [f"not_infected_if_vaccinated_on_time_{y_names[n]}" for n in after] if lp.names else None)
+    lp.vaccinated.append(row + np.arange(len(after)))
+    lp.vaccinated_time.append(n_time[after])
+
+    return n_cells
+
+# Nodes of a cascade for one intervention time; see cascadeStatus
+CascadeStatus = namedtuple('CascadeStatus', ['fixed', 'infectable', 'e_u', 'e_v', 'cell_fixed'])
+
+def cascadeStatus(graph, int_time):
+    """Nodes with y fixed to 1 (before int_time, and sources), nodes that can
+    be infected (reachable from the fixed ones over constrained edges into
+    free nodes; y = 0 for the others), these live edges, and cells with a
+    fixed node (z = 1)."""
+    n_nodes, n_cells = len(graph.node_first), len(graph.cell_first)
+    fixed = graph.n_time < int_time
+    fixed[graph.sources] = True
+    constrained = np.isin(graph.e_event, CONSTRAINED_EVENTS) & ~fixed[graph.e_v]
+    e_u, e_v = graph.e_u[constrained], graph.e_v[constrained]
+    # reachability through a virtual root node n_nodes
+    fixed_nodes = np.flatnonzero(fixed)
+    reach = sp.csr_matrix((np.ones(len(e_u)+len(fixed_nodes)),
+                           (np.concatenate([e_u, np.full(len(fixed_nodes), n_nodes)]),
+                            np.concatenate([e_v, fixed_nodes]))), shape=(n_nodes+1, n_nodes+1))
+    infectable = np.zeros(n_nodes+1, dtype=bool)
+    infectable[breadth_first_order(reach, n_nodes, directed=True, return_predecessors=False)] = True
+    infectable = infectable[:n_nodes]
+    live = infectable[e_u]
+    cell_fixed = np.zeros(n_cells, dtype=bool)
+    cell_fixed[graph.node_cell[fixed]] = True
+    return CascadeStatus(fixed, infectable, e_u[live], e_v[live], cell_fixed)
+
+def addReducedCascade(lp, cascade, int_time, weight=1, verbose=True):
+    """Adds one simulation to the LP for intervention time int_time only,
+    after a reduction that keeps the optimal value and the optimal x:
+    - y of nodes before int_time and of sources is 1: substituted; their
+      cells have z = 1 (a constant). A source after int_time fixes x of its
+      group to 0.
+    - Nodes not reachable from those over constrained edges have y = 0 and
+      are dropped, as are cells with only such nodes (z = 0).
+    - A node whose only in-edge comes from the same cell satisfies
+      y_v = max(0, y_u - x[g]) at the optimum. It is eliminated: its out-edges
+      are attached to the first remaining node r of the chain, with k x[g] for
+      the k eliminated steps, i.e. y_w >= y_r - k x[g] - x[g(w)].
+    - y + x[g] <= 1 rows are dropped (the least y satisfies them), and so is
+      z >= y for nodes whose in-edges all come from the same cell (y is
+      bounded by an earlier node of the cell).
+    The optimal x of the reduced and the full LP are the same set, so with
+    --canonical the solution chosen by canonicalSolve, its z and hence the
+    rounding (with ROUNDING_TOLERANCE) are those of the full LP.
+    weight: number of simulations with this cascade; verbose: print the size
+    of its graph. Returns the number of infected cells."""
+    graph = cascadeGraph(cascade, verbose)
+    if graph is None:
+        return 0
+    sim_id, node_cell, n_group = graph.sim_id, graph.node_cell, graph.n_group
+    n_nodes, n_cells = len(graph.node_first), len(graph.cell_first)
+    new_groups, _ = newGroups(lp, graph)
+
+    fixed, infectable, e_u, e_v, cell_fixed = cascadeStatus(graph, int_time)
+    lp.x_zero.update(n_group[graph.sources[graph.n_time[graph.sources] >= int_time]].tolist())
+
+    # Same-cell chains: pred[v] is the first remaining node of v's chain and
+    # hops[v] the number of eliminated steps from it
+    same_cell = node_cell[e_u] == node_cell[e_v]
+    chain = same_cell & (np.bincount(e_v, minlength=n_nodes)[e_v] == 1)
+    pred = np.arange(n_nodes)
+    pred[e_v[chain]] = e_u[chain]
+    hops = np.zeros(n_nodes, dtype=np.int64)
+    hops[e_v[chain]] = 1
+    while True:
+        jump = pred[pred]
+        if np.array_equal(jump, pred):
+            break
+        hops = hops + hops[pred]
+        pred = jump
+    eliminated = np.zeros(n_nodes, dtype=bool)
+    eliminated[e_v[chain]] = True
+    kept = infectable & ~fixed & ~eliminated
+
+    # z: 1 in cells with a fixed node, 0 in cells without infectable nodes;
+    # columns for the others, bounded by the nodes with an in-edge from
+    # another cell
+    foreign = np.zeros(n_nodes, dtype=bool)
+    foreign[e_v[~same_cell]] = True
+    z_nodes = np.flatnonzero(kept & foreign & ~cell_fixed[node_cell])
+    z_cells = np.unique(node_cell[z_nodes])
+
+    # Columns: z, y, then x of new groups
+    kept_nodes = np.flatnonzero(kept)
+    z_col = np.full(n_cells, -1, dtype=np.int64)
+    z_col[z_cells] = lp.num_cols + np.arange(len(z_cells))
+    y_col = np.full(n_nodes, -1, dtype=np.int64)
+    y_col[kept_nodes] = lp.num_cols + len(z_cells) + np.arange(len(kept_nodes))
+    x_new = lp.num_cols + len(z_cells) + len(kept_nodes) + np.arange(len(new_groups))
+    lp.x.update(zip(new_groups, x_new.tolist()))
+    lp.z.append(z_col)
+    lp.z_const.append(cell_fixed.astype(float))
+    lp.z_weight.append(np.full(n_cells, weight))
+    if lp.names:
+        y_names = node_names(graph.n_cell, graph.n_time, graph.n_index, sim_id)
+        lp.add_cols(z_col[z_cells], [f"z[{c},{sim_id}]" for c in graph.cells[z_cells].tolist()])
+        lp.add_cols(y_col[kept_nodes], [f"y[{y_names[n]}]" for n in kept_nodes])
+        lp.add_cols(x_new, [f"x[{g}]" for g in new_groups])
+    else:
+        lp.add_cols(np.concatenate([z_col[z_cells], y_col[kept_nodes], x_new]))
+    row = lp.num_rows
+
+    # z >= y
+    lp.add_rows(row + np.arange(len(z_nodes)), np.stack([z_col[node_cell[z_nodes]], y_col[z_nodes]], axis=1),
+                np.tile([1.0, -1.0], (len(z_nodes), 1)), '>', np.zeros(len(z_nodes)),
+                [f"node_infected_or_exposed_at_some_timestep_{graph.cells[node_cell[n]]},{y_names[n]}"
+                 for n in z_nodes] if lp.names else None)
+    row += len(z_nodes)
+
+    # Edge constraints y_w >= y_r - k x[g(r)] - x[g(w)] into remaining nodes;
+    # of parallel ones (same w, r and group) the one with the fewest steps
+    into = kept[e_v]
+    w, u = e_v[into], e_u[into]
+    r, k = pred[u], hops[u]
+    r = np.where(fixed[r], -1, r) # all fixed nodes are the constant 1
+    # the group of the eliminated steps is that of r, unless r is fixed
+    g = np.where((r < 0) & (k > 0), n_group[u], np.iinfo(np.int64).min)
+    order = np.lexsort((k, g, r, w))
+    _, first = np.unique(np.stack([w, r, g], axis=1)[order], axis=0, return_index=True)
+    keep = order[first]
+    w, u, r, k = w[keep], u[keep], r[keep], k[keep]
+    x_col = np.array([lp.x[g] for g in n_group.tolist()], dtype=np.int64)
+    free_root = r >= 0
+    # a fixed root contributes to the right-hand side; its (zero) coefficient
+    # is put on y_w, and coefficients of the same x are summed
+    lp.add_rows(row + np.arange(len(w)),
+                np.stack([y_col[w], np.where(free_root, y_col[r], y_col[w]), x_col[u], x_col[w]], axis=1),
+                np.stack([np.ones(len(w)), np.where(free_root, -1.0, 0.0), k.astype(float), np.ones(len(w))], axis=1),
+                '>', np.where(free_root, 0.0, 1.0),
+                [f"reduced_edge_{y_names[a]}_{'fixed' if b < 0 else y_names[b]}_{c}"
+                 for a, b, c in zip(w.tolist(), r.tolist(), k.tolist())] if lp.names else None)
+
+    return n_cells
+
+def cascadeKey(cascade):
+    """Hash of the time-expanded graph of one simulation (a Cascade of its
+    non-EtoE DAG edges): its distinct edges, after the EtoE bypass, with
+    their events, in sorted order. Simulations with the same key give the
+    same variables and constraints."""
+    source_index = np.where(cascade.source_index == -1, -1, 0)
+    edges = np.stack([cascade.source, cascade.source_time, source_index,
+                      cascade.target, cascade.target_time, cascade.target_index], axis=1)
+    # a repeated edge keeps its last event (as in cascadeGraph)
+    _, last = np.unique(edges[::-1], axis=0, return_index=True)
+    last = len(edges)-1 - last
+    key = hashlib.sha1(np.ascontiguousarray(edges[last]).tobytes())
+    key.update("\n".join(cascade.event[last].tolist()).encode())
+    return key.hexdigest()
+
+def cascadeScenarios(dag):
+    """Distinct cascades of the DAG: position of the first simulation with
+    each cascade, and the number of simulations with it."""
+    first = {}
+    for index, cascade in enumerate(dag.cascades(exclude=("EtoE",))):
+        first.setdefault(cascadeKey(cascade), []).append(index)
+    index = np.array([sims[0] for sims in first.values()], dtype=np.int64)
+    weight = np.array([len(sims) for sims in first.values()], dtype=np.int64)
+    print("Scenarios (distinct cascades): "+str(len(index))+" of "+str(dag.number_of_simulations))
+    return index, weight
+
+def screenGroups(dag, int_time, scenarios=None):
+    """Screening of the groups for intervention time int_time. x[g] only
+    enters the edge constraints into free (not fixed), infectable nodes of
+    group g (its entry nodes), and lowers the objective only if an entry
+    node reaches, over live edges, a free node of a cell without fixed
+    nodes. Groups for which no such cell is reachable cannot improve the
+    objective; their x can be fixed to 0. Reachability is propagated as
+    bitsets of groups, in order of time. Returns one row per group with the
+    number of entry nodes and of reachable cells (summed over simulations)
+    and whether the group is a candidate."""
+    if scenarios is None:
+        scenarios = cascadeScenarios(dag)
+    groups = np.unique(np.concatenate([dag.source_group, dag.target_group]))
+    n_words = max(1, (len(groups)+63)//64)
+    entries = np.zeros(n_words*64, dtype=np.int64)
+    reach = np.zeros(n_words*64, dtype=np.int64)
+    for index, weight in zip(*scenarios):
+        graph = cascadeGraph(dag.cascade(index, exclude=("EtoE",)), verbose=False)
+        if graph is None:
+            continue
+        fixed, infectable, e_u, e_v, cell_fixed = cascadeStatus(graph, int_time)
+        if (graph.n_time[e_u] >= graph.n_time[e_v]).any():
+            raise ValueError(f"Simulation {graph.sim_id}: DAG edges must go forward in time.")
+        free = infectable & ~fixed
+        g = np.searchsorted(groups, graph.n_group)
+        entry = np.flatnonzero(free)
+        bits = np.zeros((len(free), n_words), dtype=np.uint64)
+        bits[entry, g[entry]//64] = np.left_shift(np.uint64(1), (g[entry]%64).astype(np.uint64))
+        entries += weight*np.bincount(g[entry], minlength=n_words*64)
+        # a node's bits are final once all earlier time steps are done
+        t = graph.n_time[e_v]
+        order = np.argsort(t, kind='stable')
+        for level in np.split(order, np.flatnonzero(np.diff(t[order]))+1):
+            np.bitwise_or.at(bits, e_v[level], bits[e_u[level]])
+        target = np.flatnonzero(free & ~cell_fixed[graph.node_cell])
+        cell_bits = np.zeros((len(graph.cells), n_words), dtype=np.uint64)
+        np.bitwise_or.at(cell_bits, graph.node_cell[target], bits[target])
+        for b in range(64):
+            reach[b::64] += weight*((cell_bits >> np.uint64(b)) & np.uint64(1)).sum(axis=0).astype(np.int64)
+    df = pd.DataFrame({'group': groups, 'entry_nodes': entries[:len(groups)],
+                       'reachable_cells': reach[:len(groups)]})
+    df['candidate'] = (df.reachable_cells > 0) & (df.group != -1)
+    print(f"Screening (int_time {int_time}): {df.candidate.sum()} of {len(df)} groups are candidates")
+    return df
 
 #Rounding Algorithm
-def rounding(x, y, z, denom, fixed_budget=None):
+def rounding(x, z, denom, fixed_budget=None, ranking=None, replay=None, verbose=False, tolerance=0.0):
+    # x: LP value of each group; z: LP values of the z variables (array);
+    # ranking: optional score of each group, breaks ties in the heuristic;
+    # replay: optional dag_replay.ReplayEvaluator (at the intervention time),
+    # Z is then the replay of the rounded groups instead of rounded z;
+    # tolerance: values this far below a threshold are rounded up as well
     X = {} # stores if group is intervened, yes/no; rounded
     # Y = {} # unused?
     Y = None
-    Z = {} # stores if node has been infected at some point, yes/no (for objective value); rounded
-    # refer to detailed explanations below
- 
-    #round z values to Z (0 or 1)   
-    for key, gv in z.items():
-        # key refers to group number; gv refers to gurobi output
-        val = gv.X # z value in question
-        if val >= 0.5:
-           Z[key] = 1
-        else:
-           Z[key] = 0
+    # stores if node has been infected at some point, yes/no (for objective value); rounded
+    Z = (z >= 0.5 - tolerance).astype(int)
     
     #round x values to X
     if fixed_budget is None:
-        gs = []
-        vs = []
-        ints = []
         count = 0
         frac_k = 1.0/(2*denom)
         print("Threshold: "+str(frac_k))
-        for key, gv in x.items():
-            val = gv.X # x value in question
+        for key, val in x.items():
             # 1/(2*denom), either GM or no_groups
-            if val >= frac_k:
+            if val >= frac_k - tolerance:
                X[key] = 1
                count = count+1
             else:
                X[key] = 0
-            gs.append(key)
-            vs.append(val)
-            ints.append(X[key])
-        df = pd.DataFrame({'group': gs, 'intervene': ints, 'val': vs})
         print("X rounded to 1: "+str(count))
     else:
         # Heuristic algorithm; guarantees interventions 
         # at a specified no. of groups, rather than those that pass threshold
-        key_list, val_dict = [],{}
-        for key, gv in x.items():
-            key_list.append(key)
-            val_dict[key] = gv.X
         # sort key list in descending order of corresponding x values
-        key_list.sort(key=(lambda k: val_dict[k]), reverse=True)
-        # now take top B nodes. Ties are handled arbitrarily
+        ranking = {} if ranking is None else ranking
+        key_list = sorted(x, key=(lambda k: (x[k], ranking.get(k, 0))), reverse=True)
+        # now take top B nodes. Ties are broken by ranking, otherwise arbitrarily
         for i in range(len(key_list)):
             key = key_list[i]
             if i<fixed_budget:
@@ -178,98 +533,368 @@ def rounding(x, y, z, denom, fixed_budget=None):
             else:
                 X[key] = 0
         print('Heuristic applied')
-        print(X)
-        df = pd.DataFrame()
+        if verbose:
+            print(X)
+    if replay is not None:
+        Z = replay.cells([key for key, val in X.items() if val == 1])
+    df = pd.DataFrame({'group': list(x.keys()), 'intervene': list(X.values()), 'val': list(x.values())})
 
     return X, Y, Z, df
 
+def tieWeights(groups):
+    """Weight of x of each group in canonicalSolve: 1 plus a fixed
+    pseudo-random number in [0, 1) for each group id, so that no two
+    selections of groups have the same weighted sum (and the order of the
+    columns does not matter)."""
+    return np.array([1.0 + np.random.default_rng([1, g+1]).random() for g in groups]) # g >= -1
+
+def canonicalSolve(m, x_cols, weights, tolerance=CANONICAL_TOLERANCE, scale=CANONICAL_SCALE):
+    """Optimal solution of the LP m (just solved to optimality) with the
+    least weighted sum of x. The LP usually has many optimal solutions (e.g.
+    with x > 0 for groups that cannot lower the objective), and the one the
+    solver ends on depends on its starting point, i.e. on the earlier solves
+    and on the formulation (--reduce, --screen, ...), and so does the
+    rounding. This one does not: m is re-solved with its objective kept
+    within tolerance (relative) of the optimum and scale*weights*x added to it.
+    The objective and the row are restored. Returns the values, solver
+    runtime and work."""
+    obj = m.get_obj()
+    values = m.values()
+    cols = np.flatnonzero(obj)
+    row = m.add_rows(sp.csr_matrix((obj[cols], (np.zeros(len(cols), dtype=np.int64), cols)), shape=(1, len(obj))),
+                     '<', np.array([obj @ values + tolerance*max(1.0, abs(m.objective))]))
+    m.set_obj(x_cols, obj[x_cols] + scale*weights)
+    m.set_method('primal') # the optimal basis stays primal feasible
+    m.solve()
+    values = m.values()
+    m.remove_rows(row)
+    m.set_obj(x_cols, obj[x_cols])
+    return values, m.runtime, m.work
+
 #LP for group interventions
-def prepareLP_group(input_file, budget_groups, int_time, l, group, hierarchy_file, 
-                    use_gm=True, runtime=True, fixed_budget=None):
-    
-    no_action = 0.0
-    # no_action1 = 0.0
-    # current_sim_id = 0
-    # count = -1
-    m = Model('Group-Interventions-ILP')
-    
-    # templines = []
-    unique_groups = set()
-    # y_keys = set()
-    # z_keys = set()
-    x = {} # x[g_u]: stores whether a group is intervened or not. Between 0 and 1; represents probability of intervention
-    y = {} # y[u,i,j]: stores if node in time-expanded graph is infected, at a given time/simulation
-    z = {} # z[u,j]: stores if node u is infected in a given simuluation j, at some (any) timestep
-    
-    # Memory-efficient input file reading:
-    # First, loop through entire file once to get rows in which new simulations start
-    sim_starts = []
-    current_sim_id=-1
-    with open(input_file, 'r') as fp:
-        next(fp) # discard header row
-        for i, line in enumerate(fp, start=1): # iterate through rows
-            sim_id = int(line[0:line.index(',')])
-            if sim_id != current_sim_id:
-                sim_starts.append(i)
-                current_sim_id = sim_id
-        sim_starts.append(i+1) # to signify end
-    print("Simulation Cutoffs:\n"+str(sim_starts))
-    
-    #m.Params.Method = 1 if sim_id < 299 else -1 # dual simplex; else automatic
-    #m.Params.Threads = 1 if sim_id < 99 else 2 if sim_id < 199 else 3 if sim_id < 299 else 0
-    threads = int(os.environ['SLURM_NTASKS']) # number of threads specified in generate_pipelines
-    m.Params.Threads = threads
-    m.Params.Method = 2 if threads==1 else 3
-         
-    # Now use these cutoffs to create generators, which are passed to the function in lieu of lists
-    fp = open(input_file, 'r')
-    next(fp) # discard header row
-    for index in range(len(sim_starts)-1):
-        # index corresponds to current sim id
-        lines = (next(fp).strip() for _ in range(sim_starts[index], sim_starts[index+1])) # a generator
-        m, unique_groups, x, y, z, no_action = parseOneSimulation(lines, index, m, unique_groups, x, y, z, int_time, no_action, l, group)
-    fp.close()
-    M = float(index+1) # M: total number of simulations       
-    
-    no_action = no_action/M
-    print("No Action: avg. # nodes infected "+str(no_action))
-    print("Unique groups "+str(unique_groups))
-    #budget constraint & group -1 cannot be intervened
-    m.addConstr(quicksum(x[g] for g in unique_groups) <= budget_groups, name = "C4: budget constraint")
-    if -1 in unique_groups:
-        m.addConstr(x[-1] == 0, name = "C5: group -1 cannot be intervened")
-    m.setObjective(quicksum(z[key] for key in z.keys())/M, GRB.MINIMIZE)
-    m.update()
-    m.optimize()
-    LP_objValue = m.objVal
-    for key in x.keys():
-        print(key, x[key])
-    print("Re-done budget")
-    lp_budget = 0.0
-    for key, gv in x.items():
-        val = gv.X
-        lp_budget += val
-    print("budget used by LP "+str(lp_budget))
-    no_groups = len(unique_groups)-1 if -1 in unique_groups else len(unique_groups)
-    print("# groups: " + str(no_groups))
-    if use_gm:
-        # use gm to round instead
-        gm_val = gm(pd.read_csv(input_file), pd.read_csv(hierarchy_file))
-        print("GM value: "+str(gm_val))
-        #X,Y,Z,full_info = rounding(x,y,z, gm_val, fixed_budget=fixed_budget)
-        X,Y,Z,full_info = rounding(x,y,z, 1, fixed_budget=fixed_budget)
-    else:
-        gm_val=-1 # placeholder
-        X,Y,Z,full_info = rounding(x,y,z, no_groups, fixed_budget=fixed_budget)
-    r = m.runtime
-    print("Optimizer runtime: "+str(r))
-    w = m.work
-    print("Optimizer work time: "+str(w))
-    m.dispose()
+class GroupLP:
+    """The LP for a set of intervention times. It is built once, for the
+    earliest intervention time. A later intervention time tau only fixes more
+    y variables to 1 (lower bound 1 for nodes before tau) and deactivates
+    their y + x[g] <= 1 rows (right-hand side 2); the budget only enters the
+    right-hand side of the budget constraint. Re-solves after changing
+    either start from the previous basis (dual simplex), so the optimal
+    solution the solver ends on can depend on the budgets and intervention
+    times solved before. With canonical, the reported solution is chosen
+    among the optimal ones by canonicalSolve instead (one more solve per
+    instance, whose runtime and work are kept in canonical_runtime and
+    canonical_work, not in those of the instance).
+
+    With reduce, the LP is reduced for a single intervention time (see
+    addReducedCascade). With screen, x of groups that cannot improve the
+    objective at the current intervention time is fixed to 0 (see
+    screenGroups).
+
+    With generate (a number of scenarios), the LP starts from the generate
+    scenarios with the most simulations; every other scenario s only enters
+    through a variable theta_s >= (cuts) that underestimates its value. After
+    each solve, the scenarios are evaluated exactly at x (see
+    lp_decomposition.ScenarioBlock). A scenario whose theta is below its value
+    gets a cut; if it already has one, it is added to the LP instead (at most
+    generate per round, largest difference first). This stops when no theta
+    is below its value, and the optimal value is then that of the full LP."""
+
+    def __init__(self, dag, int_times, names=False, reduce=False, scenarios=None, screen=False,
+                 generate=None, backend='gurobi', method=None, canonical=False, threads=None, verbose=False):
+        # dag: CascadeDAG of the simulations (with groups); scenarios: see
+        # cascadeScenarios (computed if not given); method: LP method of the
+        # first solve (see lp_backends; default: barrier with one thread,
+        # else concurrent); threads: solver threads (default: SLURM_NTASKS);
+        # verbose: print every simulation, group and x.
+        # timer: wall time of the build, set_int_time, solve and rounding
+        # phases (see Timer)
+        self.dag = dag
+        self.verbose = verbose
+        self.timer = Timer()
+        self.reduce = reduce
+        self.screen = screen
+        self.screening = None
+        self.generate = generate
+        self.canonical = canonical
+        self.canonical_runtime = self.canonical_work = 0.0
+        if reduce and len(set(int_times)) > 1:
+            raise ValueError("A reduced LP is built for a single intervention time.")
+        self.min_int_time = int_time = min(int_times)
+        if threads is None:
+            threads = int(os.environ['SLURM_NTASKS']) # number of threads specified in generate_pipelines
+        self.m = m = makeBackend(backend, 'Group-Interventions-ILP', threads)
+        # x[g]: whether group g is intervened or not. Between 0 and 1; represents probability of intervention
+        # y[u,i,j]: whether node u of the time-expanded graph is infected at time i in simulation j
+        # z[u,j]: whether node u is infected in simulation j at some (any) timestep
+        self.lp = lp = LPBuilder(names=names)
+        
+        #m.Params.Method = 1 if sim_id < 299 else -1 # dual simplex; else automatic
+        #m.Params.Threads = 1 if sim_id < 99 else 2 if sim_id < 199 else 3 if sim_id < 299 else 0
+        m.set_method(method or ('barrier' if threads==1 else 'concurrent'))
+             
+        # identical cascades are added once, weighted by their number
+        if scenarios is None:
+            scenarios = cascadeScenarios(dag)
+        self.scenarios = scenarios
+        index, weight = scenarios
+        self.M = M = float(dag.number_of_simulations) # M: total number of simulations       
+        if generate:
+            # x of all groups, in order of first appearance
+            from lp_decomposition import ScenarioBlock
+            graphs = [cascadeGraph(dag.cascade(i, exclude=("EtoE",)), verbose=False) for i in index.tolist()]
+            groups = pd.unique(np.concatenate([g.cell_group for g in graphs if g is not None]
+                                              or [np.zeros(0, dtype=np.int64)]))
+            lp.x.update(zip(groups.tolist(), range(len(groups))))
+            lp.add_cols(np.arange(len(groups)), [f"x[{g}]" for g in groups.tolist()] if names else None)
+            self.block = ScenarioBlock(graphs, weight, np.sort(groups))
+            self.block_x = np.array([lp.x[g] for g in self.block.groups.tolist()], dtype=np.int64)
+            self.included = np.zeros(len(index), dtype=bool)
+            self.included[np.argsort(-weight, kind='stable')[:generate]] = True
+            n_cells = np.array([0 if g is None else len(g.cell_first) for g in graphs])
+            no_action = (weight*n_cells).sum()
+        else:
+            self.included = np.ones(len(index), dtype=bool)
+        self.int_time = int_time
+        with self.timer('cascades'):
+            added = self.add_scenarios(np.flatnonzero(self.included))
+        if not generate:
+            no_action = added
+        
+        no_action = no_action/M
+        print("No Action: avg. # nodes infected "+str(no_action))
+        unique_groups = set(lp.x)
+        if verbose:
+            print("Unique groups "+str(unique_groups))
+        #budget constraint (right-hand side set by solve) & group -1 cannot be intervened
+        self.budget_row = lp.num_rows
+        x_cols = np.array(list(lp.x.values()), dtype=np.int64)
+        lp.add_rows(np.array([self.budget_row]), x_cols[None, :], np.ones((1, len(x_cols))), '<',
+                    np.zeros(1), ["C4: budget constraint"])
+        if -1 in unique_groups:
+            lp.add_rows(np.array([lp.num_rows]), np.array([[lp.x[-1]]]), np.ones((1, 1)), '=',
+                        np.zeros(1), ["C5: group -1 cannot be intervened"])
+        if generate:
+            # theta of the scenarios (lower bounds set by set_int_time)
+            self.theta_cols = lp.num_cols + np.arange(len(index))
+            lp.add_cols(self.theta_cols, [f"theta[{i}]" for i in index.tolist()] if names else None,
+                        ub=np.where(self.included, 0, weight*n_cells))
+        obj = np.zeros(lp.num_cols)
+        self.update_z()
+        obj[self.z_cols[self.z_var]] = self.z_weight[self.z_var]/M
+        if generate:
+            obj[self.theta_cols] = (~self.included)/M
+        if screen and reduce:
+            self.screening = screenGroups(dag, int_time, scenarios)
+            self.screening_time = int_time
+            lp.x_zero.update(g for g in self.screening.group[~self.screening.candidate].tolist() if g in lp.x)
+        self.row_index = np.zeros(0, dtype=np.int64) # row of m of each LP builder row
+        self.load(obj)
+        print("LP (rows, columns) "+str(lp.num_rows)+","+str(lp.num_cols))
+        self.cuts, self.generation_time, self.block_zero = [], None, set()
+        self.set_int_time(int_time)
+        self.no_groups = len(unique_groups)-1 if -1 in unique_groups else len(unique_groups)
+        self.solves = 0
+
+    def add_scenarios(self, scenarios):
+        """Adds scenarios (positions in self.scenarios) to the LP builder,
+        for the intervention time the LP is built for. Returns the weighted
+        number of their infected cells."""
+        index, weight = self.scenarios
+        no_action = 0.0
+        for s in scenarios.tolist():
+            # index corresponds to current sim id
+            if self.verbose:
+                print("Simulation: "+str(index[s]))
+            cascade = self.dag.cascade(index[s], exclude=("EtoE",))
+            no_action += weight[s]*(addReducedCascade if self.reduce else addCascade)(
+                self.lp, cascade, self.min_int_time, weight[s], self.verbose)
+        return no_action
+
+    def update_z(self):
+        # z of all cells of all simulations in the LP: columns, or constants (-1)
+        lp = self.lp
+        self.z_cols = np.concatenate(lp.z) if lp.z else np.zeros(0, dtype=np.int64)
+        self.z_const = np.concatenate(lp.z_const) if lp.z else np.zeros(0)
+        self.z_weight = np.concatenate(lp.z_weight) if lp.z else np.zeros(0, dtype=np.int64)
+        self.z_var = self.z_cols >= 0
+
+    def load(self, obj):
+        """Adds the new columns (objective obj) and rows of the LP builder to
+        the model."""
+        lp = self.lp
+        self.row_index = np.concatenate([self.row_index, lp.load(self.m, obj, self.timer)])
+        with self.timer('update'):
+            self.m.update()
+        self.m.set_obj_constant((self.z_const*self.z_weight)[~self.z_var].sum()/self.M)
+        self.x_cols = np.array(list(lp.x.values()), dtype=np.int64)
+        if self.canonical and len(self.x_cols) != len(getattr(self, 'x_weights', [])):
+            self.x_weights = tieWeights(list(lp.x))
+        if not self.reduce:
+            self.y_time = np.concatenate(lp.y_time)
+            self.y_cols = np.concatenate(lp.y)
+            self.vaccinated_time = np.concatenate(lp.vaccinated_time)
+            self.vaccinated = self.row_index[np.concatenate(lp.vaccinated)]
+
+    def set_bounds(self):
+        # y fixed to 1 and y + x[g] <= 1 inactive before the intervention time
+        self.m.set_bounds(self.y_cols, lb=(self.y_time < self.int_time).astype(float))
+        self.m.set_rhs(self.vaccinated, np.where(self.vaccinated_time < self.int_time, 2.0, 1.0))
+
+    def set_int_time(self, int_time):
+        with self.timer('set_int_time'):
+            self._set_int_time(int_time)
+
+    def _set_int_time(self, int_time):
+        if self.reduce:
+            if int_time != self.int_time:
+                raise ValueError(f"The reduced LP was built for intervention time {self.int_time}.")
+        else:
+            if int_time < self.min_int_time:
+                raise ValueError(f"The LP was built for intervention times >= {self.min_int_time}.")
+            self.int_time = int_time
+            self.set_bounds()
+            if self.screen and (self.screening is None or self.screening_time != int_time):
+                self.screening = screenGroups(self.dag, int_time, self.scenarios)
+                self.screening_time = int_time
+        if self.generate and self.generation_time != int_time:
+            # cuts are only valid for one intervention time
+            self.m.remove_rows(self.cuts)
+            self.cuts = []
+            self.has_cut = np.zeros(len(self.included), dtype=bool)
+            zero, _ = self.block.set_int_time(int_time)
+            self.generation_time = int_time
+            self.block_zero = set(self.block.groups[zero].tolist())
+            self.m.set_bounds(self.theta_cols, lb=np.where(self.included, 0.0, self.block.fixed_cells()))
+        if self.screen or self.generate:
+            zero = set(self.lp.x_zero) | self.block_zero
+            if self.screening is not None:
+                zero.update(self.screening.group[~self.screening.candidate].tolist())
+            self.m.set_bounds(self.x_cols, ub=[0.0 if g in zero else 1.0 for g in self.lp.x])
+
+    def generate_scenarios(self, values):
+        """Evaluates the scenarios that are not in the LP at its solution
+        (values of all columns), adds cuts and scenarios. Returns False if
+        none was needed."""
+        lp, index = self.lp, self.scenarios[0]
+        x = values[self.block_x]
+        f, G = self.block.evaluate(x, by_scenario=True)
+        gap = np.where(self.included, 0.0, f - values[self.theta_cols])
+        violated = np.flatnonzero(gap > 1e-6*np.maximum(1.0, f))
+        if len(violated) == 0:
+            return False
+        # scenarios that are still above their cuts enter the LP (those with
+        # the largest differences first); the others get a cut
+        again = violated[self.has_cut[violated]]
+        add = again[np.argsort(-gap[again], kind='stable')[:self.generate]]
+        cut = np.setdiff1d(violated, add)
+        self.has_cut[cut] = True
+        # theta_s - G_s x >= f_s(x) - G_s x
+        rows = np.repeat(np.arange(len(cut)), len(x)+1)
+        cols = np.concatenate([self.theta_cols[cut][:, None],
+                               np.tile(self.block_x, (len(cut), 1))], axis=1).ravel()
+        vals = np.concatenate([np.ones((len(cut), 1)), -G[cut]], axis=1).ravel()
+        A = sp.csr_matrix((vals, (rows, cols)), shape=(len(cut), lp.num_cols))
+        A.eliminate_zeros()
+        self.cuts += self.m.add_rows(A, '>', f[cut] - G[cut] @ x).tolist()
+        z_blocks, loaded = len(lp.z), lp.num_cols
+        self.add_scenarios(add)
+        self.included[add] = True
+        self.m.set_obj(self.theta_cols[add], 0.0)
+        self.update_z()
+        obj = np.zeros(lp.num_cols - loaded)
+        for z_col, z_weight in zip(lp.z[z_blocks:], lp.z_weight[z_blocks:]):
+            obj[z_col[z_col >= 0] - loaded] = z_weight[z_col >= 0]/self.M
+        self.load(obj)
+        if not self.reduce:
+            self.set_bounds()
+        print(f"Scenario generation: {len(add)} scenarios added, {len(cut)} cuts; "
+              f"{self.included.sum()} of {len(index)} scenarios in the LP, {len(self.cuts)} cuts")
+        return True
+
+    def solve(self, budget_groups, gm_val=-1, fixed_budget=None, replay=None):
+        # gm_val: -1 if GM is not used for rounding; replay: see rounding
+        m, lp = self.m, self.lp
+        m.set_rhs(self.row_index[[self.budget_row]], budget_groups)
+        runtime = work = 0.0
+        self.canonical_runtime = self.canonical_work = 0.0
+        while True:
+            if self.solves > 0:
+                # bounds and right-hand sides changed (or rows were added):
+                # the previous basis stays dual feasible
+                m.set_method('dual')
+            with self.timer('solve'):
+                m.solve()
+            self.solves += 1
+            runtime += m.runtime
+            work += m.work
+            LP_objValue = m.objective
+            values = m.values()
+            if self.generate:
+                with self.timer('generation'):
+                    if self.generate_scenarios(values):
+                        continue
+            if not self.canonical:
+                break
+            # the optimal solution does not depend on the earlier solves
+            with self.timer('canonical'):
+                values, r, w = canonicalSolve(m, self.x_cols, self.x_weights)
+            self.canonical_runtime += r
+            self.canonical_work += w
+            if not self.generate:
+                break
+            # the scenarios must also be exact at the x of the canonical solution
+            with self.timer('generation'):
+                if not self.generate_scenarios(values):
+                    break
+        x = {g: values[c] for g, c in lp.x.items()}
+        if self.verbose:
+            for key in x.keys():
+                print(key, x[key])
+        print("Re-done budget")
+        lp_budget = 0.0
+        for key, val in x.items():
+            lp_budget += val
+        print("budget used by LP "+str(lp_budget))
+        no_groups = self.no_groups
+        print("# groups: " + str(no_groups))
+        z = self.z_const.copy()
+        z[self.z_var] = values[self.z_cols[self.z_var]]
+        z = np.repeat(z, self.z_weight) # one entry per cell and simulation
+        if self.generate:
+            # the other scenarios at x
+            z = np.concatenate([z, self.block.cells(values[self.block_x], np.flatnonzero(~self.included))])
+        ranking = None if self.screening is None else \
+            dict(zip(self.screening.group.tolist(), self.screening.reachable_cells.tolist()))
+        tolerance = ROUNDING_TOLERANCE if self.canonical else 0.0
+        with self.timer('rounding'):
+            if gm_val != -1:
+                # use gm to round instead
+                #X,Y,Z,full_info = rounding(x,z, gm_val, fixed_budget=fixed_budget)
+                X,Y,Z,full_info = rounding(x,z, 1, fixed_budget=fixed_budget, ranking=ranking, replay=replay,
+                                           verbose=self.verbose, tolerance=tolerance)
+            else:
+                X,Y,Z,full_info = rounding(x,z, no_groups, fixed_budget=fixed_budget, ranking=ranking, replay=replay,
+                                           verbose=self.verbose, tolerance=tolerance)
+        r = runtime
+        print("Optimizer runtime: "+str(r))
+        w = work
+        print("Optimizer work time: "+str(w))
+        return X,Y,Z, no_groups, LP_objValue, self.M, lp_budget, self.dag.last_sim_id, gm_val, r, w, full_info
+
+    def dispose(self):
+        self.m.dispose()
+
+def prepareLP_group(dag, budget_groups, int_time, l, gm_val=-1, runtime=True, fixed_budget=None,
+                    names=False, reduce=False, screen=False, generate=None, backend='gurobi', method=None):
+    # single instance: builds, solves and disposes of the LP
+    glp = GroupLP(dag, [int_time], names=names, reduce=reduce, screen=screen, generate=generate,
+                  backend=backend, method=method)
+    out = glp.solve(budget_groups, gm_val=gm_val, fixed_budget=fixed_budget)
+    glp.dispose()
     if runtime:
-        return X,Y,Z, no_groups, LP_objValue, M, lp_budget, sim_id, gm_val, r, w, full_info # output runtime if specified
+        return out # output runtime if specified
     else:
-        return X,Y,Z, no_groups, LP_objValue, M, lp_budget, sim_id, gm_val # added: max sim_id, gm_val, runtime, work
+        return out[:9] # added: max sim_id, gm_val, runtime, work
 
 def outputGenerator(X,Y,Z,no_groups,LP_objValue, M, int_time, budget_given, inputcode, outpath, full_info=None):
     
@@ -287,11 +912,7 @@ def outputGenerator(X,Y,Z,no_groups,LP_objValue, M, int_time, budget_given, inpu
            budget_used += 1
            fq.write(str(key)+","+str(int_time)+"\n")
     fq.close()
-    algo_value = 0
-    for key in Z.keys():
-        if Z[key] == 1:
-           algo_value += 1
-    algo_value = algo_value/M # algorithmic obj value: average number of infected nodes across all simulations
+    algo_value = int((Z == 1).sum())/M # algorithmic obj value: average number of infected nodes across all simulations
     print("Algorithm objective value "+str(algo_value))
 
     if full_info is not None:
@@ -300,7 +921,20 @@ def outputGenerator(X,Y,Z,no_groups,LP_objValue, M, int_time, budget_given, inpu
         full_info[full_info.group!=-1].to_csv(filename, index=False)
     return budget_used, algo_value, filename
 
-if __name__ == "__main__":
+def writeMetrics(filename, metrics):
+    """Writes the metrics of an instance (json), with the peak memory of the
+    process: setup (read once per run), build (the model used, once per
+    model), set_int_time (once per intervention time) and instance phases
+    are wall times in seconds; lp: size of the model after the solve, solver
+    runtime and work (and those of the canonical solve, see --canonical)."""
+    metrics['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kB on Linux
+    with open(filename, 'w') as f:
+        json.dump(metrics, f, indent=1)
+
+def main(argv=None, hierarchies=None):
+    """Runs the algorithm for the command line arguments argv (default:
+    sys.argv). hierarchies: optional dictionary path -> MultiScaleNet of the
+    hierarchies read so far, kept across calls (see lp_worker.py)."""
     parser=argparse.ArgumentParser(description=DESC,formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("input_file", help="Input DAG file to run simulation on")
     parser.add_argument("hierarchy_file", help="Input Hierarchy file of network")
@@ -316,22 +950,36 @@ if __name__ == "__main__":
     parser.add_argument("--input_code", help="Add a prefix to each output file", default="")
     parser.add_argument("--no_gm", action='store_true', help="Round results using number of groups instead of GM")
     parser.add_argument("--fixed_budget", action='store_true', help="Specify to force algorithm to intervene with a fixed budget instead of rounding")
-    args = parser.parse_args()
-
-    # read hierarchy file for group mapping, line by line
-    group = {}
-    fq = open(args.hierarchy_file,'r')
-    next(fq) # discard header
-    # for line in lines:
-    for line in fq: # can iterate through file directly
-        cols = line.strip().split(",")
-        g = cols[0]
-        node = cols[1]
-        group[node] = int(g)
-    fq.close()
-    print("Groups:")
-    print(group)
-    
+    parser.add_argument("--lp_names", action='store_true', help="Name the LP variables and constraints (slower; for debugging or writing the model)")
+    parser.add_argument("--reduce", action='store_true', help="Reduce the LP (fixed, unreachable and chained nodes, dominated constraints) for each intervention time; same optimal value, much smaller for many simulations")
+    parser.add_argument("--screen", action='store_true', help="Fix x to 0 for groups that cannot improve the objective at the intervention time (see screenGroups); their screening counts also break ties with --fixed_budget")
+    parser.add_argument("--screening_path", help="Write the screening counts of each intervention time to this directory (implies --screen)")
+    parser.add_argument("--method", choices=['lp', 'greedy'], default='lp', help="lp: LP and rounding; greedy: lazy-greedy group selection (see group_greedy.py)")
+    parser.add_argument("--greedy_start", action='store_true', help="With --decompose: start each solve from the greedy selection")
+    parser.add_argument("--solver", choices=BACKENDS, default='gurobi', help="LP solver (see lp_backends.py); highs needs no license")
+    parser.add_argument("--lp_method", choices=['auto', 'dual', 'barrier', 'concurrent'], default='auto', help="LP method of the first solve; auto: barrier with one thread (--threads), else concurrent (see lp_autotune.py)")
+    parser.add_argument("--threads", type=int, help="Solver threads (default: SLURM_NTASKS); pipe_int.sbatch passes those of its job, also when the task is run by an lp_worker.py worker with its own allocation")
+    parser.add_argument("--generate", type=int, help="Scenario generation: start the LP from this many scenarios and add at most this many per round (see GroupLP)")
+    parser.add_argument("--canonical", action='store_true', help="Report the optimal LP solution chosen by canonicalSolve, which does not depend on the budgets and intervention times solved before or on --reduce, --screen, --generate and --decompose (one more solve per instance; its time is not in lp_runtime)")
+    parser.add_argument("--replay", action='store_true', help="Objective value (obj_value) of the rounded groups by replaying the cascades (see dag_replay.py) instead of from the rounded z")
+    parser.add_argument("-v", "--verbose", action='store_true', help="Print the groups, every simulation and the LP value of every group (with --decompose: also the bounds of every iteration)")
+    parser.add_argument("--cache_path", help="Cache the results of each budget/intervention time in this directory and reuse them when the DAG, hierarchy and options are unchanged (see solve_cache.py)")
+    parser.add_argument("--decompose", action='store_true', help="Solve the LP by scenario decomposition (see lp_decomposition.py); worker processes keep blocks of simulations")
+    parser.add_argument("--block_size", type=int, help="With --decompose: simulations per block (default: an equal share per process)")
+    parser.add_argument("--processes", type=int, help="With --decompose: number of worker processes (default: --threads)")
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="With --decompose: relative optimality gap")
+    args = parser.parse_args(argv)
+    if args.screening_path is not None:
+        args.screen = True
+    if args.decompose and (args.reduce or args.screen or args.lp_names or args.generate):
+        parser.error("--decompose cannot be combined with --reduce, --screen, --lp_names or --generate")
+    if args.method == 'greedy' and (args.decompose or args.reduce or args.screen or args.lp_names or args.generate):
+        parser.error("--method greedy cannot be combined with LP options")
+    if args.greedy_start and not args.decompose:
+        parser.error("--greedy_start requires --decompose")
+    if args.replay and args.decompose:
+        parser.error("--replay cannot be combined with --decompose")
+
     header_file = f"{args.summary_path}/0header.csv" # file containing headers
     # one file per budget/int_time instance
     if not os.path.isfile(header_file):    
@@ -339,19 +987,160 @@ if __name__ == "__main__":
             f.write("input_code,num_sims,budget,delay,budget_used,lp_budget,obj_value,lp_obj_value,gm_value,lp_runtime,lp_work,input_file,int_filename\n")
     # separate header file helps avoid race conditions.
     
+    # instances with a cached result are written without solving
+    solved = [(int_time, budget) for int_time in args.intervention_times for budget in args.budgets]
+    if args.cache_path is not None:
+        from solve_cache import SolveCache
+        cache = SolveCache(args.cache_path, args.input_file, args.hierarchy_file,
+                           {a: getattr(args, a) for a in CACHE_OPTIONS})
+        for int_time, budget in list(solved):
+            entry = cache.get(budget, int_time)
+            if entry is None:
+                continue
+            folder, fields = entry
+            if args.screening_path is not None and fields['screening_file'] is None:
+                continue # cached without its screening counts: solved again
+            os.makedirs(f"{args.intervention_path}/{args.input_code}", exist_ok=True)
+            for filename in fields['files']:
+                if filename == fields['screening_file']:
+                    if args.screening_path is not None:
+                        shutil.copy(os.path.join(folder, filename),
+                                    f"{args.screening_path}/{args.input_code}_I{int_time}_screening.csv")
+                else:
+                    shutil.copy(os.path.join(folder, filename), f"{args.intervention_path}/{args.input_code}")
+            # the metrics of the original solve
+            with open(f"{args.summary_path}/{args.input_code}_I{int_time}B{budget}_metrics.json", 'w') as f:
+                json.dump({**fields['metrics'], 'input_code': args.input_code, 'cached': True}, f, indent=1)
+            int_filename = f"{args.intervention_path}/{args.input_code}/{fields['int_filename']}"
+            output = ",".join([args.input_code, fields['num_sims'], str(budget), str(int_time)] +
+                              [fields[c] for c in SUMMARY_FIELDS] + [args.input_file, int_filename]) + "\n"
+            summary_file = f"{args.summary_path}/{args.input_code}_I{int_time}B{budget}_{args.out_filename}"
+            with open(summary_file, "w") as fp:
+                 fp.write(output)
+            print(f"budget, int_time: {budget},{int_time} cached")
+            solved.remove((int_time, budget))
+        if not solved:
+            return
+
+    # wall times of the phases shared by all instances (see writeMetrics)
+    setup = Timer()
+    # group mapping from the hierarchy file
+    with setup('hierarchy'):
+        hierarchy = None if hierarchies is None else hierarchies.get(os.path.realpath(args.hierarchy_file))
+        if hierarchy is None:
+            hierarchy = msc.MultiScaleNet()
+            hierarchy.read_hierarchy(args.hierarchy_file)
+            if hierarchies is not None:
+                hierarchies[os.path.realpath(args.hierarchy_file)] = hierarchy
+        group = hierarchy.group_map()
+    if args.verbose:
+        print("Groups:")
+        print(group)
+
+    build = {}
+    replay = None
+    if args.decompose:
+        # the workers read the DAG in blocks; one master per int_time
+        from lp_decomposition import BendersLP
+        with setup('build'):
+            glp = BendersLP(args.input_file, group, tree=None if args.no_gm else hierarchy.hierarchy,
+                            block_size=args.block_size,
+                            processes=args.processes or args.threads or int(os.environ.get('SLURM_NTASKS', 1)),
+                            tolerance=args.tolerance, backend=args.solver, greedy_start=args.greedy_start,
+                            canonical=args.canonical, verbose=args.verbose)
+        print("Simulations: "+str(int(glp.M)))
+        gm_val = glp.gm_val
+    else:
+        # the DAG is read once and shared by all budget/int_time instances
+        with setup('read_dag'):
+            dag = CascadeDAG(args.input_file, group)
+        print("Simulations: "+str(dag.number_of_simulations))
+        with setup('gm'):
+            gm_val = -1 if args.no_gm else gm(dag.to_frame(), hierarchy.hierarchy) # -1: placeholder
+        with setup('scenarios'):
+            scenarios = cascadeScenarios(dag)
+        glp = None
+        if args.replay:
+            from dag_replay import ReplayEvaluator
+            with setup('replay'):
+                replay = ReplayEvaluator(dag, scenarios)
+        if args.method == 'greedy':
+            from group_greedy import GroupGreedy
+            with setup('build'):
+                glp = GroupGreedy(dag, scenarios, verbose=args.verbose)
+    if not args.no_gm:
+        print("GM value: "+str(gm_val))
+    
     # we write headers ahead of time. the delay below should be long enough so as to not overwrite anything
-    for budget, int_time in product(args.budgets, args.intervention_times):
-        print("budget, int_time: "+str(budget)+","+str(int_time))
-        # output string for summary
-        X,Y,Z, no_groups, LP_objValue, M, lp_budget, max_sim, gm_val, runtime, work, full_info = prepareLP_group(args.input_file, budget, int_time,0, group, 
-        args.hierarchy_file, use_gm=(not args.no_gm), fixed_budget=(budget if args.fixed_budget else None))
-        budget_used, algo_value, int_filename = outputGenerator(X,Y,Z,no_groups,LP_objValue, M, int_time, budget, args.input_code,  outpath=args.intervention_path, full_info=full_info)
-        #budget_given is used as name for lp_budget due to change in notion
-        
-        output = f"{args.input_code},{max_sim+1},{budget},{int_time},{budget_used},{lp_budget},{algo_value},{LP_objValue},{gm_val},{runtime},{work},{args.input_file},{int_filename}\n"
-        summary_file = f"{args.summary_path}/{args.input_code}_I{int_time}B{budget}_{args.out_filename}"
-        with open(summary_file, "w") as fp:
-             fp.write(output)
-        del X,Y,Z,no_groups,LP_objValue,M,lp_budget,max_sim,budget_used,algo_value,int_filename # free up memory
-        print()
-  
+    # one model, re-solved for each int_time and budget (with --reduce, one
+    # model per int_time)
+    for int_time in args.intervention_times:
+        budgets = [budget for budget in args.budgets if (int_time, budget) in solved]
+        if not budgets:
+            continue
+        if args.method == 'lp' and not args.decompose and (glp is None or args.reduce):
+            if glp is not None:
+                glp.dispose()
+            start = time.perf_counter()
+            glp = GroupLP(dag, [int_time] if args.reduce else args.intervention_times,
+                          names=args.lp_names, reduce=args.reduce, scenarios=scenarios, screen=args.screen,
+                          generate=args.generate, backend=args.solver,
+                          method=None if args.lp_method == 'auto' else args.lp_method, canonical=args.canonical,
+                          threads=args.threads, verbose=args.verbose)
+            build = {**glp.timer.times, 'total': time.perf_counter()-start}
+        start = time.perf_counter()
+        glp.set_int_time(int_time)
+        if replay is not None:
+            replay.set_int_time(int_time)
+        set_int_time = time.perf_counter()-start
+        if args.screening_path is not None:
+            screening_file = f"{args.screening_path}/{args.input_code}_I{int_time}_screening.csv"
+            glp.screening.to_csv(screening_file, index=False)
+            print(screening_file)
+        for budget in budgets:
+            print("budget, int_time: "+str(budget)+","+str(int_time))
+            instance = Timer()
+            before = dict(getattr(glp, 'timer', Timer()).times)
+            # output string for summary
+            with instance('solve_total'):
+                X,Y,Z, no_groups, LP_objValue, M, lp_budget, max_sim, gm_val, runtime, work, full_info = glp.solve(budget,
+                gm_val=gm_val, fixed_budget=(budget if args.fixed_budget else None), replay=replay)
+            with instance('output'):
+                budget_used, algo_value, int_filename = outputGenerator(X,Y,Z,no_groups,LP_objValue, M, int_time, budget, args.input_code,  outpath=args.intervention_path, full_info=full_info)
+            #budget_given is used as name for lp_budget due to change in notion
+            
+            output = f"{args.input_code},{max_sim+1},{budget},{int_time},{budget_used},{lp_budget},{algo_value},{LP_objValue},{gm_val},{runtime},{work},{args.input_file},{int_filename}\n"
+            summary_file = f"{args.summary_path}/{args.input_code}_I{int_time}B{budget}_{args.out_filename}"
+            with open(summary_file, "w") as fp:
+                 fp.write(output)
+            # phases of the LP during this instance (solve, rounding, ...)
+            after = getattr(glp, 'timer', Timer()).times
+            instance.times.update({k: v-before.get(k, 0.0) for k, v in after.items() if v != before.get(k, 0.0)})
+            m = getattr(glp, 'm', None)
+            metrics = {
+                'input_code': args.input_code, 'num_sims': int(max_sim)+1, 'budget': budget, 'delay': int_time,
+                'method': args.method, 'solver': args.solver, 'decompose': args.decompose, 'generate': args.generate,
+                'threads': args.threads or int(os.environ.get('SLURM_NTASKS', 1)), 'setup': setup.times, 'build': build,
+                'set_int_time': set_int_time, 'instance': instance.times,
+                'lp': None if m is None else dict(zip(['rows', 'columns', 'nonzeros'], m.size()),
+                    solves=getattr(glp, 'solves', None), runtime=float(runtime), work=float(work),
+                    canonical_runtime=float(getattr(glp, 'canonical_runtime', 0.0)),
+                    canonical_work=float(getattr(glp, 'canonical_work', 0.0)))}
+            writeMetrics(f"{args.summary_path}/{args.input_code}_I{int_time}B{budget}_metrics.json", metrics)
+            if args.cache_path is not None:
+                fields = {'num_sims': str(max_sim+1), **dict(zip(SUMMARY_FIELDS, map(str,
+                          [budget_used, lp_budget, algo_value, LP_objValue, gm_val, runtime, work])))}
+                files = [f"{args.intervention_path}/{args.input_code}/I{int_time}-B{budget}.csv"]
+                if int_filename not in files:
+                    files.append(int_filename)
+                if args.screening_path is not None:
+                    files.append(screening_file)
+                cache.put(budget, int_time, {**fields, 'int_filename': os.path.basename(int_filename),
+                          'metrics': metrics, 'screening_file': None if args.screening_path is None
+                          else os.path.basename(screening_file)}, files)
+            del X,Y,Z,no_groups,LP_objValue,M,lp_budget,max_sim,budget_used,algo_value,int_filename # free up memory
+            print()
+    glp.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+DESC='''Benchmark suite for the intervention LP (algorithm_groupint_general_v2.py).
+
+Simulates fixed-seed DAGs (run_spread_v2.py --dag_type 1, the configs of
+benchmark_simulator.py) on the shipped networks for several numbers of
+simulations, or reuses the DAGs already in --dagpath, and runs the algorithm
+on each of them for several intervention times. Each (network, number of
+simulations, intervention time) is a separate process, so the peak memory is
+that of one LP. Build time (reading the hierarchy and DAG and building the
+LP), solve time, LP size (rows, columns, nonzeros), solver work, peak memory
+and the objective values are written to a results csv file; the times and
+sizes are read from the metrics files the algorithm writes next to its
+summaries.
+
+With --baseline, the results are compared with a stored results file: runs
+that are slower, use more memory or build larger models than the baseline
+(by more than --tolerance), and runs whose LP or rounded objective value
+differs from the baseline (by more than --obj_tolerance, relative) are
+flagged. The exit code is 1 if any is found. To check a new builder or
+backend, run with its options (e.g. --solver highs, or algorithm options
+after --) and the results of the default run as baseline.
+
+Run from the scripts directory, like the other pipeline scripts.
+
+Examples:
+python benchmark_lp.py -n BD -s 1 10 50 -o ../work/benchmarks/lp_results.csv
+python benchmark_lp.py -n BD -s 1 10 50 --solver highs -o ../work/benchmarks/lp_highs.csv \\
+    -b ../work/benchmarks/lp_results.csv -- --reduce
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from time import time
+import pandas as pd
+from benchmark_simulator import benchmark_config, git_revision, run_once, BENCHPATH, HOMEPATH, NETWORKS
+
+SIMULATIONS=[1,10,50,100,250]
+INTERVENTION_TIMES=[3,6,12]
+BUDGETS=[3]
+
+# Columns compared against the baseline; larger is worse for all of them.
+METRICS=['build_time','solve_time','wall_time','peak_memory_mb','rows','columns','nonzeros']
+# Columns that must match the baseline (up to --obj_tolerance).
+OBJECTIVES=['lp_obj_value','obj_value']
+KEYS=['network','number_of_simulations','delay','budget']
+
+def benchmark_dag(network, sims, dagpath, time_steps=None, regenerate=False):
+    '''DAG file of the benchmark config of a network; simulated unless it is
+    already in dagpath.'''
+    config = benchmark_config(network, sims, time_steps)
+    dag_file = f"{dagpath}/{config['simulation_output_prefix']}_dag.csv"
+    if regenerate or not os.path.isfile(dag_file):
+        result = run_once(config, 1, dagpath, keep_dags=True)
+        if result['returncode'] != 0:
+            return None
+    return dag_file
+
+def run_lp(dag_file, network, delay, budgets, workpath, solver, method, extra_args=()):
+    '''Runs the algorithm on a DAG in a child process and measures it. One
+    row per budget.'''
+    input_code = os.path.basename(dag_file)[:-len('_dag.csv')]
+    summary_path = f'{workpath}/summaries'
+    intervention_path = f'{workpath}/interventions'
+    os.makedirs(summary_path, exist_ok=True)
+    os.makedirs(intervention_path, exist_ok=True)
+    command = [sys.executable, f'{HOMEPATH}/algorithm_groupint_general_v2.py', dag_file,
+            f'../input/networks/{network}/hierarchy.tree', '-b', *map(str, budgets), '-i', str(delay),
+            '--summary_path', summary_path, '--intervention_path', intervention_path,
+            '--input_code', input_code, '--solver', solver, '--method', method, *extra_args]
+    with open(f'{workpath}/{input_code}_I{delay}.log', 'w') as log:
+        start = time()
+        # one thread unless run in a job (as the LP jobs of generate_pipelines.py)
+        env = {**os.environ, 'SLURM_NTASKS': os.environ.get('SLURM_NTASKS', '1')}
+        proc = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+        # wait4 gives the resource usage of this child only
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall_time = time() - start
+    returncode = os.waitstatus_to_exitcode(status)
+
+    rows = []
+    for budget in budgets:
+        result = {
+            'returncode': returncode,
+            'wall_time': wall_time,
+            'peak_memory_mb': usage.ru_maxrss/1024, # kilobytes on Linux
+            'build_time': float('nan'),
+            'solve_time': float('nan'),
+            'rows': float('nan'),
+            'columns': float('nan'),
+            'nonzeros': float('nan'),
+            'lp_work': float('nan'),
+            'lp_obj_value': float('nan'),
+            'obj_value': float('nan')
+        }
+        metrics_file = f'{summary_path}/{input_code}_I{delay}B{budget}_metrics.json'
+        summary_file = f'{summary_path}/{input_code}_I{delay}B{budget}_summary.csv'
+        if returncode == 0 and os.path.isfile(metrics_file):
+            with open(metrics_file) as f:
+                metrics = json.load(f)
+            # the LP (or greedy/decomposition setup) is built once per process
+            result['build_time'] = sum(metrics['setup'].values()) + metrics['build'].get('total', 0.0) \
+                + metrics['set_int_time']
+            result['solve_time'] = metrics['instance']['solve_total']
+            if metrics['lp'] is not None:
+                result.update({k: metrics['lp'][k] for k in ['rows','columns','nonzeros']})
+                result['lp_work'] = metrics['lp']['work']
+            summary = pd.read_csv(summary_file, header=None,
+                    names=pd.read_csv(f'{summary_path}/0header.csv').columns)
+            result['lp_obj_value'] = summary.lp_obj_value.iloc[0]
+            result['obj_value'] = summary.obj_value.iloc[0]
+        rows.append({'budget': budget, **result})
+    return rows
+
+def run_benchmarks(networks, simulations, intervention_times, budgets, solver='gurobi', method='lp',
+                   extra_args=(), time_steps=None, workpath=BENCHPATH, dagpath=BENCHPATH, regenerate=False):
+    '''Runs every (network, number of simulations, intervention time)
+    combination.'''
+    os.makedirs(workpath, exist_ok=True)
+    os.makedirs(dagpath, exist_ok=True)
+    revision = git_revision()
+    rows = []
+    for network in networks:
+        for sims in simulations:
+            dag_file = benchmark_dag(network, sims, dagpath, time_steps, regenerate)
+            for delay in intervention_times:
+                if dag_file is None:
+                    results = [{'budget': b, 'returncode': -1} for b in budgets]
+                else:
+                    results = run_lp(dag_file, network, delay, budgets, workpath, solver, method, extra_args)
+                for result in results:
+                    row = {'network': network, 'number_of_simulations': sims, 'delay': delay,
+                           'solver': solver, 'method': method, 'options': ' '.join(extra_args),
+                           'revision': revision}
+                    row.update(result)
+                    print(', '.join(f'{k}={v}' for k,v in row.items()), flush=True)
+                    rows.append(row)
+    return pd.DataFrame(rows)
+
+def compare(results, baseline, tolerance=0.1, obj_tolerance=1e-6, min_time=0.5):
+    '''Compares results with a baseline results table. Returns one row per
+    (run, metric) with the relative change and a regression flag: metrics
+    that grow by more than tolerance, objective values that differ by more
+    than obj_tolerance (relative). Times below min_time seconds are too noisy
+    to flag.'''
+    df = results.merge(baseline, on=KEYS, suffixes=('','_baseline'))
+    out = []
+    for _, row in df.iterrows():
+        for metric in METRICS+OBJECTIVES:
+            new, old = row[metric], row[metric+'_baseline']
+            if pd.isna(new) or pd.isna(old):
+                continue
+            if metric in OBJECTIVES:
+                change = (new-old)/max(abs(old), 1.0)
+                regression = abs(change) > obj_tolerance
+            else:
+                if old == 0:
+                    continue
+                change = (new-old)/old
+                regression = change > tolerance
+                if metric.endswith('time') and max(new, old) < min_time:
+                    regression = False
+            out.append({**{k: row[k] for k in KEYS},
+                        'metric': metric, 'baseline': old, 'new': new,
+                        'change': change, 'regression': regression})
+    return pd.DataFrame(out, columns=KEYS+['metric','baseline','new','change','regression'])
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--networks', nargs='+', default=NETWORKS,
+            help='Networks to benchmark')
+    parser.add_argument('-s', '--simulations', nargs='+', type=int, default=SIMULATIONS,
+            help='Numbers of simulations')
+    parser.add_argument('-i', '--intervention_times', nargs='+', type=int, default=INTERVENTION_TIMES,
+            help='Intervention times')
+    parser.add_argument('--budgets', nargs='+', type=int, default=BUDGETS,
+            help='Budgets (solved in the same process)')
+    parser.add_argument('--solver', choices=['gurobi','highs'], default='gurobi',
+            help='LP solver passed to the algorithm')
+    parser.add_argument('--method', choices=['lp','greedy'], default='lp',
+            help='Selection method passed to the algorithm')
+    parser.add_argument('-t', '--time_steps', type=int,
+            help='Override the number of time steps in the simulator configs')
+    parser.add_argument('-o', '--results', default=f'{BENCHPATH}/lp_results.csv',
+            help='Results file (csv)')
+    parser.add_argument('-b', '--baseline',
+            help='Baseline results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+            help='Relative increase above which a metric is flagged')
+    parser.add_argument('--obj_tolerance', type=float, default=1e-6,
+            help='Relative difference above which an objective value is flagged')
+    parser.add_argument('--compare_only', action='store_true',
+            help='Do not run; compare an existing results file with the baseline')
+    parser.add_argument('--workpath', default=f'{BENCHPATH}/lp',
+            help='Directory for the summaries, interventions and logs of the algorithm')
+    parser.add_argument('--dagpath', default=f'{BENCHPATH}/dags',
+            help='Directory of the benchmark DAGs (reused if present)')
+    parser.add_argument('--regenerate', action='store_true',
+            help='Simulate the DAGs even if they are in --dagpath')
+    # further options of the algorithm follow --
+    argv = sys.argv[1:]
+    extra_args = argv[argv.index('--')+1:] if '--' in argv else []
+    args = parser.parse_args(argv[:argv.index('--')] if '--' in argv else argv)
+
+    if args.compare_only:
+        if args.baseline is None:
+            parser.error('--compare_only requires --baseline')
+        results = pd.read_csv(args.results)
+    else:
+        results = run_benchmarks(args.networks, args.simulations, args.intervention_times, args.budgets,
+                solver=args.solver, method=args.method, extra_args=extra_args, time_steps=args.time_steps,
+                workpath=args.workpath, dagpath=args.dagpath, regenerate=args.regenerate)
+        results.to_csv(args.results, index=False)
+        print(args.results)
+        if (results.returncode != 0).any():
+            print('Some runs failed:')
+            print(results[results.returncode != 0][KEYS].to_string(index=False))
+
+    if args.baseline is not None:
+        comparison = compare(results, pd.read_csv(args.baseline), args.tolerance, args.obj_tolerance)
+        print(comparison.to_string(index=False))
+        regressions = comparison[comparison.regression]
+        if len(regressions):
+            print(f'{len(regressions)} regression(s) beyond {args.tolerance:.0%} '
+                  f'(objective values: {args.obj_tolerance:g}):')
+            print(regressions.to_string(index=False))
+            sys.exit(1)
+        print('No regressions.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+DESC='''Benchmark suite for the simulator (run_spread_v2.py).
+
+Runs fixed-seed configs on the shipped networks, with and without the DAG
+output (--dag_type 1), for several numbers of simulations. Each run is a
+separate process; wall time, simulation time per replicate, peak memory and
+DAG file size are written to a results csv file.
+
+With --baseline, the results are compared with a stored results file and runs
+that are slower, use more memory or write larger DAGs than the baseline (by
+more than --tolerance) are flagged. The exit code is 1 if any regression is
+found, so that the comparison can be scripted.
+
+Run from the scripts directory, like the other pipeline scripts.
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from time import time
+import pandas as pd
+from create_batch_configs import generateConfigs
+# config file generator; make sure create_batch_configs.py is in the same folder
+
+HOMEPATH="../scripts"
+CONFIGFILEPATH="../input/config_files"
+BENCHPATH="../work/benchmarks"
+NETWORKS=['BD','VN','PH','TH','ID']
+SIMULATIONS=[1,10,50]
+DAG_TYPES=[0,1]
+
+# Columns compared against the baseline; larger is worse for all of them.
+METRICS=['wall_time','per_replicate_time','peak_memory_mb','dag_bytes']
+KEYS=['network','dag_type','number_of_simulations']
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'],
+                text=True, stderr=subprocess.DEVNULL).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return ''
+
+def benchmark_config(network, sims, time_steps=None):
+    '''Single-batch, fixed-seed simulator config for a network.'''
+    with open(f'{CONFIGFILEPATH}/{network.lower()}config.json') as f:
+        master_config = json.load(f)
+    master_config['batches'] = 1
+    master_config['prefix'] = f'bench_{network}_'
+    if time_steps is not None:
+        master_config['parameters']['simulation_parameters']['time_steps'] = time_steps
+    return generateConfigs(master_config, sims=sims)[0]
+
+def run_once(config, dag_type, workpath, keep_dags=False):
+    '''Runs the simulator in a child process and measures it.'''
+    prefix = config['simulation_output_prefix']
+    config_file = f'{workpath}/{prefix}.json'
+    timing_file = f'{workpath}/{prefix}_D{dag_type}_timing.json'
+    dag_file = f'{workpath}/{prefix}_dag.csv'
+    with open(config_file, 'w') as f:
+        json.dump(config, f)
+
+    command = [sys.executable, f'{HOMEPATH}/run_spread_v2.py', config_file,
+            '--dag_type', str(dag_type), '-p', workpath, '-o', workpath,
+            '--suppress_outfile', '-q', '--no_time', '--timing_out', timing_file]
+    start = time()
+    proc = subprocess.Popen(command)
+    # wait4 gives the resource usage of this child only
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall_time = time() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    result = {
+        'returncode': proc.returncode,
+        'wall_time': wall_time,
+        'peak_memory_mb': usage.ru_maxrss/1024, # kilobytes on Linux
+        'dag_bytes': 0,
+        'setup_time': float('nan'),
+        'simulation_time': float('nan'),
+        'per_replicate_time': float('nan')
+    }
+    if proc.returncode == 0:
+        with open(timing_file) as f:
+            timing = json.load(f)
+        result['setup_time'] = timing['setup']
+        result['simulation_time'] = timing['simulation']
+        result['per_replicate_time'] = timing['simulation']/timing['number_of_simulations']
+    if dag_type == 1 and os.path.isfile(dag_file):
+        result['dag_bytes'] = os.path.getsize(dag_file)
+        if not keep_dags:
+            os.remove(dag_file)
+    return result
+
+def run_benchmarks(networks, simulations, dag_types, repeats=1, time_steps=None,
+                   workpath=BENCHPATH, keep_dags=False):
+    '''Runs every (network, dag_type, number of simulations) combination.
+    With repeats>1, the fastest run is kept.'''
+    os.makedirs(workpath, exist_ok=True)
+    revision = git_revision()
+    rows = []
+    for network in networks:
+        for sims in simulations:
+            config = benchmark_config(network, sims, time_steps)
+            for dag_type in dag_types:
+                best = None
+                for _ in range(repeats):
+                    result = run_once(config, dag_type, workpath, keep_dags)
+                    if best is None or result['wall_time'] < best['wall_time']:
+                        best = result
+                row = {'network': network, 'dag_type': dag_type,
+                       'number_of_simulations': sims,
+                       'time_steps': config['simulation_parameters']['time_steps'],
+                       'revision': revision}
+                row.update(best)
+                print(', '.join(f'{k}={v}' for k,v in row.items()), flush=True)
+                rows.append(row)
+    return pd.DataFrame(rows)
+
+def compare(results, baseline, tolerance=0.1, min_time=0.5):
+    '''Compares results with a baseline results table. Returns one row per
+    (run, metric) with the relative change and a regression flag.
+    Times below min_time seconds are too noisy to flag.'''
+    df = results.merge(baseline, on=KEYS, suffixes=('','_baseline'))
+    out = []
+    for _, row in df.iterrows():
+        for metric in METRICS:
+            new, old = row[metric], row[metric+'_baseline']
+            if pd.isna(new) or pd.isna(old) or old == 0:
+                continue
+            change = (new-old)/old
+            regression = change > tolerance
+            if metric.endswith('time') and max(new, old) < min_time:
+                regression = False
+            out.append({**{k: row[k] for k in KEYS},
+                        'metric': metric, 'baseline': old, 'new': new,
+                        'change': change, 'regression': regression})
+    return pd.DataFrame(out, columns=KEYS+['metric','baseline','new','change','regression'])
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--networks', nargs='+', default=NETWORKS,
+            help='Networks to benchmark')
+    parser.add_argument('-s', '--simulations', nargs='+', type=int, default=SIMULATIONS,
+            help='Numbers of simulations')
+    parser.add_argument('-d', '--dag_types', nargs='+', type=int, default=DAG_TYPES,
+            help='DAG types passed to the simulator')
+    parser.add_argument('-r', '--repeats', type=int, default=1,
+            help='Repeat each run and keep the fastest')
+    parser.add_argument('-t', '--time_steps', type=int,
+            help='Override the number of time steps in the configs')
+    parser.add_argument('-o', '--results', default=f'{BENCHPATH}/simulator_results.csv',
+            help='Results file (csv)')
+    parser.add_argument('-b', '--baseline',
+            help='Baseline results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+            help='Relative increase above which a metric is flagged')
+    parser.add_argument('--compare_only', action='store_true',
+            help='Do not run; compare an existing results file with the baseline')
+    parser.add_argument('--workpath', default=BENCHPATH,
+            help='Directory for configs, timing files and DAGs')
+    parser.add_argument('--keep_dags', action='store_true',
+            help='Do not delete DAG files after measuring them')
+    args = parser.parse_args()
+
+    if args.compare_only:
+        if args.baseline is None:
+            parser.error('--compare_only requires --baseline')
+        results = pd.read_csv(args.results)
+    else:
+        results = run_benchmarks(args.networks, args.simulations, args.dag_types,
+                repeats=args.repeats, time_steps=args.time_steps,
+                workpath=args.workpath, keep_dags=args.keep_dags)
+        results.to_csv(args.results, index=False)
+        print(args.results)
+        if (results.returncode != 0).any():
+            print('Some runs failed:')
+            print(results[results.returncode != 0][KEYS].to_string(index=False))
+
+    if args.baseline is not None:
+        comparison = compare(results, pd.read_csv(args.baseline), args.tolerance)
+        print(comparison.to_string(index=False))
+        regressions = comparison[comparison.regression]
+        if len(regressions):
+            print(f'{len(regressions)} regression(s) beyond {args.tolerance:.0%}:')
+            print(regressions.to_string(index=False))
+            sys.exit(1)
+        print('No regressions.')
+
+if __name__ == '__main__':
+    main()
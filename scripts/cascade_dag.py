@@ -0,0 +1,134 @@
+DESC="""Simulation DAGs as integer arrays.
+
+Reads the DAG file written by run_spread_v2.py (--dag_type 1) once into
+compact arrays: one entry per edge, with the simulation, source and target
+(cell, time step, index), the event type as a code and, if a group map is
+given, the group (locality) of the source and target cells. Edges of a
+simulation are contiguous; simulation i is edges sim_start[i]:sim_start[i+1].
+The intervention algorithm builds every budget/intervention time instance from
+these arrays instead of re-reading the file. A subset of the simulations can
+be read on its own (in chunks), e.g. one block per worker process.
+
+Example:
+python cascade_dag.py ../work/dags/BD_S100_24_dag.csv
+"""
+
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# Columns read from the DAG file; the intervention and pathway columns are not
+# needed.
+COLUMNS=['simulation_step','source','source_time_step','source_index',
+         'target','target_time_step','target_index']
+EDGE_FIELDS=['source','source_time','source_index','target','target_time','target_index']
+DTYPES={**{c:'int64' for c in COLUMNS}, 'event':'category'}
+CHUNK_SIZE=1000000 # rows per chunk when reading a subset of the simulations
+
+# One simulation; see CascadeDAG.cascade
+Cascade=namedtuple('Cascade',['sim_id']+EDGE_FIELDS+['event','source_group','target_group'])
+
+def group_lookup(cells, group):
+    """Group of each cell from a dictionary cell -> group; -1 if absent."""
+    if len(group)==0:
+        return np.full(len(cells), -1, dtype=np.int64)
+    keys=np.fromiter(group.keys(), dtype=np.int64, count=len(group))
+    values=np.fromiter(group.values(), dtype=np.int64, count=len(group))
+    position=pd.Index(keys).get_indexer(cells)
+    return np.where(position>=0, values[position], -1)
+
+def simulation_ids(input_file):
+    """Simulation ids of a DAG file in order of appearance (read in chunks)."""
+    ids=[]
+    for chunk in pd.read_csv(input_file, usecols=['simulation_step'], dtype='int64',
+                             chunksize=CHUNK_SIZE):
+        sim=chunk.simulation_step.to_numpy()
+        start=np.concatenate([[0], np.flatnonzero(sim[1:]!=sim[:-1])+1])
+        for s in sim[start].tolist():
+            if len(ids)==0 or ids[-1]!=s:
+                ids.append(s)
+    return ids
+
+class CascadeDAG:
+    """Simulations of a DAG file. group: optional dictionary cell -> group
+    (e.g. MultiScaleNet.group_map()). simulations: optional simulation ids
+    to read (default: all)."""
+
+    def __init__(self, input_file, group=None, simulations=None):
+        self.input_file=input_file
+        if simulations is None:
+            df=pd.read_csv(input_file, usecols=COLUMNS+['event'], dtype=DTYPES)
+        else:
+            keep=np.asarray(list(simulations), dtype=np.int64)
+            chunks=[chunk[chunk.simulation_step.isin(keep)] for chunk in
+                    pd.read_csv(input_file, usecols=COLUMNS+['event'], dtype=DTYPES,
+                                chunksize=CHUNK_SIZE)]
+            df=pd.concat(chunks, ignore_index=True) if len(chunks) else \
+                pd.read_csv(input_file, usecols=COLUMNS+['event'], dtype=DTYPES, nrows=0)
+            # categories may differ between chunks
+            df['event']=df.event.astype('category')
+        self.sim=df.simulation_step.to_numpy()
+        for field, column in zip(EDGE_FIELDS, COLUMNS[1:]):
+            setattr(self, field, df[column].to_numpy())
+        # event names and per-edge codes
+        self.events=np.array(df.event.cat.categories, dtype=object)
+        self.event=df.event.cat.codes.to_numpy()
+        self.number_of_edges=len(df)
+        # Simulations are runs of equal simulation_step
+        change=np.flatnonzero(self.sim[1:]!=self.sim[:-1])+1
+        self.sim_start=np.concatenate([[0], change, [self.number_of_edges]]) \
+            if self.number_of_edges else np.zeros(1, dtype=np.int64)
+        self.number_of_simulations=len(self.sim_start)-1
+        # id of the last simulation in the file
+        self.last_sim_id=int(self.sim[-1]) if self.number_of_edges else -1
+        self.set_groups({} if group is None else group)
+
+    def set_groups(self, group):
+        """Groups of the source and target cells of every edge."""
+        self.source_group=group_lookup(self.source, group)
+        self.target_group=group_lookup(self.target, group)
+
+    def event_mask(self, events):
+        """Boolean mask of edges whose event is one of events."""
+        return np.isin(self.events, list(events))[self.event]
+
+    def cascade(self, i, exclude=()):
+        """Edges of simulation i (0-based position in the file), without the
+        events in exclude. Events are returned as names."""
+        s=slice(self.sim_start[i], self.sim_start[i+1])
+        keep=~self.event_mask(exclude)[s] if len(exclude) else slice(None)
+        return Cascade(int(self.sim[s][0]) if s.stop>s.start else i,
+                *(getattr(self, f)[s][keep] for f in EDGE_FIELDS),
+                self.events[self.event[s][keep]],
+                self.source_group[s][keep], self.target_group[s][keep])
+
+    def cascades(self, exclude=()):
+        for i in range(self.number_of_simulations):
+            yield self.cascade(i, exclude)
+
+    def to_frame(self):
+        """The DAG as a DataFrame with the columns of the file that were read
+        (as expected by gm_compute.gm)."""
+        df=pd.DataFrame({'simulation_step': self.sim})
+        for field, column in zip(EDGE_FIELDS, COLUMNS[1:]):
+            df[column]=getattr(self, field)
+        df['event']=self.events[self.event]
+        return df
+
+    def summary(self):
+        counts=np.bincount(self.event, minlength=len(self.events))
+        return pd.Series({
+            'simulations': self.number_of_simulations,
+            'edges': self.number_of_edges,
+            **{f'{e} edges': c for e, c in zip(self.events, counts)}})
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('input_file', help='DAG file (csv)')
+    args=parser.parse_args()
+    print(CascadeDAG(args.input_file).summary().to_string())
+
+if __name__ == '__main__':
+    main()
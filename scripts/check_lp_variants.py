@@ -0,0 +1,245 @@
+DESC='''Behavioural checks of the options of the intervention LP
+(algorithm_groupint_general_v2.py).
+
+Runs the algorithm with --canonical (without it, the optimal solution the
+solver reports can differ between the options) on a small DAG (the benchmark
+DAG of a network, see benchmark_lp.py, truncated to its first --max_time time
+steps) and checks:
+- --reduce, --screen, --generate and --decompose against the plain LP: the
+  same lp_obj_value, obj_value and budget_used (up to --obj_tolerance,
+  relative) and the same intervention files, for every budget and
+  intervention time;
+- --cache_path: a first run (cache miss, on an empty cache) solves every
+  instance, a second one (cache hit) solves none; both write the results of
+  the plain LP and a metrics file for every instance;
+- lp_worker.py: a task submitted to a worker writes the results of the plain
+  LP;
+- rounding without --canonical: rounding() rounds values just below its
+  thresholds down unless given a tolerance, and a plain LP run without
+  --canonical intervenes on exactly the groups with x >= 1/(2*groups).
+
+Each run is a separate process with SLURM_NTASKS=1 (unless set). The exit
+code is 1 if any check fails.
+
+Run from the scripts directory, like the other pipeline scripts.
+
+Example:
+python check_lp_variants.py -n BD -s 20 --max_time 8 -b 1 3 5 -i 3 6
+'''
+
+import argparse
+import contextlib
+import filecmp
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from glob import glob
+import numpy as np
+import pandas as pd
+from benchmark_simulator import HOMEPATH, BENCHPATH
+from benchmark_lp import benchmark_dag
+
+VARIANTS={'reduce': ['--reduce'], 'screen': ['--screen'], 'generate': ['--generate', '5'],
+          'decompose': ['--decompose']}
+# summary columns that must match the plain LP
+COMPARED=['lp_obj_value','obj_value','budget_used']
+INPUT_CODE='check'
+
+def truncate_dag(dag_file, max_time, out_file):
+    '''DAG file with the edges into time steps up to max_time only.'''
+    dag = pd.read_csv(dag_file)
+    dag[dag.target_time_step <= max_time].to_csv(out_file, index=False)
+    return out_file
+
+def algorithm_args(dag_file, network, budgets, intervention_times, solver, workpath, extra_args=(),
+                   canonical=True):
+    '''Arguments of the algorithm for a run with its outputs in workpath
+    (emptied).'''
+    shutil.rmtree(workpath, ignore_errors=True)
+    os.makedirs(f'{workpath}/summaries', exist_ok=True)
+    os.makedirs(f'{workpath}/interventions', exist_ok=True)
+    return [dag_file, f'../input/networks/{network}/hierarchy.tree',
+            '-b', *map(str, budgets), '-i', *map(str, intervention_times), '--no_gm',
+            *(['--canonical'] if canonical else []), '--solver', solver,
+            '--summary_path', f'{workpath}/summaries', '--intervention_path', f'{workpath}/interventions',
+            '--input_code', INPUT_CODE, *extra_args]
+
+def run_algorithm(args, workpath):
+    '''Runs the algorithm in a child process; returns its exit code and
+    output.'''
+    env = {**os.environ, 'SLURM_NTASKS': os.environ.get('SLURM_NTASKS', '1')}
+    proc = subprocess.run([sys.executable, f'{HOMEPATH}/algorithm_groupint_general_v2.py', *args],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+    with open(f'{workpath}/log.txt', 'w') as f:
+        f.write(proc.stdout)
+    return proc.returncode, proc.stdout
+
+def results(workpath, budgets, intervention_times):
+    '''Summary rows of a run, one per (intervention time, budget); None if
+    one is missing.'''
+    summary_path = f'{workpath}/summaries'
+    names = pd.read_csv(f'{summary_path}/0header.csv').columns
+    rows = []
+    for i in intervention_times:
+        for b in budgets:
+            summary_file = f'{summary_path}/{INPUT_CODE}_I{i}B{b}_summary.csv'
+            if not os.path.isfile(summary_file):
+                return None
+            rows.append(pd.read_csv(summary_file, header=None, names=names).iloc[0])
+    return pd.DataFrame(rows).set_index(['delay','budget'])
+
+def compare(name, workpath, reference, budgets, intervention_times, obj_tolerance):
+    '''Differences (list of messages) between the results of a run and those
+    of the plain LP.'''
+    df = results(workpath, budgets, intervention_times)
+    if df is None:
+        return [f'{name}: summaries missing']
+    out = []
+    for key, row in reference.iterrows():
+        for column in COMPARED:
+            old, new = row[column], df.loc[key, column]
+            if abs(new-old) > obj_tolerance*max(abs(old), 1.0):
+                out.append(f'{name}: I{key[0]}B{key[1]} {column} {new} (plain LP: {old})')
+        int_file = f'I{key[0]}-B{key[1]}.csv'
+        if not filecmp.cmp(f'{reference.attrs["workpath"]}/interventions/{INPUT_CODE}/{int_file}',
+                           f'{workpath}/interventions/{INPUT_CODE}/{int_file}', shallow=False):
+            out.append(f'{name}: {int_file} differs from the plain LP')
+    return out
+
+def check_rounding(workpath, output, budgets, intervention_times):
+    '''Differences (list of messages) from the rounding without tolerance:
+    of rounding() at its thresholds, and of a run without --canonical (output:
+    its printed output) from x >= threshold.'''
+    from algorithm_groupint_general_v2 import rounding, ROUNDING_TOLERANCE
+    out = []
+    # threshold 1/(2*2) for x, 0.5 for z
+    x, z = {1: 0.25-1e-9, 2: 0.25}, np.array([0.5-1e-9, 0.5])
+    for tolerance, expected in [(0.0, [0, 1]), (ROUNDING_TOLERANCE, [1, 1])]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            X, _, Z, _ = rounding(x, z, 2, tolerance=tolerance)
+        if list(X.values()) != expected or Z.tolist() != expected:
+            out.append(f'rounding: tolerance {tolerance}: X {list(X.values())}, Z {Z.tolist()} (expected {expected})')
+    thresholds = [float(line.split(': ')[1]) for line in output.splitlines() if line.startswith('Threshold: ')]
+    instances = [(i, b) for i in intervention_times for b in budgets]
+    if len(thresholds) != len(instances):
+        return out + [f'rounding: {len(thresholds)} thresholds printed for {len(instances)} instances']
+    for (i, b), threshold in zip(instances, thresholds):
+        df = pd.read_csv(f'{workpath}/interventions/{INPUT_CODE}/comp_I{i}-B{b}.csv')
+        wrong = df[df.intervene != (df.val >= threshold).astype(int)]
+        if len(wrong):
+            out.append(f'rounding: I{i}B{b}: groups {wrong.group.tolist()} not rounded at x >= {threshold}')
+    return out
+
+def check_worker(args_of, workpath, solver, timeout):
+    '''Runs one task on a worker of a new queue; returns its exit code.'''
+    import lp_worker
+    queue = f'{workpath}/queue'
+    command = [sys.executable, f'{HOMEPATH}/lp_worker.py', 'serve', queue, '--idle_timeout', str(timeout)]
+    if solver != 'gurobi':
+        command.append('--no_gurobi')
+    task = args_of(workpath)
+    env = {**os.environ, 'SLURM_NTASKS': os.environ.get('SLURM_NTASKS', '1')}
+    with open(f'{workpath}/worker_log.txt', 'w') as log:
+        worker = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+        name = lp_worker.submit(queue, task, log=f'{workpath}/log.txt')
+        result = lp_worker.wait(queue, name, timeout)
+        open(os.path.join(queue, 'stop'), 'w').close()
+        worker.wait()
+    return 1 if result is None else result['status']
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--network', default='BD',
+            help='Network of the benchmark DAG')
+    parser.add_argument('-s', '--simulations', type=int, default=20,
+            help='Number of simulations of the benchmark DAG')
+    parser.add_argument('--max_time', type=int, default=8,
+            help='Keep the time steps of the DAG up to this one')
+    parser.add_argument('-b', '--budgets', nargs='+', type=int, default=[1,3,5],
+            help='Budgets')
+    parser.add_argument('-i', '--intervention_times', nargs='+', type=int, default=[3,6],
+            help='Intervention times')
+    parser.add_argument('--solver', choices=['gurobi','highs'], default='highs',
+            help='LP solver passed to the algorithm')
+    parser.add_argument('--obj_tolerance', type=float, default=1e-6,
+            help='Relative difference above which a value differs from the plain LP')
+    parser.add_argument('--timeout', type=float, default=600,
+            help='Seconds to wait for the task of the worker')
+    parser.add_argument('--workpath',
+            help='Directory for the outputs of the runs (default: a temporary directory)')
+    parser.add_argument('--dagpath', default=f'{BENCHPATH}/dags',
+            help='Directory of the benchmark DAGs (reused if present)')
+    args = parser.parse_args()
+
+    workpath = args.workpath or tempfile.mkdtemp(prefix='check_lp_')
+    os.makedirs(workpath, exist_ok=True)
+    dag_file = benchmark_dag(args.network, args.simulations, args.dagpath)
+    if dag_file is None:
+        print(f'Simulation of the {args.network} benchmark DAG failed')
+        sys.exit(1)
+    dag_file = truncate_dag(dag_file, args.max_time, f'{workpath}/{args.network}_T{args.max_time}_dag.csv')
+    print(f'DAG: {dag_file}, outputs: {workpath}', flush=True)
+
+    def args_of(path, extra_args=(), canonical=True):
+        return algorithm_args(dag_file, args.network, args.budgets, args.intervention_times, args.solver,
+                              path, extra_args, canonical)
+    failures = []
+    returncode, _ = run_algorithm(args_of(f'{workpath}/plain'), f'{workpath}/plain')
+    reference = None if returncode != 0 else results(f'{workpath}/plain', args.budgets, args.intervention_times)
+    if reference is None:
+        print(f'Plain LP failed (exit code {returncode}), see {workpath}/plain/log.txt')
+        sys.exit(1)
+    reference.attrs['workpath'] = f'{workpath}/plain'
+    print(reference[COMPARED].to_string(), flush=True)
+
+    for name, extra_args in VARIANTS.items():
+        returncode, _ = run_algorithm(args_of(f'{workpath}/{name}', extra_args), f'{workpath}/{name}')
+        found = [f'{name}: exit code {returncode}'] if returncode != 0 else \
+            compare(name, f'{workpath}/{name}', reference, args.budgets, args.intervention_times,
+                    args.obj_tolerance)
+        print(f'{name}: ' + ('differs' if found else 'same as the plain LP'), flush=True)
+        failures += found
+
+    # solved on a miss, read back on a hit
+    instances = len(args.budgets)*len(args.intervention_times)
+    cache = ['--cache_path', f'{workpath}/cache']
+    shutil.rmtree(f'{workpath}/cache', ignore_errors=True)
+    for name, cached in [('cache_miss', 0), ('cache_hit', instances)]:
+        returncode, output = run_algorithm(args_of(f'{workpath}/{name}', cache), f'{workpath}/{name}')
+        found = [f'{name}: exit code {returncode}'] if returncode != 0 else \
+            compare(name, f'{workpath}/{name}', reference, args.budgets, args.intervention_times,
+                    args.obj_tolerance)
+        hits = sum(line.endswith(' cached') for line in output.splitlines())
+        if returncode == 0 and hits != cached:
+            found.append(f'{name}: {hits} of {instances} instances read from the cache (expected {cached})')
+        metrics = glob(f'{workpath}/{name}/summaries/{INPUT_CODE}_I*B*_metrics.json')
+        if returncode == 0 and len(metrics) != instances:
+            found.append(f'{name}: {len(metrics)} metrics files for {instances} instances')
+        print(f'{name}: ' + ('differs' if found else f'same as the plain LP, {hits} cached'), flush=True)
+        failures += found
+
+    returncode = check_worker(args_of, f'{workpath}/worker', args.solver, args.timeout)
+    found = [f'worker: exit code {returncode}'] if returncode != 0 else \
+        compare('worker', f'{workpath}/worker', reference, args.budgets, args.intervention_times,
+                args.obj_tolerance)
+    print('worker: ' + ('differs' if found else 'same as the plain LP'), flush=True)
+    failures += found
+
+    returncode, output = run_algorithm(args_of(f'{workpath}/default', canonical=False), f'{workpath}/default')
+    found = [f'default: exit code {returncode}'] if returncode != 0 else \
+        check_rounding(f'{workpath}/default', output, args.budgets, args.intervention_times)
+    print('rounding: ' + ('differs' if found else 'no tolerance without --canonical'), flush=True)
+    failures += found
+
+    if failures:
+        print(f'{len(failures)} check(s) failed:')
+        print('\n'.join(failures))
+        sys.exit(1)
+    print('All checks passed.')
+
+if __name__ == '__main__':
+    main()
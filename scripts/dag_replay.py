@@ -0,0 +1,148 @@
+DESC="""Replays the simulated cascades of a DAG file with groups blocked.
+
+Scores intervention sets without re-simulating: the cascades of the DAG file
+(run_spread_v2.py --dag_type 1) are read once, and for each set of blocked
+groups (localities), a cell counts as infected if it is reached from an
+infected node (before the intervention time, or a source) along the DAG
+edges without passing through a node of a blocked group at or after the
+intervention time. This is the model of the intervention LP (with x = 1 for
+the blocked groups), so the average is the LP objective of an integral
+solution. Many sets are evaluated at once, as boolean matrices.
+
+The files can be intervention files of the algorithm (group,time), e.g.
+../work/interventions/BD_S100_24/I6-B3.csv, or baseline files (node,time),
+e.g. ../input/config_files/baseline_interventions/BD/degree_interventions/B1_T12_degree.csv.
+
+Example:
+python dag_replay.py ../work/dags/BD_S100_24_dag.csv ../input/networks/BD/hierarchy.tree \\
+    ../work/interventions/BD_S100_24/I6-B*.csv -o ../results/BD_S100_24_replay.csv
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import msc_network as msc
+from cascade_dag import CascadeDAG
+from lp_decomposition import ScenarioBlock
+from algorithm_groupint_general_v2 import cascadeGraph, cascadeScenarios
+
+class ReplayEvaluator:
+    """Average number of infected cells of the simulations of a CascadeDAG
+    (with groups) when sets of groups are blocked. scenarios: see
+    cascadeScenarios (computed if not given). Call set_int_time first."""
+
+    def __init__(self, dag, scenarios=None):
+        if scenarios is None:
+            scenarios = cascadeScenarios(dag)
+        index, weight = scenarios
+        graphs = [cascadeGraph(dag.cascade(i, exclude=("EtoE",)), verbose=False) for i in index.tolist()]
+        groups = np.unique(np.concatenate([g.cell_group for g in graphs if g is not None]
+                                          or [np.zeros(0, dtype=np.int64)]))
+        self.block = ScenarioBlock(graphs, weight, groups)
+        self.groups = groups
+        self.M = float(dag.number_of_simulations) # M: total number of simulations
+        self.int_time = None
+
+    def set_int_time(self, int_time):
+        if int_time == self.int_time:
+            return
+        block = self.block
+        block.set_int_time(int_time)
+        self.int_time = int_time
+        # in-edges of each level grouped by target
+        self.levels = []
+        for u, v in block.levels:
+            order = np.argsort(v, kind='stable')
+            u, v = u[order], v[order]
+            start = np.flatnonzero(np.concatenate([[True], v[1:] != v[:-1]]))
+            self.levels.append((u, start, v[start], block.node_group[v[start]]))
+        # nodes grouped by cell
+        self.cell_order = np.argsort(block.node_cell, kind='stable')
+        cell = block.node_cell[self.cell_order]
+        self.cell_start = np.flatnonzero(np.concatenate([[True], cell[1:] != cell[:-1]]))
+        self.cell_index = cell[self.cell_start]
+
+    def blocked(self, selections):
+        """Boolean matrix (sets x groups) of sets of group ids. Group -1 (cells
+        outside of the localities) and unknown groups are never blocked."""
+        blocked = np.zeros((len(selections), len(self.groups)), dtype=bool)
+        for k, selection in enumerate(selections):
+            g = np.asarray(list(selection), dtype=np.int64)
+            g = g[np.isin(g, self.groups) & (g != -1)]
+            blocked[k, np.searchsorted(self.groups, g)] = True
+        return blocked
+
+    def infected(self, blocked):
+        """Infected cells (sets x cells of all scenarios) for a boolean matrix
+        of blocked groups. The sets are packed into the bits of 64-bit words,
+        so each level is a few array operations on (nodes x sets/64)."""
+        k = len(blocked)
+        words = -(-k // 64)
+        # (groups x words) bit matrix of the groups that are not blocked
+        open_groups = np.zeros((len(self.groups), words*8), dtype=np.uint8)
+        open_groups[:, :-(-k // 8)] = np.packbits(~blocked.T, axis=1, bitorder='little')
+        open_groups = open_groups.view(np.uint64)
+        y = np.where(self.block.fixed[:, None], ~np.uint64(0), np.uint64(0)) \
+            .repeat(words, axis=1)
+        for u, start, v, g in self.levels:
+            y[v] = np.bitwise_or.reduceat(y[u], start, axis=0) & open_groups[g]
+        cells = np.zeros((len(self.block.cell_fixed), words), dtype=np.uint64)
+        if len(self.cell_order):
+            cells[self.cell_index] = np.bitwise_or.reduceat(y[self.cell_order], self.cell_start, axis=0)
+        cells = np.unpackbits(cells.view(np.uint8), axis=1, count=k, bitorder='little').T.astype(bool)
+        return cells | self.block.cell_fixed
+
+    def evaluate(self, selections, chunk_size=1024):
+        """Average number of infected cells for each set of blocked groups."""
+        values = []
+        for k in range(0, len(selections), chunk_size):
+            cells = self.infected(self.blocked(selections[k:k+chunk_size]))
+            values.append(cells @ self.block.cell_weight / self.M)
+        return np.concatenate(values) if values else np.zeros(0)
+
+    def cells(self, selection):
+        """Infected cells (1/0) with the groups of selection blocked, one entry
+        per cell and simulation."""
+        return np.repeat(self.infected(self.blocked([selection]))[0].astype(int), self.block.cell_weight)
+
+def readIntervention(filename):
+    """Groups and intervention time of an intervention file (group,time or
+    node,time)."""
+    df = pd.read_csv(filename)
+    times = df.time.unique()
+    if len(times) > 1:
+        raise ValueError(f"{filename}: all groups must have the same intervention time.")
+    return df.iloc[:, 0].tolist(), int(times[0]) if len(times) else None
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("input_file", help="DAG file (csv)")
+    parser.add_argument("hierarchy_file", help="Hierarchy file of the network")
+    parser.add_argument("interventions", nargs="*", help="Intervention files")
+    parser.add_argument("-i", "--intervention_time", type=int,
+                        help="Intervention time (default: from each file); required without files")
+    parser.add_argument("-o", "--out_file", help="Write the results to this csv file")
+    args = parser.parse_args()
+
+    hierarchy = msc.MultiScaleNet()
+    hierarchy.read_hierarchy(args.hierarchy_file)
+    replay = ReplayEvaluator(CascadeDAG(args.input_file, hierarchy.group_map()))
+    rows = []
+    files = [(f, *readIntervention(f)) for f in args.interventions]
+    int_times = sorted({args.intervention_time or t for _, _, t in files} |
+                       ({args.intervention_time} if args.intervention_time is not None else set()))
+    for int_time in int_times:
+        replay.set_int_time(int_time)
+        instances = [('none', [])] + [(f, groups) for f, groups, t in files
+                                      if (args.intervention_time or t) == int_time]
+        values = replay.evaluate([groups for _, groups in instances])
+        rows += [{'file': f, 'delay': int_time, 'groups': len(groups), 'infections_mean': v}
+                 for (f, groups), v in zip(instances, values)]
+    df = pd.DataFrame(rows, columns=['file', 'delay', 'groups', 'infections_mean'])
+    print(df.to_string(index=False))
+    if args.out_file is not None:
+        df.to_csv(args.out_file, index=False)
+
+if __name__ == '__main__':
+    main()
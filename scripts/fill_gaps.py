@@ -2,13 +2,27 @@
 Fill gaps in intervention solutions by a rank-based approach.
 
 AA
+
+Optionally, the algorithm's and the filled solutions are scored by replaying
+the cascades of each input code (see dag_replay.py), e.g. from work:
+python ../scripts/fill_gaps.py --dag_path dags --hierarchy_file ../input/networks/BD/hierarchy.tree \
+    --replay_file ../results/fill_gaps_replay.csv
 '''
 
+import argparse
 import os
 from glob import glob
 import pandas as pd
 from pdb import set_trace
 
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument('--dag_path', help='Directory of the DAG files ({input_code}_dag.csv); replays the solutions')
+parser.add_argument('--hierarchy_file', help='Hierarchy file of the network (required with --dag_path)')
+parser.add_argument('--replay_file', help='Write the replayed solutions to this csv file')
+args = parser.parse_args()
+if args.dag_path is not None and args.hierarchy_file is None:
+    parser.error('--dag_path requires --hierarchy_file')
+
 # Step 1: Collect all intervention files
 files = glob('interventions/**/comp_I*csv', recursive=True)
 
@@ -49,6 +63,7 @@ ossdf = df.groupby(['parent', 'delay', 'budget'], as_index=False)['intervene'].s
 ossdf.rename(columns={'intervene': 'sol_size'}, inplace=True)
 
 # Step 7: For each unique (parent, delay, budget)
+solutions = []
 for (parent, delay, budget) in ossdf[['parent', 'delay', 'budget']].drop_duplicates().values:
     # Find row in ossdf with highest sol_size <= budget
     subset = ossdf[(ossdf['parent'] == parent) & (ossdf['delay'] == delay) & (ossdf['sol_size'] <= budget)]
@@ -82,6 +97,34 @@ for (parent, delay, budget) in ossdf[['parent', 'delay', 'budget']].drop_duplica
     out_path = os.path.join(parent, f'new_I{delay}-B{budget}.csv')
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
     final_df.to_csv(out_path, index=False)
+    own_df = df[(df['parent'] == parent) & (df['delay'] == delay) & (df['budget'] == budget)]
+    solutions.append((parent, delay, budget, sorted(own_df[own_df.intervene==1].group), sorted(sol_groups)))
 
 print("Rank-based intervention solutions have been generated and saved.")
 
+# Step 8 (optional): average infections of the algorithm's and the filled
+# solutions, replayed on the cascades of each input code
+if args.dag_path is not None:
+    import msc_network as msc
+    from cascade_dag import CascadeDAG
+    from dag_replay import ReplayEvaluator
+    hierarchy = msc.MultiScaleNet()
+    hierarchy.read_hierarchy(args.hierarchy_file)
+    group = hierarchy.group_map()
+    rows = []
+    sdf = pd.DataFrame(solutions, columns=['parent', 'delay', 'budget', 'algorithm', 'filled'])
+    for parent, pdf in sdf.groupby('parent'):
+        input_code = os.path.basename(os.path.normpath(parent))
+        replay = ReplayEvaluator(CascadeDAG(os.path.join(args.dag_path, f'{input_code}_dag.csv'), group))
+        for delay, ddf in pdf.groupby('delay'):
+            replay.set_int_time(delay)
+            values = replay.evaluate(ddf.algorithm.tolist() + ddf.filled.tolist()).reshape(2, -1)
+            for (budget, algorithm, filled), a, f in zip(ddf[['budget', 'algorithm', 'filled']].values, *values):
+                rows.append({'input_code': input_code, 'delay': delay, 'budget': budget,
+                             'algorithm_groups': len(algorithm), 'algorithm_infections': a,
+                             'filled_groups': len(filled), 'filled_infections': f})
+    rdf = pd.DataFrame(rows)
+    print(rdf.to_string(index=False))
+    if args.replay_file is not None:
+        rdf.to_csv(args.replay_file, index=False)
+
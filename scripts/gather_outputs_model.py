@@ -153,7 +153,7 @@ def alpha_plotter(df_ss, df_summary):
             print('Levels:', contour_levels[j])
             df_sub = df_m[(df_m.network==n) & (df_m.delay==d) & (df_m.budget==b)]
             if len(df_sub)<676:
-                print("Missing points")
+                print("Missing points; interpolating") # e.g. adaptive_alpha_sweep.py output
             _,_,levels=contour_plotter(df_sub, fig, axs[i,j], "lp_obj_value", cmap=cmaps[j],
                     cbar_label="Infected Nodes" if j==len(delays)-1 else "",
                     cbar_axs=(axs[:,j] if i==len(budgets)-1 else None),
@@ -179,8 +179,13 @@ def contour_plotter(df_m, fig=None, ax=None, stat='infections_mean', stat_label=
     
     X = np.unique(df_m['alpha_S'])
     Y = np.unique(df_m['alpha_LD'])
-    Z = np.reshape(df_m[stat].to_numpy(), (len(Y), len(X))) # rows are y's, columns are X's
-    CS = ax.contourf(X,Y,Z,cmap=cmap, levels=levels)
+    if len(df_m) == len(X)*len(Y):
+        Z = np.reshape(df_m[stat].to_numpy(), (len(Y), len(X))) # rows are y's, columns are X's
+        CS = ax.contourf(X,Y,Z,cmap=cmap, levels=levels)
+    else:
+        # scattered points (incomplete or adaptively refined grid): interpolate
+        # linearly over a triangulation of the points
+        CS = ax.tricontourf(df_m['alpha_S'], df_m['alpha_LD'], df_m[stat], cmap=cmap, levels=levels)
     if cbar_axs is not None:
         _ = fig.colorbar(CS, ax=cbar_axs, label=cbar_label)
     return fig, ax, CS.levels
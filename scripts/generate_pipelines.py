@@ -12,6 +12,7 @@ import argparse
 import itertools, math
 from create_batch_configs import generateConfigs 
 # config file generator; make sure create_batch_configs.py is in the same folder
+from lp_autotune import CostModel, readMetrics, readSummaries, interventionResources
 
 HOMEPATH="../scripts"
 WORKPATH="../work"
@@ -31,7 +32,7 @@ MEM_VALUES = {
     'VN': math.log(27000)
 } # a set of constants used to estimate the number of threads to allow interventions to use
 
-def generate_pipeline_instances(master_config, slurmFile, configs_only=False, simulator_only=False, shell=False, jobArray=True):
+def generate_pipeline_instances(master_config, slurmFile, configs_only=False, simulator_only=False, shell=False, jobArray=True, cost_model=None):
     '''Main function, handling pipeline instances. Can choose to only generate configs, or omit interventions'''
     simulations = master_config['simulations']
     if type(simulations) == list:
@@ -57,7 +58,7 @@ def generate_pipeline_instances(master_config, slurmFile, configs_only=False, si
         return True
     
     if jobArray:
-        job_array_write(master_config, slurmFile, simulator_only) # see helper function below
+        job_array_write(master_config, slurmFile, simulator_only, cost_model) # see helper function below
         
         
     else: # writes jobs one by one, instead of in an array
@@ -87,8 +88,9 @@ def generate_pipeline_instances(master_config, slurmFile, configs_only=False, si
             # log files and directories will be automatically created, if they do not exist
         print(f"Number of instances processed: {i+1}")
 
-def job_array_write(master_config, slurmFile, simulator_only=False):
-    '''Helper function to utilize SLURM's job array functionality to submit jobs.'''
+def job_array_write(master_config, slurmFile, simulator_only=False, cost_model=None):
+    '''Helper function to utilize SLURM's job array functionality to submit jobs.
+    cost_model: optional lp_autotune.CostModel for the intervention jobs.'''
     batches = master_config['batches']
     simulations = master_config['simulations']
     net_ind = (master_config['input']['network']).rindex('/')+1
@@ -115,15 +117,16 @@ echo "Submitted batch job $jid"; ../scripts/qreg_batch \n''')
             cpu_limit = math.ceil(MEM_VALUES[network_name] * int(s) * int(i) / 815) 
             cpu_limit = min(max(cpu_limit,1),20)
             # rough estimate of how many threads for optimizer to utilize, from 1 to 20
-            print(network_name,s,i,b,cpu_limit)
+            cpu_limit, mem_limit, lp_method = interventionResources(cost_model, network_name, int(s), int(i), int(b), cpu_limit)
+            print(network_name,s,i,b,cpu_limit,lp_method)
             slurmFile.write(f'''\
 sbatch -o {WORKPATH}/logs/{prefix}_%a/I{i}B{b}_log.txt \
 --array=0-{batches-1} \
 --dependency=aftercorr:$jid \
---ntasks={cpu_limit} --mem={cpu_limit*8}G \
+--ntasks={cpu_limit} --mem={mem_limit}G \
 --export=ALL,prefix={prefix},\
 hierarchy={master_config['input']['hierarchy']},budget={b},\
-int_time={i} \
+int_time={i},lp_method={lp_method} \
 ../scripts/pipe_int.sbatch; \
 ../scripts/qreg_batch \n''')           
 
@@ -162,10 +165,13 @@ if __name__=="__main__":
                        help="Generate slurm scripts, but without running interventions")
     group.add_argument("-n","--no_job_array", action="store_true",
                        help="sbatch jobs one at a time, instead of as a job array")
+    parser.add_argument("--history", nargs='+',
+            help="Summary csv files or folders of earlier runs; the threads, memory and LP method of the intervention jobs are chosen from a cost model fitted to them (see lp_autotune.py)")
     # parser.add_argument("-d", "--debug", action="store_true")
     # parser.add_argument("-q", "--quiet", action="store_true")
     args = parser.parse_args()
     
+    cost_model = None if args.history is None else CostModel(readSummaries(args.history), readMetrics(args.history))
     slurmFile = open(args.run_file, 'w')
     slurmFile.write('#!/bin/bash\n')
     slurmFile.write('start=$SECONDS\n')
@@ -178,7 +184,8 @@ if __name__=="__main__":
                 configs_only=args.configs_only,
                 simulator_only=args.simulator_only,
                 shell=False, # UNIMPLEMENTED
-                jobArray=(not args.no_job_array)) 
+                jobArray=(not args.no_job_array),
+                cost_model=cost_model) 
             
     slurmFile.write('echo "Total time" $(($SECONDS-$start))\n')
     slurmFile.close()
@@ -12,6 +12,7 @@ import argparse
 import itertools, math
 from create_batch_configs import generateConfigs 
 # config file generator; make sure create_batch_configs.py is in the same folder
+from lp_autotune import CostModel, readMetrics, readSummaries, interventionResources
 
 HOMEPATH="../scripts"
 WORKPATH="../work"
@@ -32,7 +33,7 @@ MEM_VALUES = {
     'VN': math.log(27000)
 } # a set of constants used to estimate the number of threads to allow interventions to use
 
-def generate_pipeline_instances_model(master_config, slurmFile, configs_only=False, simulator_only=False, shell=False, jobArray=True):
+def generate_pipeline_instances_model(master_config, slurmFile, configs_only=False, simulator_only=False, shell=False, jobArray=True, cost_model=None):
     '''Main function, handling pipeline instances. Can choose to only generate configs, or omit interventions'''
 
     batch_configs = []
@@ -53,14 +54,15 @@ def generate_pipeline_instances_model(master_config, slurmFile, configs_only=Fal
         return True
     
     if jobArray and master_config['batches']>1:
-        job_array_write_model(master_config, slurmFile, simulator_only)
+        job_array_write_model(master_config, slurmFile, simulator_only, cost_model)
     else: 
-        job_single_write_model(master_config, slurmFile, simulator_only)
+        job_single_write_model(master_config, slurmFile, simulator_only, cost_model)
 
-def job_array_write_model(master_config, slurmFile, simulator_only=False):
+def job_array_write_model(master_config, slurmFile, simulator_only=False, cost_model=None):
     '''
     Function to utilize SLURM's job array functionality to submit jobs.
     This function is run if multiple batches are to be run per input combination
+    cost_model: optional lp_autotune.CostModel for the intervention jobs.
     '''
     batches = master_config['batches']
     alpha_S = master_config['parameters']['model_parameters']['alpha_S']
@@ -86,22 +88,24 @@ echo "Submitted batch job $jid"; ./qreg_batch \n''') # default memory usage
             cpu_limit = math.ceil(MEM_VALUES[network_name] * int(s) * int(i) / 815) # rough estimate
             #cpu_limit = math.ceil(mem_limit/8)
             cpu_limit = min(max(cpu_limit,1),20)
-            print(network_name,alpha_S,alpha_LD,i,b,cpu_limit)
+            cpu_limit, mem_limit, lp_method = interventionResources(cost_model, network_name, int(s), int(i), int(b), cpu_limit)
+            print(network_name,alpha_S,alpha_LD,i,b,cpu_limit,lp_method)
             #print(mem_limit)
             slurmFile.write(f'''\
 sbatch -o {WORKPATH}/logs/{prefix}_%a/I{i}B{b}_log.txt \
 --array=0-{batches-1} \
 --dependency=aftercorr:$jid \
---ntasks={cpu_limit} --mem={cpu_limit*8}G \
+--ntasks={cpu_limit} --mem={mem_limit}G \
 --export=ALL,prefix={prefix},\
 hierarchy={master_config['input']['hierarchy']},budget={b},\
-int_time={i} \
+int_time={i},lp_method={lp_method} \
 ./pipe_int.sbatch; \
 ./qreg_batch \n''')           
 
-def job_single_write_model(master_config, slurmFile, simulator_only=False):
+def job_single_write_model(master_config, slurmFile, simulator_only=False, cost_model=None):
     '''Function to be run if only one batch is needed per alpha_S/alpha_LD combination.
-    In this case, each combination is submitted one job at a time.'''
+    In this case, each combination is submitted one job at a time.
+    cost_model: optional lp_autotune.CostModel for the intervention jobs.'''
     alpha_S = master_config['parameters']['model_parameters']['alpha_S']
     alpha_LD = master_config['parameters']['model_parameters']['alpha_LD']
     net_ind = (master_config['input']['network']).rindex('/')+1
@@ -126,14 +130,15 @@ echo "Submitted batch job $jid"; ./qreg_single \n''')
             cpu_limit = math.ceil(MEM_VALUES[network_name] * int(s) * int(i) / 815) 
             cpu_limit = min(max(cpu_limit,1),20)
             # rough estimate of how many threads for optimizer to utilize, from 1 to 20
-            print(network_name,alpha_S,alpha_LD,i,b,cpu_limit)
+            cpu_limit, mem_limit, lp_method = interventionResources(cost_model, network_name, int(s), int(i), int(b), cpu_limit)
+            print(network_name,alpha_S,alpha_LD,i,b,cpu_limit,lp_method)
             slurmFile.write(f'''\
 sbatch -o {logpath}/I{i}B{b}_log.txt \
 --dependency=afterok:$jid \
---ntasks={cpu_limit} --mem={cpu_limit*8}G \
+--ntasks={cpu_limit} --mem={mem_limit}G \
 --export=ALL,prefix={prefix},single=1,\
 hierarchy={master_config['input']['hierarchy']},budget={b},\
-int_time={i} \
+int_time={i},lp_method={lp_method} \
 ./pipe_int.sbatch; \
 ./qreg_single \n''')  
 
@@ -172,10 +177,13 @@ if __name__=="__main__":
                        help="Generate slurm scripts, but without running interventions")
     group.add_argument("-n","--no_job_array", action="store_true",
                        help="sbatch jobs one at a time, instead of as a job array")
+    parser.add_argument("--history", nargs='+',
+            help="Summary csv files or folders of earlier runs; the threads, memory and LP method of the intervention jobs are chosen from a cost model fitted to them (see lp_autotune.py)")
     # parser.add_argument("-d", "--debug", action="store_true")
     # parser.add_argument("-q", "--quiet", action="store_true")
     args = parser.parse_args()
     
+    cost_model = None if args.history is None else CostModel(readSummaries(args.history), readMetrics(args.history))
     slurmFile = open(args.run_file, 'w')
     slurmFile.write('#!/bin/bash\n')
     slurmFile.write('start=$SECONDS\n')
@@ -188,7 +196,8 @@ if __name__=="__main__":
                 configs_only=args.configs_only,
                 simulator_only=args.simulator_only,
                 shell=False, # UNIMPLEMENTED
-                jobArray=(not args.no_job_array) )
+                jobArray=(not args.no_job_array),
+                cost_model=cost_model)
                 # will not run job array if only one batch
             
     slurmFile.write('echo "Total time" $(($SECONDS-$start))\n')
@@ -0,0 +1,287 @@
+DESC="""Synthetic multiscale network generator.
+
+Writes a network folder in the MultiScaleNet format (0.nodes, 0.edges,
+1.nodes, 1.edges, hierarchy.tree) together with a matching seed file, so that
+the simulator and the intervention algorithm can be exercised on networks much
+larger than the shipped ones.
+
+Cells are laid out on a square grid. Short-distance (level 0) edges connect
+every pair of cells within the given Moore range. Cells are partitioned into
+rectangular blocks, one per locality, and a fraction of them can be left
+outside of any locality (parent -1), as in the real networks. Long-distance
+(level 1) trade edges are drawn between random locality pairs for each month.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import numpy as np
+import pandas as pd
+
+FORMAT="[%(filename)s] [%(levelname)s]: %(message)s"
+MONTHS=[str(m) for m in range(1,13)]
+LOCALITY_ID_START=1 # locality ids start here; cell ids start after them
+
+def grid_shape(number_of_cells):
+    # Near-square grid with at least number_of_cells positions.
+    width=math.ceil(math.sqrt(number_of_cells))
+    height=math.ceil(number_of_cells/width)
+    return width,height
+
+def locality_blocks(number_of_localities, width, height):
+    # Split the grid into bx*by>=number_of_localities blocks, as square as
+    # possible.
+    bx=max(1,round(math.sqrt(number_of_localities*width/height)))
+    bx=min(bx,width)
+    by=math.ceil(number_of_localities/bx)
+    return bx,by
+
+def generate_cells(args, rng):
+    width,height=grid_shape(args.cells)
+    position=np.arange(args.cells)
+    x=position % width
+    y=position // width
+    cellIds=position+args.cell_id_start
+
+    # Locality assignment by rectangular blocks of the grid.
+    bx,by=locality_blocks(args.localities, width, height)
+    block=(x*bx//width) + (y*by//height)*bx
+    # More blocks than localities: fold the surplus blocks back in.
+    locality=block % args.localities + LOCALITY_ID_START
+    unassigned=rng.random(args.cells)<args.unassigned_frac
+    parent=np.where(unassigned,-1,locality)
+
+    # Monthly production profiles.
+    if args.production=='uniform':
+        production=np.ones((args.cells,12))
+    elif args.production=='seasonal':
+        # One sinusoidal season per locality, peaking at a random month.
+        peak=rng.integers(0,12,args.localities)[locality-LOCALITY_ID_START]
+        months=np.arange(12)
+        production=1+np.cos(2*np.pi*(months[None,:]-peak[:,None])/12)
+        production*=rng.lognormal(0,args.production_sigma,(args.cells,1))
+    elif args.production=='lognormal':
+        production=rng.lognormal(0,args.production_sigma,(args.cells,12))
+    else:
+        raise ValueError(f"Unknown production profile '{args.production}'.")
+    production[rng.random(args.cells)<args.zero_production_frac,:]=0
+    if production.max()>0:
+        production=production/production.max()
+
+    nodes=pd.DataFrame(production, columns=MONTHS)
+    nodes.insert(0,'country_name',args.country)
+    nodes.insert(0,'node',cellIds)
+    return nodes,x,y,parent,width,height
+
+def generate_short_distance_edges(cellIds, x, y, width, height, mooreRange, country):
+    # Grid position -> cell index (-1 for empty positions in the last row).
+    grid=np.full((height,width),-1,dtype=np.int64)
+    grid[y,x]=np.arange(len(cellIds))
+    sources=[]
+    targets=[]
+    distances=[]
+    for dx in range(-mooreRange,mooreRange+1):
+        for dy in range(-mooreRange,mooreRange+1):
+            if dx==0 and dy==0:
+                continue
+            tx=x+dx
+            ty=y+dy
+            valid=(tx>=0)&(tx<width)&(ty>=0)&(ty<height)
+            target=np.full(len(cellIds),-1,dtype=np.int64)
+            target[valid]=grid[ty[valid],tx[valid]]
+            valid=target>=0
+            sources.append(cellIds[valid])
+            targets.append(cellIds[target[valid]])
+            distances.append(np.full(valid.sum(),max(abs(dx),abs(dy)),dtype=np.int8))
+    edges=pd.DataFrame({
+        'source': np.concatenate(sources),
+        'target': np.concatenate(targets),
+        'moore': np.concatenate(distances)})
+    edges=edges.sort_values(['source','moore','target'],kind='stable').reset_index(drop=True)
+    edges['source_country']=country
+    edges['target_country']=country
+    return edges
+
+def generate_long_distance_edges(localityIds, representativeCell, tradeDensity, weightSigma, country, rng):
+    # For every month, each ordered pair of distinct localities trades with
+    # probability tradeDensity. At least one edge per month is kept, since
+    # the simulator expects long-distance edges in every month.
+    n=len(localityIds)
+    source,target=np.meshgrid(np.arange(n),np.arange(n),indexing='ij')
+    offDiagonal=source!=target
+    source=source[offDiagonal]
+    target=target[offDiagonal]
+    frames=[]
+    for month in range(1,13):
+        keep=rng.random(len(source))<tradeDensity
+        if not keep.any() and len(source):
+            keep[rng.integers(len(source))]=True
+        frames.append(pd.DataFrame({
+            'source': localityIds[source[keep]],
+            'target': localityIds[target[keep]],
+            'weight': rng.lognormal(math.log(0.03),weightSigma,keep.sum()),
+            'month': month,
+            'cell_id_x': representativeCell[source[keep]],
+            'cell_id_y': representativeCell[target[keep]]}))
+    edges=pd.concat(frames,ignore_index=True)
+    edges['weight']=edges.weight.clip(upper=1)
+    edges['source_country']=country
+    edges['target_country']=country
+    return edges
+
+def generate_seeds(nodes, parent, numberOfSeeds, rng):
+    # Seed a compact set of producing cells inside one locality.
+    cellIds=nodes.node.to_numpy()
+    producing=nodes[MONTHS].to_numpy().sum(axis=1)>0
+    candidates=np.flatnonzero((parent!=-1)&producing)
+    if len(candidates)==0:
+        candidates=np.arange(len(cellIds))
+    locality=parent[rng.choice(candidates)]
+    inLocality=np.flatnonzero(parent==locality) if locality!=-1 else candidates
+    chosen=inLocality[:numberOfSeeds]
+    return pd.DataFrame({'node': cellIds[chosen], 'probability': 1})
+
+def generate_network(args):
+    rng=np.random.default_rng(args.random_seed)
+    if args.cell_id_start<=args.localities+LOCALITY_ID_START:
+        raise ValueError("Cell ids overlap with locality ids. Increase --cell_id_start.")
+
+    logging.info(f"Generating {args.cells} cells ...")
+    nodes,x,y,parent,width,height=generate_cells(args, rng)
+    cellIds=nodes.node.to_numpy()
+
+    logging.info("Generating short-distance edges ...")
+    edges0=generate_short_distance_edges(cellIds, x, y, width, height,
+            args.moore_range, args.country)
+
+    # Localities that own no cell are dropped, so that every locality in
+    # 1.nodes has at least one child.
+    localityIds=np.unique(parent[parent!=-1])
+    firstCell=pd.Series(cellIds).groupby(parent).first()
+    representativeCell=firstCell.loc[localityIds].to_numpy()
+    nodes1=pd.DataFrame({
+        'node': localityIds,
+        'name': [f'L{l}' for l in localityIds],
+        'cell_id': representativeCell,
+        'country': args.country})
+
+    logging.info(f"Generating long-distance edges between {len(localityIds)} localities ...")
+    edges1=generate_long_distance_edges(localityIds, representativeCell,
+            args.trade_density, args.weight_sigma, args.country, rng)
+
+    localityNames=dict(zip(nodes1.node,nodes1.name))
+    localityNames[-1]='root'
+    hierarchy=pd.concat([
+        pd.DataFrame({'parent': -1, 'child': localityIds}),
+        pd.DataFrame({'parent': parent, 'child': cellIds})],
+        ignore_index=True)
+    hierarchy['locality_name']=hierarchy.parent.map(localityNames)
+    hierarchy.loc[hierarchy.parent==-1,'locality_name']='root'
+    hierarchy['child_country']=args.country
+
+    seeds=generate_seeds(nodes, parent, args.seeds, rng)
+    return nodes,edges0,nodes1,edges1,hierarchy,seeds
+
+def write_network(folder, nodes, edges0, nodes1, edges1, hierarchy):
+    os.makedirs(folder, exist_ok=True)
+    nodes.to_csv(f'{folder}/0.nodes',index=False)
+    edges0.to_csv(f'{folder}/0.edges',index=False)
+    nodes1.to_csv(f'{folder}/1.nodes',index=False)
+    edges1.to_csv(f'{folder}/1.edges',index=False)
+    hierarchy.to_csv(f'{folder}/hierarchy.tree',index=False)
+
+def write_master_config(configFile, folder, seedFile, prefix, args):
+    # Master config in the format read by generate_pipelines.py.
+    config={
+        "input": {
+            "network": folder,
+            "hierarchy": f"{folder}/hierarchy.tree",
+            "seeding": seedFile,
+            "intervention": ""
+        },
+        "batches": 1,
+        "simulations": [1,10],
+        "parameters": {
+            "model_parameters": {
+                "suitability_thresh": 0,
+                "exposure_delay": 3,
+                "alpha_S": 300,
+                "alpha_L": 0.2,
+                "alpha_LD": 200,
+                "kernel": "moore",
+                "kernel_parameters": 1
+            },
+            "simulation_parameters": {
+                "time_steps": 24,
+                "start_month": 5
+            }
+        },
+        "budget": [3,5],
+        "intervention_time": [3,6,12],
+        "random_seed": args.random_seed,
+        "prefix": prefix
+    }
+    with open(configFile,'w') as f:
+        json.dump(config,f,indent=4)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("network", help="Output network folder.")
+    parser.add_argument("-n", "--cells", type=int, default=50000,
+            help="Number of cells (level 0 nodes).")
+    parser.add_argument("-l", "--localities", type=int, default=100,
+            help="Number of localities (level 1 nodes).")
+    parser.add_argument("--unassigned_frac", type=float, default=0.1,
+            help="Fraction of cells which do not belong to any locality.")
+    parser.add_argument("--moore_range", type=int, default=3,
+            help="Short-distance edges connect cells up to this Moore distance.")
+    parser.add_argument("--trade_density", type=float, default=0.1,
+            help="Probability that an ordered locality pair trades in a given month.")
+    parser.add_argument("--weight_sigma", type=float, default=1.0,
+            help="Log-scale spread of trade weights.")
+    parser.add_argument("--production", default="seasonal",
+            choices=["uniform","seasonal","lognormal"],
+            help="Monthly production profile of cells.")
+    parser.add_argument("--production_sigma", type=float, default=1.0,
+            help="Log-scale spread of cell production.")
+    parser.add_argument("--zero_production_frac", type=float, default=0.05,
+            help="Fraction of cells with no production (never suitable).")
+    parser.add_argument("--country", default="SY",
+            help="Country code written to the country columns.")
+    parser.add_argument("--cell_id_start", type=int, default=1000000,
+            help="First cell id. Must be larger than the number of localities.")
+    parser.add_argument("-k", "--seeds", type=int, default=10,
+            help="Number of seed cells.")
+    parser.add_argument("--seed_file",
+            help="Output seed file. Default: <network>_seed.csv")
+    parser.add_argument("--config_file",
+            help="Also write a master config file for generate_pipelines.py.")
+    parser.add_argument("--prefix", default="SY_",
+            help="Prefix used in the master config file.")
+    parser.add_argument("--random_seed", type=int, default=1234)
+    parser.add_argument("--no_validate", action="store_true",
+            help="Skip reading the network back with MultiScaleNet.")
+    args=parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,format=FORMAT)
+
+    folder=args.network.rstrip('/')
+    seedFile=args.seed_file if args.seed_file is not None else f'{folder}_seed.csv'
+
+    nodes,edges0,nodes1,edges1,hierarchy,seeds=generate_network(args)
+    logging.info(f"Writing network to '{folder}' ...")
+    write_network(folder, nodes, edges0, nodes1, edges1, hierarchy)
+    seeds.to_csv(seedFile,index=False)
+    logging.info(f"Seed file: '{seedFile}'")
+    if args.config_file is not None:
+        write_master_config(args.config_file, folder, seedFile, args.prefix, args)
+        logging.info(f"Master config: '{args.config_file}'")
+
+    if not args.no_validate:
+        import msc_network as msc # ensure msc_network.py is in the same folder
+        net=msc.MultiScaleNet()
+        net.read_from_folder(folder)
+        net.display_summary()
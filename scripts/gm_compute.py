@@ -59,8 +59,10 @@ def gm_per_cascade(df, tree):
 
 def gm(sim, tree):
     tree = tree[['child', 'parent']].set_index('child', drop=True).squeeze()
-    gmH = sim.groupby('simulation_step').apply(gm_per_cascade, tree)
-    return gmH.max()
+    # iterating keeps simulation_step in each group (apply drops it in
+    # recent pandas versions)
+    return max(gm_per_cascade(cascade, tree)
+               for _, cascade in sim.groupby('simulation_step'))
 
 def main():
     # parser
@@ -0,0 +1,126 @@
+DESC="""Lazy-greedy group selection on the scenario DAGs.
+
+Instead of the LP and rounding of algorithm_groupint_general_v2.py, groups
+are chosen one at a time: each step adds the group whose blocking most
+reduces the average number of infected cells at the intervention time. For a
+set of blocked groups (x = 1), the infected cells of every simulation follow
+from the recursion of lp_decomposition.ScenarioBlock. Marginal gains are only
+re-evaluated for the group at the top of the queue (lazy greedy, CELF): a
+gain computed for a smaller selection is used as a bound for the larger one.
+The selections of all budgets of an intervention time are prefixes of one
+greedy sequence.
+
+Used by algorithm_groupint_general_v2.py --method greedy, and as the
+starting point of --decompose with --greedy_start.
+"""
+
+import heapq
+import time
+import numpy as np
+import pandas as pd
+from lp_decomposition import ScenarioBlock
+from algorithm_groupint_general_v2 import cascadeGraph, cascadeScenarios, rounding
+
+class LazyGreedy:
+    """Greedy minimization of value(selection) over the candidates, with
+    lazy evaluation of the marginal gains. value: function of a list of
+    candidates."""
+
+    def __init__(self, value, candidates):
+        self.value = value
+        self.selected = []
+        self.current = value([])
+        self.evaluations = 1
+        # (-gain, candidate, size of the selection the gain was computed for)
+        self.queue = [(-np.inf, c, -1) for c in candidates]
+        heapq.heapify(self.queue)
+        self.done = False
+
+    def select(self, budget):
+        """The first budget candidates of the greedy sequence (fewer if no
+        candidate reduces the value)."""
+        while len(self.selected) < budget and self.queue and not self.done:
+            neg_gain, c, size = heapq.heappop(self.queue)
+            if size == len(self.selected):
+                if -neg_gain <= 0:
+                    self.done = True # no candidate reduces the value
+                    heapq.heappush(self.queue, (neg_gain, c, size))
+                    break
+                self.selected.append(c)
+                self.current += neg_gain
+                continue
+            gain = self.current - self.value(self.selected + [c])
+            self.evaluations += 1
+            heapq.heappush(self.queue, (-gain, c, len(self.selected)))
+        return self.selected[:budget]
+
+class GroupGreedy:
+    """Greedy group selection; same interface as GroupLP (set_int_time,
+    solve, dispose). dag: CascadeDAG of the simulations (with groups);
+    scenarios: see cascadeScenarios (computed if not given); verbose: print
+    the groups."""
+
+    def __init__(self, dag, scenarios=None, verbose=False):
+        self.dag = dag
+        self.verbose = verbose
+        if scenarios is None:
+            scenarios = cascadeScenarios(dag)
+        index, weight = scenarios
+        graphs = [cascadeGraph(dag.cascade(i, exclude=("EtoE",)), verbose=False) for i in index.tolist()]
+        # groups in order of first appearance (as in the LP)
+        groups = pd.unique(np.concatenate([g.cell_group for g in graphs if g is not None]
+                                          or [np.zeros(0, dtype=np.int64)]))
+        self.x_groups = groups.tolist()
+        self.block = ScenarioBlock(graphs, weight, np.sort(groups))
+        self.x_index = np.searchsorted(self.block.groups, groups)
+        self.M = float(dag.number_of_simulations) # M: total number of simulations
+        unique_groups = set(self.x_groups)
+        if verbose:
+            print("Unique groups "+str(unique_groups))
+        self.no_groups = len(unique_groups)-1 if -1 in unique_groups else len(unique_groups)
+
+    def value(self, selected):
+        """Weighted number of infected cells with the groups at positions
+        selected (of block.groups) blocked."""
+        x = np.zeros(len(self.block.groups))
+        x[selected] = 1.0
+        return float((self.block.recursion(x)[1]*self.block.cell_weight).sum())
+
+    def set_int_time(self, int_time):
+        self.int_time = int_time
+        zero, _ = self.block.set_int_time(int_time)
+        # groups that can be blocked and appear in the recursion; sources
+        # after int_time and group -1 cannot be blocked
+        relevant = np.unique(np.concatenate([self.block.node_group[v] for _, v in self.block.levels]
+                                            or [np.zeros(0, dtype=np.int64)]))
+        excluded = set(zero.tolist()) | set(np.searchsorted(self.block.groups, [-1]).tolist()
+                                             if -1 in self.x_groups else [])
+        self.greedy = LazyGreedy(self.value, [g for g in relevant.tolist() if g not in excluded])
+        print("No Action: avg. # nodes infected "+str(self.greedy.current/self.M))
+
+    def solve(self, budget_groups, gm_val=-1, fixed_budget=None, replay=None):
+        # gm_val: -1 if GM is not used for rounding; replay: see rounding
+        start = time.time()
+        selected = self.greedy.select(budget_groups)
+        x_full = np.zeros(len(self.block.groups))
+        x_full[selected] = 1.0
+        x = dict(zip(self.x_groups, x_full[self.x_index].tolist()))
+        objValue = self.value(selected)/self.M
+        print("Greedy selection: "+str(self.block.groups[selected].tolist()))
+        print("Greedy objective value "+str(objValue))
+        lp_budget = float(len(selected))
+        no_groups = self.no_groups
+        z = self.block.cells(x_full)
+        if gm_val != -1:
+            X,Y,Z,full_info = rounding(x,z, 1, fixed_budget=fixed_budget, replay=replay, verbose=self.verbose)
+        else:
+            X,Y,Z,full_info = rounding(x,z, no_groups, fixed_budget=fixed_budget, replay=replay,
+                                       verbose=self.verbose)
+        r = time.time()-start
+        print("Greedy runtime: "+str(r))
+        w = float(self.greedy.evaluations)
+        print("Greedy evaluations: "+str(w))
+        return X,Y,Z, no_groups, objValue, self.M, lp_budget, self.dag.last_sim_id, gm_val, r, w, full_info
+
+    def dispose(self):
+        pass
@@ -0,0 +1,253 @@
+DESC="""Threads, memory and LP method of intervention jobs from the recorded solves.
+
+generate_pipelines.py and generate_pipelines_model.py estimate the threads
+and memory of an intervention job from hand-set constants per network.
+algorithm_groupint_general_v2.py records, next to each summary, the size of
+the LP (nonzeros), its solver work (in work units of about a second of one
+thread) and the peak memory of the process (<input_code>_I<delay>B<budget>_metrics.json).
+This module fits a cost model to them by least squares, on a log scale:
+
+    log(nonzeros)   = a[network] + b*log(num_sims) + c*log(1+delay)
+    log(lp_work)    = d + e*log(nonzeros) + f*log(budget)
+    log(peak_rss)   = g + h*log(nonzeros)
+
+(if all recorded solves have the same number of simulations, b is set to 1:
+the LP has one block per simulation), and chooses for a new instance, from
+its predicted size,
+
+    threads = predicted work / WORK_PER_THREAD (between 1 and MAX_THREADS),
+    LP method = dual simplex on one thread if the predicted work is below
+                DUAL_WORK, else the default (algorithm --lp_method auto),
+    memory = MEMORY_MARGIN * predicted peak memory (at least MIN_MEMORY GB).
+
+Summaries of older runs without metrics files only record lp_work: then
+lp_work is fitted directly (log(lp_work) = a[network] + b*log(num_sims) +
+c*log(1+delay) + d*log(budget)), and the memory of a job stays with the
+generator's estimate (8 GB per estimated thread). Networks without recorded
+solves keep the generator's estimates.
+
+Only solves of the full LP by Gurobi are fitted, as in the pipeline jobs
+(see fittedSolve): HiGHS reports iterations instead of work units, the
+greedy method counts evaluations, and the metrics of --decompose and
+--generate describe a master or partial LP. Summaries in a folder whose
+metrics file shows another kind of solve are skipped as well; summary csv
+files without metrics files are taken as pipeline solves.
+
+The summaries are read from csv files with a header (e.g. the summaries.csv
+written by gather_outputs.py) or from folders of per-instance summary files
+with a 0header.csv (e.g. ../work/summaries); the metrics files from the same
+folders.
+
+Example:
+python lp_autotune.py ../work/summaries -s 10 100 -i 6 12 -b 3
+"""
+
+import argparse
+import json
+import math
+import os
+from glob import glob
+import numpy as np
+import pandas as pd
+
+WORK_PER_THREAD = 60.0 # predicted work units per thread
+MAX_THREADS = 20
+DUAL_WORK = 5.0 # below this predicted work: one thread, dual simplex
+MEMORY_MARGIN = 1.5 # memory of a job: this times the predicted peak memory
+MIN_MEMORY = 2 # GB
+
+# network of an input code, e.g. BD in BD_S100_24, BD_as0.5_ald0.3_0 or bench_BD_S10_0
+NETWORK_PATTERN = r"(?:^|_)([A-Z]+)[0-9]*_"
+
+def metricsRecords(path):
+    """Contents of the metrics files of a folder (none for a file)."""
+    records = []
+    for filename in glob(os.path.join(path, '*_metrics.json')) if os.path.isdir(path) else []:
+        with open(filename) as f:
+            records.append(json.load(f))
+    return records
+
+def fittedSolve(metrics):
+    """Whether the cost model is fitted to a recorded solve: the full LP
+    (--method lp, without --decompose or --generate) solved by Gurobi."""
+    return metrics.get('lp') is not None and metrics.get('solver') == 'gurobi' and \
+        metrics.get('method') == 'lp' and not metrics.get('decompose') and not metrics.get('generate')
+
+def readSummaries(paths):
+    """Recorded solves (num_sims, delay, budget, lp_work and network) of
+    summary csv files or folders."""
+    frames = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = pd.read_csv(os.path.join(path, '0header.csv')).columns
+            files = [f for f in glob(os.path.join(path, '*.csv')) if os.path.basename(f) != '0header.csv']
+            if not files:
+                continue
+            df = pd.concat([pd.read_csv(f, header=None, names=names) for f in files], ignore_index=True)
+            skipped = {(m['input_code'], m['delay'], m['budget']) for m in metricsRecords(path) if not fittedSolve(m)}
+            keys = zip(df.input_code.astype(str), df.delay, df.budget)
+            frames.append(df[[key not in skipped for key in keys]])
+        else:
+            frames.append(pd.read_csv(path))
+    if not frames:
+        return pd.DataFrame(columns=['network', 'num_sims', 'delay', 'budget', 'lp_work'])
+    df = pd.concat(frames, ignore_index=True)
+    if 'network' not in df.columns: # as in gather_outputs.combine_summaries
+        df['network'] = df['int_filename'].str.extract(r"(?<=/)([A-Z]+)(?=[0-9]*_S)", expand=False)
+    df = df.dropna(subset=['network', 'lp_work'])
+    return df[(df.lp_work > 0) & (df.network != '')]
+
+def readMetrics(paths):
+    """Recorded LP solves (network, num_sims, delay, budget, nonzeros,
+    lp_work, peak_rss_mb) of the metrics files in folders (see
+    fittedSolve)."""
+    rows = []
+    for path in paths:
+        for metrics in metricsRecords(path):
+            if not fittedSolve(metrics):
+                continue
+            rows.append({'input_code': metrics['input_code'], 'num_sims': metrics['num_sims'],
+                         'delay': metrics['delay'], 'budget': metrics['budget'],
+                         'nonzeros': metrics['lp']['nonzeros'], 'lp_work': metrics['lp']['work'],
+                         'peak_rss_mb': metrics['peak_rss_mb']})
+    df = pd.DataFrame(rows, columns=['input_code', 'num_sims', 'delay', 'budget', 'nonzeros', 'lp_work',
+                                     'peak_rss_mb'])
+    df['network'] = df.input_code.str.extract(NETWORK_PATTERN, expand=False)
+    df = df.dropna(subset=['network'])
+    return df[(df.nonzeros > 0) & (df.lp_work > 0) & (df.peak_rss_mb > 0)]
+
+def logFit(A, y):
+    """Least squares coefficients of y (a log) on the columns of A, and R^2."""
+    coef = np.linalg.lstsq(A, y, rcond=None)[0] if len(y) else np.zeros(A.shape[1])
+    residual = y - A @ coef
+    r2 = 1-residual.var()/y.var() if len(y) > 1 and y.var() > 0 else float('nan')
+    return coef, r2
+
+class CostModel:
+    """Least squares fits to the recorded solves (see DESC): to the metrics
+    files if there are any, else to lp_work of the summaries."""
+
+    def __init__(self, summaries, metrics=None):
+        self.sized = metrics is not None and len(metrics) > 0
+        data = metrics if self.sized else summaries
+        self.networks = sorted(data.network.unique().tolist())
+        self.fixed_sims = data.num_sims.nunique() < 2
+        self.count = len(data)
+        sims = np.log(data.num_sims.to_numpy(dtype=float))
+        if self.sized:
+            # size from the instance, work and memory from the size
+            y = np.log(data.nonzeros.to_numpy(dtype=float)) - (sims if self.fixed_sims else 0.0)
+            self.size_coef, self.size_r2 = logFit(self.features(data.network, data.num_sims, data.delay), y)
+            nonzeros = np.log(data.nonzeros.to_numpy(dtype=float))
+            self.coef, self.r2 = logFit(np.column_stack([np.ones(len(data)), nonzeros,
+                                                         np.log(data.budget.to_numpy(dtype=float))]),
+                                        np.log(data.lp_work.to_numpy(dtype=float)))
+            self.memory_coef, self.memory_r2 = logFit(np.column_stack([np.ones(len(data)), nonzeros]),
+                                                      np.log(data.peak_rss_mb.to_numpy(dtype=float)))
+        else:
+            y = np.log(data.lp_work.to_numpy(dtype=float)) - (sims if self.fixed_sims else 0.0)
+            self.coef, self.r2 = logFit(self.features(data.network, data.num_sims, data.delay, data.budget), y)
+
+    def features(self, network, sims, delay, budget=None):
+        network = np.asarray(network)
+        columns = [(network == n).astype(float) for n in self.networks] + [np.log1p(np.asarray(delay, dtype=float))]
+        if budget is not None:
+            columns.append(np.log(np.asarray(budget, dtype=float)))
+        if not self.fixed_sims:
+            columns.append(np.log(np.asarray(sims, dtype=float)))
+        return np.column_stack(columns)
+
+    def predict_size(self, network, sims, delay):
+        """Predicted nonzeros of the LP of an instance; None without metrics
+        or for a network without recorded solves."""
+        if not self.sized or network not in self.networks:
+            return None
+        log_size = float((self.features([network], [sims], [delay]) @ self.size_coef)[0])
+        if self.fixed_sims:
+            log_size += math.log(sims)
+        return math.exp(log_size)
+
+    def predict(self, network, sims, delay, budget):
+        """Predicted lp_work of an instance; None for a network without
+        recorded solves."""
+        if network not in self.networks:
+            return None
+        if self.sized:
+            size = self.predict_size(network, sims, delay)
+            return math.exp(self.coef @ [1.0, math.log(size), math.log(budget)])
+        log_work = float((self.features([network], [sims], [delay], [budget]) @ self.coef)[0])
+        if self.fixed_sims:
+            log_work += math.log(sims)
+        return math.exp(log_work)
+
+    def predict_memory(self, network, sims, delay):
+        """Predicted peak memory (MB) of an instance; None without metrics or
+        for a network without recorded solves."""
+        size = self.predict_size(network, sims, delay)
+        if size is None:
+            return None
+        return math.exp(self.memory_coef @ [1.0, math.log(size)])
+
+    def choose(self, network, sims, delay, budget):
+        """(threads, LP method) of an instance; None for a network without
+        recorded solves."""
+        work = self.predict(network, sims, delay, budget)
+        if work is None:
+            return None
+        if work < DUAL_WORK:
+            return 1, 'dual'
+        return min(max(math.ceil(work / WORK_PER_THREAD), 1), MAX_THREADS), 'auto'
+
+    def memory(self, network, sims, delay):
+        """Memory (GB) of a job for an instance; None without metrics or for
+        a network without recorded solves."""
+        memory = self.predict_memory(network, sims, delay)
+        if memory is None:
+            return None
+        return max(math.ceil(MEMORY_MARGIN*memory/1024), MIN_MEMORY)
+
+def interventionResources(model, network, sims, delay, budget, threads):
+    """(threads, memory in GB, LP method) of an intervention job. threads:
+    the generator's estimate, used without a model or recorded solves for the
+    network; the memory is then 8 GB per estimated thread."""
+    choice = None if model is None else model.choose(network, sims, delay, budget)
+    memory = None if model is None else model.memory(network, sims, delay)
+    if memory is None:
+        memory = threads*8
+    if choice is None:
+        return threads, memory, 'auto'
+    return choice[0], memory, choice[1]
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('summaries', nargs='+', help='Summary csv files or folders (with metrics files)')
+    parser.add_argument('-s', '--simulations', nargs='+', type=int, default=[100], help='Numbers of simulations')
+    parser.add_argument('-i', '--intervention_times', nargs='+', type=int, default=[6], help='Intervention times')
+    parser.add_argument('-b', '--budgets', nargs='+', type=int, default=[3], help='Budgets')
+    args = parser.parse_args()
+
+    model = CostModel(readSummaries(args.summaries), readMetrics(args.summaries))
+    fixed = " (num_sims exponent fixed to 1)" if model.fixed_sims else ""
+    if model.sized:
+        print(f"Recorded LP solves: {model.count}; R^2 of log(nonzeros): {model.size_r2:.3f}{fixed}, "
+              f"of log(lp_work): {model.r2:.3f}, of log(peak_rss_mb): {model.memory_r2:.3f}")
+    else:
+        print(f"Recorded solves: {model.count} (no metrics files: memory not modelled); "
+              f"R^2 of log(lp_work): {model.r2:.3f}{fixed}")
+    rows = []
+    for network in model.networks:
+        for s in args.simulations:
+            for i in args.intervention_times:
+                for b in args.budgets:
+                    threads, method = model.choose(network, s, i, b)
+                    rows.append({'network': network, 'num_sims': s, 'delay': i, 'budget': b,
+                                 'predicted_nonzeros': model.predict_size(network, s, i),
+                                 'predicted_work': model.predict(network, s, i, b),
+                                 'predicted_rss_mb': model.predict_memory(network, s, i),
+                                 'threads': threads, 'memory_gb': model.memory(network, s, i),
+                                 'lp_method': method})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+DESC="""LP solver backends for the intervention algorithm.
+
+GroupLP (algorithm_groupint_general_v2.py) and BendersLP (lp_decomposition.py)
+build and modify their LPs through this interface, so the same model can be
+solved with Gurobi (gurobipy; a license is required) or with the open-source
+HiGHS (highspy). Columns and rows are referred to by their index, in order of
+creation; the objective is minimized. The solver package is only imported
+when its backend is created.
+
+methods: 'dual' (dual simplex; warm starts from the previous basis after
+bound, right-hand side and row changes), 'primal' (primal simplex; warm
+starts after objective changes), 'barrier' and 'concurrent'.
+"""
+
+import time
+import numpy as np
+
+BACKENDS = ('gurobi', 'highs')
+# gurobipy Env shared by the Gurobi models of a long-lived process (see
+# lp_worker.py); None: the default environment
+GUROBI_ENV = None
+
+def makeBackend(backend, name, threads=1, output=True):
+    """New, empty LP. backend: one of BACKENDS."""
+    if backend == 'gurobi':
+        return GurobiBackend(name, threads, output)
+    if backend == 'highs':
+        return HighsBackend(name, threads, output)
+    raise ValueError(f"Unknown LP backend {backend}; use one of {', '.join(BACKENDS)}.")
+
+class GurobiBackend:
+    """LP in a gurobipy Model."""
+    METHODS = {'primal': 0, 'dual': 1, 'barrier': 2, 'concurrent': 3}
+
+    def __init__(self, name, threads=1, output=True):
+        import gurobipy as gp # gurobi installation required
+        self.gp = gp
+        self.m = gp.Model(name, env=GUROBI_ENV)
+        self.m.Params.Threads = threads
+        if not output:
+            self.m.Params.OutputFlag = 0
+        self.m.ModelSense = gp.GRB.MINIMIZE
+        self.vars, self.constrs = [], []
+
+    def set_method(self, method):
+        self.m.Params.Method = self.METHODS[method]
+
+    def add_cols(self, lb, ub, obj):
+        v = self.m.addMVar(len(obj), lb=lb, ub=np.where(np.isinf(ub), self.gp.GRB.INFINITY, ub), obj=obj)
+        self.vars += v.tolist()
+        return np.arange(len(self.vars)-len(obj), len(self.vars))
+
+    def add_rows(self, A, sense, rhs):
+        """Rows A x (sense) rhs; A: sparse matrix over all columns; sense:
+        '<', '>' or '=' (one or one per row)."""
+        c = self.m.addMConstr(A, self.gp.MVar.fromlist(self.vars), sense, rhs)
+        self.constrs += c.tolist()
+        return np.arange(len(self.constrs)-A.shape[0], len(self.constrs))
+
+    def set_names(self, cols, col_names, rows, row_names):
+        self.m.update()
+        self.m.setAttr("VarName", [self.vars[c] for c in cols], col_names)
+        self.m.setAttr("ConstrName", [self.constrs[r] for r in rows], row_names)
+
+    def set_bounds(self, cols, lb=None, ub=None):
+        variables = [self.vars[c] for c in cols]
+        if lb is not None:
+            self.m.setAttr("LB", variables, np.broadcast_to(lb, len(variables)).tolist())
+        if ub is not None:
+            self.m.setAttr("UB", variables, np.broadcast_to(ub, len(variables)).tolist())
+
+    def set_obj(self, cols, obj):
+        self.m.setAttr("Obj", [self.vars[c] for c in cols], np.broadcast_to(obj, len(cols)).tolist())
+
+    def get_obj(self):
+        self.m.update()
+        return np.array(self.m.getAttr("Obj", self.vars))
+
+    def set_obj_constant(self, constant):
+        self.m.ObjCon = constant
+
+    def set_rhs(self, rows, rhs):
+        self.m.setAttr("RHS", [self.constrs[r] for r in rows], np.broadcast_to(rhs, len(rows)).tolist())
+
+    def remove_rows(self, rows):
+        self.m.remove([self.constrs[r] for r in rows])
+
+    def update(self):
+        self.m.update()
+
+    def size(self):
+        """(rows, columns, nonzeros)"""
+        self.m.update()
+        return self.m.NumConstrs, self.m.NumVars, self.m.NumNZs
+
+    def solve(self):
+        self.m.update()
+        self.m.optimize()
+        if self.m.Status != self.gp.GRB.OPTIMAL:
+            raise RuntimeError(f"Gurobi: LP not solved to optimality (status {self.m.Status}).")
+
+    @property
+    def objective(self):
+        return self.m.ObjVal
+
+    def values(self):
+        return np.array(self.m.getAttr("X", self.vars))
+
+    @property
+    def runtime(self):
+        return self.m.Runtime
+
+    @property
+    def work(self):
+        return self.m.Work
+
+    def write(self, filename):
+        self.m.update()
+        self.m.write(filename)
+
+    def dispose(self):
+        self.m.dispose()
+
+class HighsBackend:
+    """LP in a highspy Highs instance. Removed rows are kept as free rows,
+    so that row indices do not change. work: number of simplex and barrier
+    iterations."""
+
+    def __init__(self, name, threads=1, output=True):
+        import highspy
+        self.h = h = highspy.Highs()
+        self.name = name
+        self.inf = h.getInfinity()
+        h.setOptionValue("output_flag", bool(output))
+        h.setOptionValue("threads", int(threads))
+        self.lb, self.ub, self.cost = np.zeros(0), np.zeros(0), np.zeros(0)
+        self.sense = np.zeros(0, dtype='<U1')
+        self.run_time = 0.0
+
+    def set_method(self, method):
+        if method in ('dual', 'primal'):
+            self.h.setOptionValue("solver", "simplex")
+            self.h.setOptionValue("simplex_strategy", 1 if method == 'dual' else 4)
+        else:
+            self.h.setOptionValue("solver", "ipm" if method == 'barrier' else "choose")
+
+    def add_cols(self, lb, ub, obj):
+        n = len(obj)
+        lb, ub = np.broadcast_to(lb, n).astype(float), np.broadcast_to(ub, n).astype(float)
+        self.h.addCols(n, np.asarray(obj, dtype=float), lb, np.minimum(ub, self.inf),
+                       0, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0))
+        self.lb, self.ub = np.concatenate([self.lb, lb]), np.concatenate([self.ub, ub])
+        self.cost = np.concatenate([self.cost, np.asarray(obj, dtype=float)])
+        return np.arange(len(self.lb)-n, len(self.lb))
+
+    def row_bounds(self, sense, rhs):
+        lower = np.where(sense == '<', -self.inf, rhs)
+        upper = np.where(sense == '>', self.inf, rhs)
+        return lower, upper
+
+    def add_rows(self, A, sense, rhs):
+        """Rows A x (sense) rhs; A: sparse matrix over all columns; sense:
+        '<', '>' or '=' (one or one per row)."""
+        A = A.tocsr()
+        k = A.shape[0]
+        sense = np.broadcast_to(np.asarray(sense), k).astype('<U1')
+        lower, upper = self.row_bounds(sense, np.broadcast_to(rhs, k).astype(float))
+        self.h.addRows(k, lower, upper, A.nnz, A.indptr[:-1].astype(np.int32),
+                       A.indices.astype(np.int32), A.data.astype(float))
+        self.sense = np.concatenate([self.sense, sense])
+        return np.arange(len(self.sense)-k, len(self.sense))
+
+    def set_names(self, cols, col_names, rows, row_names):
+        for c, n in zip(cols, col_names):
+            self.h.passColName(int(c), n)
+        for r, n in zip(rows, row_names):
+            self.h.passRowName(int(r), n)
+
+    def set_bounds(self, cols, lb=None, ub=None):
+        cols = np.asarray(cols, dtype=np.int64)
+        if lb is not None:
+            self.lb[cols] = lb
+        if ub is not None:
+            self.ub[cols] = ub
+        if len(cols):
+            self.h.changeColsBounds(len(cols), cols.astype(np.int32), self.lb[cols],
+                                    np.minimum(self.ub[cols], self.inf))
+
+    def set_obj(self, cols, obj):
+        cols = np.asarray(cols, dtype=np.int32)
+        if len(cols):
+            self.cost[cols] = obj
+            self.h.changeColsCost(len(cols), cols, np.broadcast_to(obj, len(cols)).astype(float))
+
+    def get_obj(self):
+        return self.cost.copy()
+
+    def set_obj_constant(self, constant):
+        self.h.changeObjectiveOffset(float(constant))
+
+    def set_rhs(self, rows, rhs):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows):
+            lower, upper = self.row_bounds(self.sense[rows], np.broadcast_to(rhs, len(rows)).astype(float))
+            self.h.changeRowsBounds(len(rows), rows.astype(np.int32), lower, upper)
+
+    def remove_rows(self, rows):
+        rows = np.asarray(rows, dtype=np.int32)
+        if len(rows):
+            self.h.changeRowsBounds(len(rows), rows, np.full(len(rows), -self.inf),
+                                    np.full(len(rows), self.inf))
+
+    def update(self):
+        pass
+
+    def size(self):
+        """(rows, columns, nonzeros); removed rows are counted"""
+        return self.h.getNumRow(), self.h.getNumCol(), self.h.getNumNz()
+
+    def solve(self):
+        start = time.time()
+        self.h.run()
+        self.run_time = time.time()-start
+        status = self.h.getModelStatus()
+        if self.h.modelStatusToString(status) != "Optimal":
+            raise RuntimeError(f"HiGHS: LP not solved to optimality ({self.h.modelStatusToString(status)}).")
+
+    @property
+    def objective(self):
+        return self.h.getInfo().objective_function_value
+
+    def values(self):
+        return np.array(self.h.getSolution().col_value)
+
+    @property
+    def runtime(self):
+        return self.run_time
+
+    @property
+    def work(self):
+        info = self.h.getInfo()
+        return float(info.simplex_iteration_count + max(info.ipm_iteration_count, 0))
+
+    def write(self, filename):
+        self.h.writeModel(filename)
+
+    def dispose(self):
+        self.h.clear()
@@ -0,0 +1,368 @@
+DESC="""Scenario decomposition of the group-intervention LP.
+
+The LP of algorithm_groupint_general_v2.py couples its simulations
+(scenarios) only through the group variables x. For a fixed x, the least y of
+a simulation follows from a max-plus recursion over its time-expanded graph,
+in time order:
+    y_v = 1 for fixed nodes (before the intervention time, and sources),
+    y_v = max(0, max over live in-edges u -> v of y_u - x[g(v)]) otherwise,
+and z_c is the largest y of the nodes of cell c. Its value sum_c z_c equals
+the LP value of the simulation, a convex piecewise-linear function of x;
+following the maximizing in-edges back from each cell gives the slope of the
+active piece (a subgradient).
+
+BendersLP solves the LP by cutting planes (Benders decomposition): a small
+master LP over x and one variable theta per block of simulations collects the
+cuts theta_b >= f_b(x^k) + g_b (x - x^k), and worker processes evaluate f_b
+and g_b exactly at the master's x. Each worker reads and keeps only its own
+blocks of the DAG file, so memory grows with the block size instead of the
+number of simulations.
+
+Used by algorithm_groupint_general_v2.py --decompose.
+"""
+
+import os
+import time
+import multiprocessing as mp
+import numpy as np
+import scipy.sparse as sp
+import pandas as pd
+from lp_backends import makeBackend
+from gm_compute import gm
+from cascade_dag import CascadeDAG, simulation_ids
+from algorithm_groupint_general_v2 import cascadeGraph, cascadeStatus, cascadeScenarios, rounding, \
+    canonicalSolve, tieWeights, ROUNDING_TOLERANCE
+
+class ScenarioBlock:
+    """Cascades (CascadeGraph, None if empty) with their weights, as one
+    disjoint time-expanded graph. groups: sorted array of all groups; x is
+    indexed by position in it."""
+
+    def __init__(self, graphs, weights, groups):
+        self.graphs, self.weights, self.groups = graphs, list(weights), groups
+
+    def set_int_time(self, int_time):
+        """Prepares the recursion for an intervention time. Returns the
+        groups (positions) of sources after int_time, whose x must be 0, and
+        the weighted number of cells with a fixed node."""
+        fixed, node_cell, node_group, cell_fixed, cell_weight, cell_scenario = [], [], [], [], [], []
+        e_u, e_v, e_time, x_zero = [], [], [], []
+        nodes = cells = 0
+        for scenario, (graph, weight) in enumerate(zip(self.graphs, self.weights)):
+            if graph is None:
+                continue
+            status = cascadeStatus(graph, int_time)
+            t_u, t_v = graph.n_time[status.e_u], graph.n_time[status.e_v]
+            if np.any(t_v <= t_u):
+                raise ValueError(f"Simulation {graph.sim_id}: edges must go forward in time.")
+            fixed.append(status.fixed)
+            node_cell.append(cells + graph.node_cell)
+            node_group.append(np.searchsorted(self.groups, graph.n_group))
+            cell_fixed.append(status.cell_fixed)
+            cell_weight.append(np.full(len(graph.cell_first), weight))
+            cell_scenario.append(np.full(len(graph.cell_first), scenario))
+            e_u.append(nodes + status.e_u)
+            e_v.append(nodes + status.e_v)
+            e_time.append(t_v)
+            late = graph.sources[graph.n_time[graph.sources] >= int_time]
+            x_zero.append(node_group[-1][late])
+            nodes += len(graph.node_first)
+            cells += len(graph.cell_first)
+        concat = lambda a, dtype: np.concatenate(a) if a else np.zeros(0, dtype=dtype)
+        self.fixed = concat(fixed, bool)
+        self.node_cell = concat(node_cell, np.int64)
+        self.node_group = concat(node_group, np.int64)
+        self.cell_fixed = concat(cell_fixed, bool)
+        self.cell_weight = concat(cell_weight, np.int64)
+        self.cell_scenario = concat(cell_scenario, np.int64)
+        # live edges by time of the target: all in-edges of a node are
+        # evaluated after those of its predecessors
+        e_time = concat(e_time, np.int64)
+        order = np.argsort(e_time, kind='stable')
+        e_u, e_v, e_time = concat(e_u, np.int64)[order], concat(e_v, np.int64)[order], e_time[order]
+        split = np.flatnonzero(np.diff(e_time))+1
+        self.levels = list(zip(np.split(e_u, split), np.split(e_v, split))) if len(e_u) else []
+        return np.unique(concat(x_zero, np.int64)), int(self.cell_weight[self.cell_fixed].sum())
+
+    def fixed_cells(self):
+        """Weighted number of cells with a fixed node, per scenario."""
+        return np.bincount(self.cell_scenario[self.cell_fixed], self.cell_weight[self.cell_fixed],
+                           minlength=len(self.graphs))
+
+    def recursion(self, x):
+        """Least y and z for x (indexed like groups), and the maximizing
+        in-edge of each node (-1 if none)."""
+        y = self.fixed.astype(float)
+        pred = np.full(len(y), -1, dtype=np.int64)
+        for u, v in self.levels:
+            reach = y[u] - x[self.node_group[v]]
+            np.maximum.at(y, v, reach)
+            best = (reach > 0) & (reach == y[v])
+            pred[v[best]] = u[best]
+        z = self.cell_fixed.astype(float)
+        np.maximum.at(z, self.node_cell, y)
+        return y, z, pred
+
+    def evaluate(self, x, by_scenario=False):
+        """Weighted LP value of the block at x and a subgradient; with
+        by_scenario, arrays of the values and subgradients (rows) of the
+        scenarios."""
+        y, z, pred = self.recursion(x)
+        rows = len(self.graphs) if by_scenario else 1
+        grad = np.zeros((rows, len(x)))
+        # one maximizing node per open cell with z > 0; its value is
+        # 1 - (sum of x[g] over the nodes on its path from a fixed node)
+        top = np.flatnonzero((y > 0) & (y == z[self.node_cell]) & ~self.cell_fixed[self.node_cell])
+        _, first = np.unique(self.node_cell[top], return_index=True)
+        node = top[first]
+        weight = self.cell_weight[self.node_cell[node]].astype(float)
+        row = self.cell_scenario[self.node_cell[node]] if by_scenario else np.zeros(len(node), dtype=np.int64)
+        while len(node):
+            free = ~self.fixed[node]
+            node, weight, row = node[free], weight[free], row[free]
+            np.add.at(grad, (row, self.node_group[node]), -weight)
+            node = pred[node]
+            keep = node >= 0
+            node, weight, row = node[keep], weight[keep], row[keep]
+        if by_scenario:
+            return np.bincount(self.cell_scenario, z*self.cell_weight, minlength=rows), grad
+        return float((z*self.cell_weight).sum()), grad[0]
+
+    def cells(self, x, scenarios=None):
+        """z at x, one entry per cell and simulation (of the given scenarios
+        only, if any)."""
+        z = self.recursion(x)[1]
+        keep = slice(None) if scenarios is None else np.isin(self.cell_scenario, scenarios)
+        return np.repeat(z[keep], self.cell_weight[keep])
+
+def readBlock(input_file, group, groups, simulations, tree=None):
+    """ScenarioBlock of the distinct cascades of some simulations of a DAG
+    file. Its info: number of simulations, groups in order of first
+    appearance (as in the monolithic LP), weighted number of infected cells
+    and GM value (-1 without tree)."""
+    dag = CascadeDAG(input_file, group, simulations=simulations)
+    index, weight = cascadeScenarios(dag)
+    graphs = [cascadeGraph(dag.cascade(i, exclude=("EtoE",)), verbose=False) for i in index.tolist()]
+    block = ScenarioBlock(graphs, weight, groups)
+    graphs = [g for g in graphs if g is not None]
+    block.info = {
+        'simulations': dag.number_of_simulations,
+        'groups': pd.unique(np.concatenate([g.cell_group for g in graphs])).tolist() if graphs else [],
+        'infected_cells': sum(int(w)*len(g.cell_first) for g, w in zip(block.graphs, block.weights) if g is not None),
+        'gm': -1 if tree is None or dag.number_of_edges == 0 else gm(dag.to_frame(), tree)}
+    return block
+
+def blockWorker(conn, input_file, group, groups, blocks, tree):
+    """Worker process: keeps its blocks and answers requests (method name,
+    argument) with the results for all of them, until it receives None."""
+    try:
+        blocks = [readBlock(input_file, group, groups, sims, tree) for sims in blocks]
+        conn.send([b.info for b in blocks])
+        for request, arg in iter(conn.recv, None):
+            conn.send([getattr(b, request)(arg) for b in blocks])
+    except Exception as e:
+        conn.send(e)
+    conn.close()
+
+class BendersLP:
+    """The group-intervention LP solved by scenario decomposition; same
+    interface as GroupLP (set_int_time, solve, dispose).
+
+    group: dictionary cell -> group. tree: hierarchy DataFrame for the GM
+    value (None to skip it). block_size: simulations per block (default: an
+    equal share per process). processes: number of worker processes.
+    tolerance: relative gap between the best evaluated x (upper bound) and
+    the master (lower bound) at which a solve stops. backend: LP solver of
+    the master (see lp_backends). greedy_start: start each solve from the
+    greedy selection of the budget (see group_greedy) instead of the best x of
+    the previous budget. canonical: once the gap is closed, report the
+    canonical solution of the master (see canonicalSolve) if its exact value
+    is within the gap as well (else its cuts are added and the iterations go
+    on); its wall time and work are kept in canonical_runtime and
+    canonical_work, not in those of the instance. verbose: print the groups,
+    the bounds of every iteration and the LP value of every group."""
+
+    def __init__(self, input_file, group, tree=None, block_size=None, processes=1,
+                 tolerance=1e-6, max_iterations=1000, backend='gurobi', greedy_start=False, canonical=False,
+                 verbose=False):
+        ids = simulation_ids(input_file)
+        self.M = float(len(ids)) # M: total number of simulations
+        self.last_sim_id = ids[-1] if ids else -1
+        self.tolerance, self.max_iterations = tolerance, max_iterations
+        self.backend = backend
+        self.greedy_start = greedy_start
+        self.canonical = canonical
+        self.canonical_runtime = self.canonical_work = 0.0
+        self.verbose = verbose
+        self.groups = np.union1d(np.fromiter(group.values(), dtype=np.int64, count=len(group)), [-1])
+        if block_size is None:
+            block_size = -(-len(ids)//max(processes, 1))
+        blocks = [ids[i:i+block_size] for i in range(0, len(ids), max(block_size, 1))]
+        processes = max(min(processes, len(blocks)), 1)
+        print("Blocks: "+str(len(blocks))+" of at most "+str(block_size)+" simulations, "
+              +str(processes)+" processes")
+        # block b is kept by worker b % processes
+        self.assignment = [list(range(k, len(blocks), processes)) for k in range(processes)]
+        context = mp.get_context('fork')
+        self.workers = []
+        for k in range(processes):
+            conn, child = context.Pipe()
+            worker = context.Process(target=blockWorker, daemon=True,
+                                     args=(child, input_file, group, self.groups,
+                                           [blocks[b] for b in self.assignment[k]], tree))
+            worker.start()
+            child.close()
+            self.workers.append((worker, conn))
+        info = self.request(None, None)
+        self.n_blocks = len(info)
+        present = pd.unique(np.array([g for i in info for g in i['groups']], dtype=np.int64))
+        self.x_groups = present.tolist()
+        self.x_index = np.searchsorted(self.groups, present)
+        self.x_weights = tieWeights(self.x_groups)
+        self.gm_val = max([i['gm'] for i in info], default=-1) if tree is not None else -1
+        no_action = sum(i['infected_cells'] for i in info)/self.M
+        print("No Action: avg. # nodes infected "+str(no_action))
+        unique_groups = set(self.x_groups)
+        if verbose:
+            print("Unique groups "+str(unique_groups))
+        self.no_groups = len(unique_groups)-1 if -1 in unique_groups else len(unique_groups)
+        self.m = None
+        self.int_time = None
+
+    def request(self, request, arg):
+        """Sends a request to all workers; results in block order."""
+        if request is not None:
+            for _, conn in self.workers:
+                conn.send((request, arg))
+        results = {}
+        for blocks, (_, conn) in zip(self.assignment, self.workers):
+            reply = conn.recv()
+            if isinstance(reply, Exception):
+                raise reply
+            results.update(zip(blocks, reply))
+        return [results[b] for b in sorted(results)]
+
+    def full_x(self, x):
+        x_full = np.zeros(len(self.groups))
+        x_full[self.x_index] = x
+        return x_full
+
+    def set_int_time(self, int_time):
+        # the cuts depend on the intervention time: new master
+        self.int_time = int_time
+        replies = self.request('set_int_time', int_time)
+        x_zero = np.unique(np.concatenate([z for z, _ in replies]))
+        n_x = len(self.x_groups)
+        ub = np.ones(n_x)
+        ub[np.isin(self.x_index, x_zero)] = 0.0
+        if -1 in self.x_groups:
+            ub[self.x_groups.index(-1)] = 0.0 # group -1 cannot be intervened
+        if self.m is not None:
+            self.m.dispose()
+        self.m = m = makeBackend(self.backend, 'Group-Interventions-Master', threads=1, output=False)
+        m.set_method('dual')
+        # x, then theta of each block (at least its fixed cells)
+        m.add_cols(np.concatenate([np.zeros(n_x), [float(c) for _, c in replies]]),
+                   np.concatenate([ub, np.full(self.n_blocks, np.inf)]),
+                   np.concatenate([np.zeros(n_x), np.full(self.n_blocks, 1.0/self.M)]))
+        self.budget_row = m.add_rows(sp.csr_matrix(np.concatenate([np.ones(n_x), np.zeros(self.n_blocks)])[None, :]),
+                                     '<', np.zeros(1))
+        self.x_best = np.zeros(n_x)
+        self.cuts = 0
+        if self.greedy_start:
+            from group_greedy import LazyGreedy
+            self.greedy = LazyGreedy(self.blocked_value, np.flatnonzero(ub > 0).tolist())
+
+    def blocked_value(self, selected):
+        # weighted number of infected cells with x = 1 for the selected groups
+        x = np.zeros(len(self.x_groups))
+        x[selected] = 1.0
+        return sum(v for v, _ in self.request('evaluate', self.full_x(x)))
+
+    def add_cuts(self, x, values, grads):
+        # theta_b - g_b x >= f_b(x) - g_b x
+        G = np.array([g[self.x_index] for g in grads])
+        A = sp.hstack([sp.csr_matrix(-G), sp.identity(self.n_blocks, format='csr')], format='csr')
+        A.eliminate_zeros()
+        self.m.add_rows(A, '>', np.array(values) - G @ x)
+        self.cuts += self.n_blocks
+
+    def solve(self, budget_groups, gm_val=-1, fixed_budget=None, replay=None):
+        # gm_val: -1 if GM is not used for rounding; replay: see rounding
+        m, n_x = self.m, len(self.x_groups)
+        m.set_rhs(self.budget_row, budget_groups)
+        # start from the best x of the previous budget, scaled to the budget
+        x = self.x_best
+        if x.sum() > budget_groups:
+            x = x*(budget_groups/x.sum())
+        if self.greedy_start:
+            x = np.zeros(n_x)
+            x[self.greedy.select(int(budget_groups))] = 1.0
+        start = time.time()
+        upper, lower, work = np.inf, -np.inf, 0.0
+        self.canonical_runtime = self.canonical_work = 0.0
+        canonical = False
+        for iteration in range(self.max_iterations):
+            replies = self.request('evaluate', self.full_x(x))
+            values, grads = [v for v, _ in replies], [g for _, g in replies]
+            value = sum(values)/self.M
+            if canonical and value - lower <= self.tolerance*max(1.0, abs(value)):
+                upper, self.x_best = value, x
+                break
+            if value < upper:
+                upper, self.x_best = value, x
+            self.add_cuts(x, values, grads)
+            m.set_method('dual')
+            m.solve()
+            work += m.work
+            lower = m.objective
+            if self.verbose:
+                print(f"Iteration {iteration}: lower bound {lower}, upper bound {upper}, cuts {self.cuts}")
+            closed = upper - lower <= self.tolerance*max(1.0, abs(upper))
+            if closed and not self.canonical:
+                break
+            canonical = closed
+            if canonical:
+                # the optimal x that does not depend on the earlier solves
+                canonical_start = time.time()
+                values, _, w = canonicalSolve(m, np.arange(n_x), self.x_weights)
+                self.canonical_runtime += time.time()-canonical_start
+                self.canonical_work += w
+                x = values[:n_x]
+            else:
+                x = m.values()[:n_x]
+        else:
+            print("Gap not closed after "+str(self.max_iterations)+" iterations")
+        print(f"Iterations: {iteration+1}, bounds {lower}, {upper}, cuts {self.cuts}")
+        LP_objValue = upper
+        x = dict(zip(self.x_groups, self.x_best.tolist()))
+        if self.verbose:
+            for key in x.keys():
+                print(key, x[key])
+        print("Re-done budget")
+        lp_budget = 0.0
+        for key, val in x.items():
+            lp_budget += val
+        print("budget used by LP "+str(lp_budget))
+        no_groups = self.no_groups
+        print("# groups: " + str(no_groups))
+        z = np.concatenate(self.request('cells', self.full_x(self.x_best)))
+        tolerance = ROUNDING_TOLERANCE if self.canonical else 0.0
+        if gm_val != -1:
+            # use gm to round instead
+            X,Y,Z,full_info = rounding(x,z, 1, fixed_budget=fixed_budget, replay=replay, verbose=self.verbose,
+                                       tolerance=tolerance)
+        else:
+            X,Y,Z,full_info = rounding(x,z, no_groups, fixed_budget=fixed_budget, replay=replay,
+                                       verbose=self.verbose, tolerance=tolerance)
+        r = time.time()-start-self.canonical_runtime
+        print("Optimizer runtime: "+str(r))
+        print("Optimizer work time: "+str(work))
+        return X,Y,Z, no_groups, LP_objValue, self.M, lp_budget, self.last_sim_id, gm_val, r, work, full_info
+
+    def dispose(self):
+        for worker, conn in self.workers:
+            conn.send(None)
+            worker.join()
+        if self.m is not None:
+            self.m.dispose()
@@ -0,0 +1,201 @@
+DESC="""Long-lived worker for the intervention algorithm, fed by a file queue.
+
+Every run of algorithm_groupint_general_v2.py starts Python, imports pandas,
+networkx and gurobipy, checks out a Gurobi license and reads the hierarchy;
+for small DAGs this takes longer than the solve. A worker does this once: it
+keeps the modules loaded, one Gurobi environment (lp_backends.GUROBI_ENV) and
+the hierarchies it has read, and runs the tasks of a queue folder one after
+the other, in-process (algorithm_groupint_general_v2.main). A task is the
+argument list of algorithm_groupint_general_v2.py, run in the directory it
+was submitted from. Several workers can serve the same queue.
+
+The queue is a folder on a local (or shared) file system: tasks are files in
+pending/, claimed by renaming them to running/ and reported in done/. No
+other service is needed. submit only imports the standard library.
+
+Examples:
+python lp_worker.py serve ../work/lp_queue --idle_timeout 600 &
+python lp_worker.py submit ../work/lp_queue --wait -- ../work/dags/BD_S1_0_dag.csv \\
+    ../input/networks/BD/hierarchy.tree -b 1 3 -i 6 --input_code BD_S1_0
+python lp_worker.py stop ../work/lp_queue
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import time
+import traceback
+import uuid
+
+POLL = 0.2 # seconds between looks at the queue
+
+def queueFolder(queue, name):
+    folder = os.path.join(queue, name)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def writeJSON(filename, data):
+    """Writes data to filename atomically (temporary file and rename)."""
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, filename)
+
+def submit(queue, argv, log=None):
+    """Adds a task (arguments of algorithm_groupint_general_v2.py) to the
+    queue; returns its name. log: file for the output of the task (default:
+    the worker's output)."""
+    name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}.json" # in order of submission
+    task = {'args': list(argv), 'cwd': os.getcwd(),
+            'log': None if log is None else os.path.abspath(log)}
+    queueFolder(queue, 'done')
+    writeJSON(os.path.join(queueFolder(queue, 'pending'), name), task)
+    return name
+
+def wait(queue, name, timeout=None):
+    """Result of a task ({'status': exit code, 'runtime': seconds}), once it
+    is done; None after timeout seconds."""
+    filename = os.path.join(queue, 'done', name)
+    start = time.time()
+    while not os.path.isfile(filename):
+        if timeout is not None and time.time()-start > timeout:
+            return None
+        time.sleep(POLL)
+    with open(filename) as f:
+        result = json.load(f)
+    os.remove(filename)
+    return result
+
+def claim(pending, running):
+    """Moves the oldest pending task to running; None if there is none. The
+    rename fails if another worker claimed the task first."""
+    for name in sorted(os.listdir(pending)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            os.rename(os.path.join(pending, name), os.path.join(running, f"{name}.{os.getpid()}"))
+            return name
+        except FileNotFoundError:
+            continue
+    return None
+
+def requeueStale(pending, running):
+    """Puts the tasks of workers that no longer run (on this node) back in
+    the queue."""
+    for filename in os.listdir(running):
+        name, pid = filename.rsplit('.', 1)
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            os.rename(os.path.join(running, filename), os.path.join(pending, name))
+            print(f"Requeued {name}")
+        except (PermissionError, ValueError):
+            pass
+
+def runTask(task, algorithm, hierarchies):
+    """Runs one task; returns its exit code."""
+    cwd = os.getcwd()
+    log = open(task['log'], 'a') if task['log'] is not None else None
+    try:
+        os.chdir(task['cwd'])
+        with contextlib.redirect_stdout(log or sys.stdout), contextlib.redirect_stderr(log or sys.stderr):
+            try:
+                algorithm.main(task['args'], hierarchies)
+                return 0
+            except SystemExit as e: # argparse errors
+                return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception:
+                traceback.print_exc()
+                return 1
+    finally:
+        os.chdir(cwd)
+        if log is not None:
+            log.close()
+        gc.collect()
+
+def serve(queue, idle_timeout=None, gurobi=True):
+    """Runs the tasks of the queue until a stop file exists and the queue is
+    empty, or no task came for idle_timeout seconds."""
+    pending, running, done = (queueFolder(queue, f) for f in ('pending', 'running', 'done'))
+    requeueStale(pending, running)
+    import algorithm_groupint_general_v2 as algorithm
+    import lp_backends
+    if gurobi:
+        try:
+            import gurobipy as gp
+            lp_backends.GUROBI_ENV = gp.Env()
+        except ImportError:
+            print("gurobipy not available; tasks with --solver gurobi will fail")
+    hierarchies = {}
+    count, idle = 0, time.time()
+    print(f"Worker {os.getpid()} serving {queue}")
+    while True:
+        name = claim(pending, running)
+        if name is None:
+            if os.path.isfile(os.path.join(queue, 'stop')) or \
+                    (idle_timeout is not None and time.time()-idle > idle_timeout):
+                break
+            time.sleep(POLL)
+            continue
+        claimed = os.path.join(running, f"{name}.{os.getpid()}")
+        with open(claimed) as f:
+            task = json.load(f)
+        start = time.time()
+        status = runTask(task, algorithm, hierarchies)
+        runtime = time.time()-start
+        writeJSON(os.path.join(done, name), {'status': status, 'runtime': runtime})
+        os.remove(claimed)
+        count += 1
+        idle = time.time()
+        print(f"Task {name}: status {status}, {runtime:.2f} s")
+    if lp_backends.GUROBI_ENV is not None:
+        lp_backends.GUROBI_ENV.dispose()
+        lp_backends.GUROBI_ENV = None
+    print(f"Worker {os.getpid()} done: {count} tasks")
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('serve', help='Run the tasks of a queue')
+    p.add_argument('queue', help='Queue folder')
+    p.add_argument('--idle_timeout', type=float, help='Stop after this many seconds without tasks')
+    p.add_argument('--no_gurobi', action='store_true', help='Do not create a Gurobi environment (e.g. only --solver highs)')
+    p = commands.add_parser('submit', help='Add a task to a queue: submit QUEUE [options] -- ARGS, '
+                            'with the arguments of algorithm_groupint_general_v2.py after --')
+    p.add_argument('queue', help='Queue folder')
+    p.add_argument('--log', help='Write the output of the task to this file')
+    p.add_argument('--wait', action='store_true', help='Wait for the task and exit with its exit code')
+    p.add_argument('--timeout', type=float, help='With --wait: give up after this many seconds (exit code 1)')
+    p = commands.add_parser('stop', help='Stop the workers of a queue once it is empty')
+    p.add_argument('queue', help='Queue folder')
+    # the arguments of a task follow --
+    argv = sys.argv[1:]
+    task_args = argv[argv.index('--')+1:] if '--' in argv else []
+    args = parser.parse_args(argv[:argv.index('--')] if '--' in argv else argv)
+
+    if args.command == 'serve':
+        if os.path.isfile(os.path.join(args.queue, 'stop')):
+            os.remove(os.path.join(args.queue, 'stop'))
+        serve(args.queue, args.idle_timeout, gurobi=not args.no_gurobi)
+    elif args.command == 'submit':
+        if not task_args:
+            parser.error('submit: no arguments for algorithm_groupint_general_v2.py (after --)')
+        name = submit(args.queue, task_args, args.log)
+        print(name)
+        if args.wait:
+            result = wait(args.queue, name, args.timeout)
+            if result is None:
+                print(f"Task {name} not done after {args.timeout} s")
+                sys.exit(1)
+            print(f"Task {name}: status {result['status']}, {result['runtime']:.2f} s")
+            sys.exit(result['status'])
+    else:
+        os.makedirs(args.queue, exist_ok=True)
+        open(os.path.join(args.queue, 'stop'), 'w').close()
+
+if __name__ == '__main__':
+    main()
@@ -4,22 +4,28 @@ functionality. A multiscale network consists of (1) a sequence of networks
 tree (hierarchy.tree) that specifies the parent-child relationship between
 nodes of different levels.
 
-Pending:
-- Mandatory column testing.
-- To verify the hierarchy tree, it is read in as a string dataframe. This is a
-  potential performance issue. However, it permits using different data types
-  at different levels.
-By: MS and AA
+Files are read with explicit types for the known columns. Validation (unique
+node ids, hierarchy levels, tree check) uses array lookups and union-find; with
+a validation manifest, networks whose files have not changed since they were
+last validated skip it.
 
-(Unchanged, but other scripts depend on this)
+The class also provides contiguous node indices, CSR adjacency per level (and
+month) and cell <-> locality index arrays, built once on demand, so that the
+simulator, the intervention LP and other consumers need not re-derive them
+from the DataFrames.
+By: MS and AA
 """
 import argparse
+import hashlib
+import json
 import logging
+import os
+import tempfile
+from collections import namedtuple
 import numpy as np
 import pandas as pd
 import pdb
 from glob import glob
-import networkx as nx
 from pdb import set_trace
 
 EPI="""The file format for node file is:
@@ -38,6 +44,136 @@ source,target,Time,Weight,Condition
 The node and the edge file have levelnumber.node, levelnumber.edge naming convention. 
 """ 
 
+# Mandatory columns
+NODE_COLUMNS=['node']
+EDGE_COLUMNS=['source','target']
+HIERARCHY_COLUMNS=['parent','child']
+# Country columns of the level 0 and level 1 node files
+COUNTRY_COLUMNS=['country_name','country']
+MONTH_COLUMNS=[str(m) for m in range(1,13)] # monthly production
+CHUNK_SIZE=1000000 # rows per chunk when reading a subset of a file
+HASH_BLOCK=1<<20 # bytes read at a time when hashing a network file
+# Types of known columns, so that pandas need not infer them. Other columns
+# (names, countries) are inferred.
+DTYPES={
+    'node':'int64', 'source':'int64', 'target':'int64',
+    'parent':'int64', 'child':'int64',
+    'cell_id':'int64', 'cell_id_x':'int64', 'cell_id_y':'int64',
+    'moore':'int64', 'month':'int64',
+    'weight':'float64', 'haversine':'float64',
+    **{m:'float64' for m in MONTH_COLUMNS}
+}
+
+# Compressed sparse row adjacency; see MultiScaleNet.adjacency
+CSR=namedtuple('CSR',['indptr','indices','edge'])
+# Group membership; see MultiScaleNet.group_index. cell_group[i]: locality
+# index of cell i (-1: none). The cells of locality g are
+# members[indptr[g]:indptr[g+1]].
+GroupIndex=namedtuple('GroupIndex',['cell_group','indptr','members'])
+
+def level_columns(columns, level):
+    if isinstance(columns, dict):
+        return columns.get(level)
+    return columns
+
+def read_table(fileName, mandatory, columns=None, exclude=(), rows=None):
+    """Reads a node, edge or hierarchy file with explicit types. If columns
+    is given, only those (and the mandatory ones) are read; columns in
+    exclude are never read. rows optionally selects rows (DataFrame ->
+    boolean mask); the file is then read in chunks, so that only selected
+    rows are held in memory."""
+    keep=None if columns is None else set(columns)|set(mandatory)
+    usecols=None
+    if keep is not None or len(exclude):
+        usecols=lambda c: c not in exclude and (keep is None or c in keep)
+    try:
+        if rows is None:
+            df=pd.read_csv(fileName, dtype=DTYPES, usecols=usecols)
+        else:
+            chunks=[]
+            for chunk in pd.read_csv(fileName, dtype=DTYPES, usecols=usecols, chunksize=CHUNK_SIZE):
+                check_columns(fileName, chunk, mandatory)
+                chunks.append(chunk[rows(chunk)])
+            if len(chunks):
+                df=pd.concat(chunks, ignore_index=True)
+            else:
+                df=pd.read_csv(fileName, dtype=DTYPES, usecols=usecols, nrows=0)
+    except FileNotFoundError:
+        raise FileNotFoundError(f'Expected file {fileName} is absent.')
+    except ValueError as e:
+        # e.g. non-integer node ids
+        raise ValueError(f'{fileName}: {e}')
+    check_columns(fileName, df, mandatory)
+    return df
+
+def check_columns(fileName, df, mandatory):
+    missing=[c for c in mandatory if c not in df.columns]
+    if missing:
+        raise ValueError(f"{fileName}: {', '.join(missing)} column(s) should be present.")
+
+def window_months(startMonth, timeSteps):
+    """Calendar months (1-12) used by a simulation of timeSteps monthly
+    steps starting at startMonth; same mapping as monthTimeStepMap in
+    run_spread_v2.py."""
+    monthTimeStepMap=np.roll(np.arange(timeSteps+1) % 12, -startMonth+1) + 1
+    return sorted(set(monthTimeStepMap.tolist()))
+
+def is_tree(parent, child):
+    """True if the undirected graph of parent-child edges is a tree (as
+    networkx.is_tree), checked with union-find."""
+    # Repeated or reversed edges are one edge of the undirected graph
+    edges=np.unique(np.stack([np.minimum(parent,child),np.maximum(parent,child)],axis=1),axis=0)
+    nodes,index=np.unique(edges,return_inverse=True)
+    if len(nodes)==0 or len(edges)!=len(nodes)-1:
+        return False
+    # n-1 edges without a cycle connect all n nodes
+    root=list(range(len(nodes)))
+    size=[1]*len(nodes)
+    for a,b in index.reshape(-1,2).tolist():
+        while root[a]!=a:
+            root[a]=root[root[a]]
+            a=root[a]
+        while root[b]!=b:
+            root[b]=root[root[b]]
+            b=root[b]
+        if a==b:
+            return False
+        if size[a]<size[b]:
+            a,b=b,a
+        root[b]=a
+        size[a]+=size[b]
+    return True
+
+def network_hash(networkFolder, numberOfLevels):
+    """Hash of the contents of the network files."""
+    h=hashlib.sha1()
+    files=[f'{l}.{t}' for l in range(numberOfLevels) for t in ('nodes','edges')]+['hierarchy.tree']
+    for f in files:
+        h.update(f.encode())
+        digest=hashlib.sha1()
+        with open(f'{networkFolder}/{f}','rb') as fp:
+            for block in iter(lambda: fp.read(HASH_BLOCK), b''):
+                digest.update(block)
+        h.update(digest.digest())
+    return h.hexdigest()
+
+def read_manifest(manifest):
+    try:
+        with open(manifest) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def write_manifest(manifest, validated):
+    # Many jobs may share a manifest: write to a temporary file and rename, so
+    # that readers never see a partial file. Concurrent writers may drop each
+    # other's entries, which only costs a re-validation.
+    folder=os.path.dirname(os.path.abspath(manifest))
+    fd,tmp=tempfile.mkstemp(dir=folder,suffix='.tmp')
+    with os.fdopen(fd,'w') as f:
+        json.dump(validated,f,indent=1)
+    os.replace(tmp,manifest)
+
 class MultiScaleNet:   
 
     def __init__(self):
@@ -47,8 +183,23 @@ class MultiScaleNet:
         self.edges=[]
         self.hierarchy=None
         self.number_of_levels=0    
+        self._index={} # lookups built on demand by the index methods
 
-    def read_from_folder(self,networkFolder):
+    def read_from_folder(self,networkFolder,nodeColumns=None,edgeColumns=None,manifest=None,
+                         localities=None,countries=None,months=None):
+        """Reads the network. nodeColumns and edgeColumns optionally restrict
+        the columns read from the node and edge files (one list for all
+        levels, or a dict level -> list); mandatory columns are always read.
+        If a manifest file is given, networks whose files are listed in it as
+        validated are not validated again; newly validated networks are
+        added to it.
+
+        A region can be read instead of the whole network: localities (level
+        1 ids) keeps those localities and their cells, countries keeps the
+        cells and localities of those countries. Only edges and hierarchy
+        rows within the region are kept. months (1-12) restricts the monthly
+        production columns and the long-distance edges to those months
+        (see window_months)."""
 
         self.name=networkFolder
 
@@ -58,61 +209,202 @@ class MultiScaleNet:
         self.number_of_levels=len(nodeFiles)
         if self.number_of_levels != len(edgeFiles):
             raise Exception('Number of node files and number of edge files do not match.')
+        subset=localities is not None or countries is not None
+        if subset and self.number_of_levels<2:
+            raise ValueError('A region subset needs level 0 (cells) and level 1 (localities).')
+        excludeMonths=[] if months is None else [m for m in MONTH_COLUMNS if int(m) not in months]
+
+        # Read hierarchy
+        self.hierarchy=read_table(f'{networkFolder}/hierarchy.tree', HIERARCHY_COLUMNS)
 
-        # Read nodes
-        nodeLevelMapper=pd.DataFrame(columns = {'node': [], 'level': []})
-        df_list = []
+        # Read nodes; localities first, since cells of a locality subset
+        # follow from them
+        nodes={}
+        for l in sorted(range(self.number_of_levels),key=lambda l: l!=1):
+            columns=level_columns(nodeColumns,l)
+            if countries is not None and columns is not None:
+                columns=list(columns)+COUNTRY_COLUMNS # needed to select rows
+            df=read_table(f'{networkFolder}/{l}.nodes', NODE_COLUMNS, columns, excludeMonths)
+            if l==1 and localities is not None:
+                df=df[df.node.isin(localities)]
+                unknown=sorted(set(localities)-set(df.node))
+                if unknown:
+                    raise ValueError(f'{networkFolder}: unknown localities {unknown}.')
+            elif l==0 and localities is not None:
+                cells=self.hierarchy.child[self.hierarchy.parent.isin(nodes[1].node)]
+                df=df[df.node.isin(cells)]
+            if countries is not None and l<=1:
+                country=[c for c in COUNTRY_COLUMNS if c in df.columns]
+                if len(country)==0:
+                    raise ValueError(f'{networkFolder}/{l}.nodes: no country column.')
+                df=df[df[country[0]].isin(countries)]
+                if columns is not None:
+                    df=df.drop(columns=[c for c in country if c not in level_columns(nodeColumns,l)])
+            nodes[l]=df.reset_index(drop=True) if subset else df
+        self.nodes=[nodes[l] for l in range(self.number_of_levels)]
+        if subset and (len(nodes[0])==0 or len(nodes[1])==0):
+            raise ValueError(f'{networkFolder}: the region (localities {localities}, countries {countries}) '
+                             'has no cells or no localities.')
+
+        if subset:
+            kept=pd.concat([n.node for n in self.nodes])
+            self.hierarchy=self.hierarchy[self.hierarchy.child.isin(kept)
+                    & (self.hierarchy.parent.isin(kept) | (self.hierarchy.parent==-1))
+                    ].reset_index(drop=True)
+
+        # Read edges
         for l in range(self.number_of_levels):
-            nodeFileName=f'{networkFolder}/{l}.nodes'
-            try:
-                currentLevelNodes=pd.read_csv(nodeFileName)
-                if 'node' not in currentLevelNodes.columns:
-                    raise Exception(f"{nodeFileName}: 'node' column should be present in node file.")
-                elif currentLevelNodes.node.dtype!=int:
-                    raise Exception(f"{nodeFileName}: 'node' should be of 'int' type.")
-                self.nodes.append(currentLevelNodes)
-            except FileNotFoundError:
-                raise  FileNotFoundError(f'Expected file {nodeFileName} is absent.')
-            df=self.nodes[l]['node'].to_frame()
-            df['level']=l
-            df_list.append(df)
-        nodeLevelMapper=pd.concat(df_list, ignore_index=True)
-        
-        #nodeLevelMapper.loc[nodeLevelMapper.shape[0]]=[-1, self.number_of_levels]
-        
+            ids=self.nodes[l].node
+            def rows(df, ids=ids):
+                keep=np.ones(len(df),dtype=bool)
+                if subset:
+                    keep&=df.source.isin(ids).to_numpy()&df.target.isin(ids).to_numpy()
+                if months is not None and 'month' in df.columns:
+                    keep&=df.month.isin(months).to_numpy()
+                return keep
+            self.edges.append(read_table(f'{networkFolder}/{l}.edges', EDGE_COLUMNS,
+                level_columns(edgeColumns,l),
+                rows=rows if subset or months is not None else None))
+
+        if manifest is None:
+            self.validate()
+        else:
+            key=network_hash(networkFolder,self.number_of_levels)
+            if subset:
+                # validity of a region does not follow from that of the network
+                key+=':'+json.dumps({'localities': None if localities is None else sorted(localities),
+                                     'countries': None if countries is None else sorted(countries)})
+            validated=read_manifest(manifest)
+            if validated.get(key)=='validated':
+                logging.debug(f"{networkFolder}: validated before, skipping checks.")
+            else:
+                self.validate()
+                validated[key]='validated'
+                write_manifest(manifest,validated)
+        self.compute_summary()
+
+    def write_to_folder(self,networkFolder):
+        """Writes the network (e.g. a region read with read_from_folder) in
+        the same format."""
+        os.makedirs(networkFolder,exist_ok=True)
+        for l in range(self.number_of_levels):
+            self.nodes[l].to_csv(f'{networkFolder}/{l}.nodes',index=False)
+            self.edges[l].to_csv(f'{networkFolder}/{l}.edges',index=False)
+        self.hierarchy.to_csv(f'{networkFolder}/hierarchy.tree',index=False)
+
+    def validate(self):
+        """Checks that node ids are unique across levels, that every node in
+        the hierarchy exists, that no node has a parent at a lower level, and
+        that the hierarchy is a tree."""
+        ids=np.concatenate([n.node.to_numpy() for n in self.nodes])
+        levels=np.repeat(np.arange(self.number_of_levels),[n.shape[0] for n in self.nodes])
+        order=np.argsort(ids,kind='stable')
+        sortedIds=ids[order]
+        sortedLevels=levels[order]
+
         # Check if there are any duplicate node ids. That is, ids which occur in 
         # more than one level.
-        x=nodeLevelMapper.node.drop_duplicates()
-        if x.shape[0]<nodeLevelMapper.shape[0]:
+        if (sortedIds[1:]==sortedIds[:-1]).any():
             raise Exception("A node id has been used in multiple levels.")
 
-        nodeLevelMapper = nodeLevelMapper.set_index('node',drop=True).squeeze()
-        nodeLevelMapper[-1] = self.number_of_levels
-        
-        # Read hierarchy and check if hierarchy conditions are met
-        self.hierarchy=pd.read_csv(f'{networkFolder}/hierarchy.tree')
-        if self.hierarchy.parent.dtype!=int or self.hierarchy.child.dtype!=int:
-            raise ValueError("Hierarchy file: All nodes should be integers.")
-        levelMappedHierarchy=self.hierarchy.replace(nodeLevelMapper)
-        
-        if np.less(levelMappedHierarchy.parent,levelMappedHierarchy.child).any():  # Each child and each parents level compare
+        def node_level(x):
+            # Level of each id; the root (-1) is above the top level
+            pos=np.searchsorted(sortedIds,x).clip(max=len(sortedIds)-1)
+            found=sortedIds[pos]==x
+            root=x==-1
+            if not (found|root).all():
+                raise ValueError(f"Hierarchy file: unknown node(s) {np.unique(x[~(found|root)])[:10].tolist()}.")
+            return np.where(root,self.number_of_levels,sortedLevels[pos])
+
+        parent=self.hierarchy.parent.to_numpy()
+        child=self.hierarchy.child.to_numpy()
+        if np.less(node_level(parent),node_level(child)).any():  # Each child and each parents level compare
             raise Exception("A node has a parent at a lower level. Check input.")
-        if not nx.is_tree(nx.from_pandas_edgelist(self.hierarchy,'parent','child')):
+        if not is_tree(parent,child):
             raise Exception("The hierachy relationship is not a tree.")
 
-        # Read edges
-        for l in range(self.number_of_levels):
-            edgeFileName='%s/%d.edges' %(networkFolder,l)
-            try:
-                x=pd.read_csv(edgeFileName)
-                if ('source' and 'target' not in x.columns):
-                    raise ValueError('Source and target columns should be present') 
-                self.edges.append(x)
-            except FileNotFoundError:
-                raise  FileNotFoundError('Expected file %s is absent.' %edgeFileName)
-            # MS: throw an error if mandatory columns are not present
-        self.compute_summary()
-   
+    def read_hierarchy(self,hierarchyFile):
+        """Reads only the hierarchy file, for consumers that need group
+        membership but not the network (see group_map)."""
+        self.hierarchy=read_table(hierarchyFile, HIERARCHY_COLUMNS)
+
+    # Index API. Nodes of a level are indexed 0..n-1 in the order of the node
+    # file. The lookups are built once and cached.
+
+    def node_ids(self,level):
+        """Node ids of a level; position i is the node with index i."""
+        return self.nodes[level].node.to_numpy()
+
+    def node_index(self,ids,level):
+        """Indices of node ids at a level; -1 for ids not at that level."""
+        key=('sorted',level)
+        if key not in self._index:
+            order=np.argsort(self.node_ids(level),kind='stable')
+            self._index[key]=(order,self.node_ids(level)[order])
+        order,sortedIds=self._index[key]
+        ids=np.asarray(ids)
+        if len(sortedIds)==0:
+            return np.full(ids.shape,-1)
+        pos=np.searchsorted(sortedIds,ids).clip(max=len(sortedIds)-1)
+        return np.where(sortedIds[pos]==ids,order[pos],-1)
+
+    def adjacency(self,level,month=None):
+        """CSR adjacency of the edges of a level (of one month, for edge
+        files with a month column). Row i lists the out-edges of node i:
+        targets indices[indptr[i]:indptr[i+1]], and their rows in
+        self.edges[level] in edge."""
+        key=('adjacency',level,month)
+        if key not in self._index:
+            edges=self.edges[level]
+            if month is None:
+                rows=np.arange(len(edges))
+            else:
+                rows=np.flatnonzero(edges.month.to_numpy()==month)
+            source=self.node_index(edges.source.to_numpy()[rows],level)
+            target=self.node_index(edges.target.to_numpy()[rows],level)
+            if (source<0).any() or (target<0).any():
+                raise ValueError(f"Level {level} edges refer to nodes absent from {level}.nodes.")
+            order=np.argsort(source,kind='stable')
+            indptr=np.zeros(len(self.nodes[level])+1,dtype=np.int64)
+            np.cumsum(np.bincount(source,minlength=len(self.nodes[level])),out=indptr[1:])
+            self._index[key]=CSR(indptr,target[order],rows[order])
+        return self._index[key]
+
+    def group_index(self):
+        """Cell (level 0) <-> group (locality, level 1) index arrays from the
+        hierarchy."""
+        if 'groups' not in self._index:
+            numberOfCells=len(self.nodes[0])
+            cell=self.node_index(self.hierarchy.child.to_numpy(),0)
+            group=self.node_index(self.hierarchy.parent.to_numpy(),1)
+            member=(cell>=0)&(group>=0)
+            cellGroup=np.full(numberOfCells,-1,dtype=np.int64)
+            cellGroup[cell[member]]=group[member]
+            # members in hierarchy file order within each group
+            order=np.argsort(group[member],kind='stable')
+            indptr=np.zeros(len(self.nodes[1])+1,dtype=np.int64)
+            np.cumsum(np.bincount(group[member],minlength=len(self.nodes[1])),out=indptr[1:])
+            self._index['groups']=GroupIndex(cellGroup,indptr,cell[member][order])
+        return self._index['groups']
+
+    def group_members(self,localityIds):
+        """Cells of each given locality id. Returns (position, cellIds): the
+        cells of localityIds[k] are cellIds[position==k], in hierarchy
+        order. Unknown localities have no cells."""
+        groups=self.node_index(localityIds,1)
+        index=self.group_index()
+        start=np.where(groups>=0,index.indptr[groups],0)
+        counts=np.where(groups>=0,index.indptr[groups+1]-start,0)
+        position=np.repeat(np.arange(len(groups)),counts)
+        offset=np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)
+        members=index.members[start[position]+offset]
+        return position,self.node_ids(0)[members]
+
+    def group_map(self):
+        """Dictionary node id -> parent id (-1: root) from the hierarchy.
+        Needs only the hierarchy (read_hierarchy)."""
+        return dict(zip(self.hierarchy.child.tolist(),self.hierarchy.parent.tolist()))
+
     def compute_summary(self):
         self.number_of_nodes=[]
         self.number_of_edges=[]
@@ -133,11 +425,20 @@ if __name__=='__main__':
     # parser
     parser=argparse.ArgumentParser(description=DESC, epilog=EPI,formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument("network", help="input network folder which contains (i.nodes,i.edges) for i=0,1,2,... and hierarchy.tree files.")
+    parser.add_argument("--manifest", help="Validation manifest file (json); validated networks are recorded in it.")
+    parser.add_argument("--localities", type=int, nargs="+", help="Read only these localities (level 1 ids) and their cells.")
+    parser.add_argument("--countries", nargs="+", help="Read only the cells and localities of these countries.")
+    parser.add_argument("--months", type=int, nargs="+", help="Read only these months (1-12).")
+    parser.add_argument("-o", "--out", help="Write the network read (e.g. a region) to this folder.")
 
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.DEBUG)
 
     net=MultiScaleNet()
-    net.read_from_folder(args.network)
+    net.read_from_folder(args.network,manifest=args.manifest,
+            localities=args.localities,countries=args.countries,months=args.months)
     net.display_summary()
+    if args.out is not None:
+        net.write_to_folder(args.out)
+        logging.info(f"Written to '{args.out}'")
@@ -4,13 +4,14 @@ This is a slightly modified version from run_spread.py from MULTIPATHWAY_SIMULAT
 """
 
 import argparse
-from json import load
+from json import load, dump
 import logging
 import numpy as np
 import pandas as pd
 from random import seed
 from time import time
 import os
+from collections import deque
 import msc_network as msc # ensure msc_network.py is in the same folder
 
 # Constants
@@ -85,6 +86,47 @@ def compute_probability_LD(nodes, edges, alphaLD):
         ## edges['probability'] = edges['source'].map(nodes[0].probability)   
     return
 
+def weighted_describe(df, weights):
+    # Weighted counterpart of DataFrame.describe() for importance splitting.
+    # Quantiles interpolate linearly, and reduce to pandas' default when all
+    # weights are equal. The weights are reliability weights: the variance
+    # is unbiased (divided by sum(w)-sum(w^2)/sum(w)), i.e. the sample
+    # variance of describe() (ddof=1) when all weights are 1.
+    stats={}
+    for column in df.columns:
+        order=np.argsort(df[column].to_numpy(),kind='stable')
+        values=df[column].to_numpy()[order].astype(float)
+        w=weights[order]
+        total=w.sum()
+        mean=(w*values).sum()/total
+        denominator=total-(w**2).sum()/total
+        cumulative=np.cumsum(w)-w
+        position=cumulative/(total-w[-1]) if total>w[-1] else np.zeros(len(w))
+        stats[column]={
+            'count': total,
+            'mean': mean,
+            'std': np.sqrt((w*(values-mean)**2).sum()/denominator) if denominator>0 else np.nan,
+            'min': values[0],
+            '25%': np.interp(.25,position,values),
+            '50%': np.interp(.5,position,values),
+            '75%': np.interp(.75,position,values),
+            'max': values[-1]}
+    return pd.DataFrame(stats)
+
+def write_trajectories(trajectoryFile, numNodesInf, infectionTimes, weights,
+        nodesLevel0, monthTimeStepMap, simulationPrefix):
+    # Full-resolution simulation output in numpy's npz format, one array per
+    # column. See trajectory_query.py for reading it back.
+    np.savez_compressed(trajectoryFile,
+            new_infections=numNodesInf.to_numpy(dtype=np.int32),
+            infection_time=infectionTimes,
+            weight=weights,
+            node=nodesLevel0.index.to_numpy(dtype=np.int64),
+            locality=nodesLevel0.locality.fillna(-1).to_numpy(dtype=np.int64),
+            month=monthTimeStepMap.astype(np.int8),
+            simulation_output_prefix=np.array(simulationPrefix))
+    return
+
 def run_spread(network,
         model, 
         simulation, 
@@ -100,8 +142,6 @@ def run_spread(network,
 
     #PW: only cells within localities
     localityCellMap=hierarchyTree[hierarchyTree.parent!=-1]
-    hierarchyTreeDict=hierarchyTree.groupby('parent')['child'].apply(list)
-    hierarchyTreeDict=hierarchyTreeDict.to_dict()
     
     #PW: group cells by locality
     hierarchyTree=hierarchyTree.set_index('child').parent
@@ -156,8 +196,7 @@ def run_spread(network,
 
     ### AA: Remove isolated cells or level 0 nodes
     nodeAttributes[0]=nodeAttributes[0][
-            nodeAttributes[0].index.isin(
-                edgeAttributes['S'].source.drop_duplicates().to_list())]
+            np.diff(network.adjacency(0).indptr)>0]
 
     ## Short distance human-assisted pathway
     ## These are edges from locality to its own cells.
@@ -171,9 +210,9 @@ def run_spread(network,
 
     if args.dag_type == 1:
         # Taking the Cartesian product of a locality's set of cells with itself.
-        edgeAttributes['L']['source'] = edgeAttributes['L'][
-            'source'].map(hierarchyTreeDict)
-        edgeAttributes['L'] = edgeAttributes['L'].explode('source')
+        position,cells = network.group_members(edgeAttributes['L'].source.to_numpy())
+        edgeAttributes['L'] = edgeAttributes['L'].iloc[position]
+        edgeAttributes['L']['source'] = cells
         edgeAttributes['L'] = edgeAttributes['L'][
                 edgeAttributes['L'].source!=edgeAttributes['L'].target]
 
@@ -190,13 +229,15 @@ def run_spread(network,
 
     
     if args.dag_type == 1:
-        longDistanceEdges['source'] = longDistanceEdges['source'].map(
-            hierarchyTreeDict)
-        longDistanceEdges = longDistanceEdges.explode('source')
+        position,cells = network.group_members(longDistanceEdges.source.to_numpy())
+        longDistanceEdges = longDistanceEdges.iloc[position]
+        longDistanceEdges['source'] = cells
         longDistanceEdges=longDistanceEdges[
                 longDistanceEdges.source!=longDistanceEdges.child]
     edgeAttributes['LD']=longDistanceEdges.rename(columns={
         'child': 'target'}).groupby('month')
+    # Used in months without long-distance edges (e.g. in a region subset)
+    noEdgesLD=longDistanceEdges.rename(columns={'child': 'target'}).iloc[:0]
     # Remove variables not required from this point
     del network
     
@@ -215,6 +256,12 @@ def run_spread(network,
     numNodesInf = pd.DataFrame(np.zeros(
             (simulation['number_of_simulations'],simulation['time_steps']+1),
             dtype=int))
+    # Time of infection of every cell in every simulation, -1 if not infected.
+    # Only kept if full-resolution output is requested.
+    if args.trajectory_outpath is not None:
+        infectionTimes = np.full(
+                (simulation['number_of_simulations'],len(nodeAttributes[0])),
+                INFINITY, dtype=np.int16)
     # This table is being created to store the DAG.
     # It will be used only when dag_type!=1
     if args.dag_type==1:
@@ -234,28 +281,69 @@ def run_spread(network,
 
         timeExpandedTable.to_csv(dagFile,index=False)
 
+    # Importance splitting. Every simulation (trajectory) carries a weight.
+    # When a trajectory crosses the next infection-size threshold, it is
+    # cloned and its weight is shared equally among the copies, so that
+    # weighted statistics remain unbiased. Each clone continues with its own
+    # random number stream.
+    weights = np.ones(simulation['number_of_simulations'])
+    splitting = args.split_thresholds is not None
+    if splitting:
+        if args.dag_type==1:
+            raise ValueError('Importance splitting is not supported with DAG output.')
+        thresholds = sorted(args.split_thresholds)
+        cloneSeeds = np.random.SeedSequence(np.random.randint(2**31))
+        infectionCountTable = infectionCountTable.astype(float)
+    # Trajectories to simulate: None for a new simulation, otherwise the
+    # state of a clone.
+    pending = deque([None]*simulation['number_of_simulations'])
+
     # Start simulations
-    for simStep in range(simulation['number_of_simulations']): 
-        logging.info(f'Iteration {simStep} ...')
-        # Flush (or reset) system state
-        nodeAttributes[0].state=SUSCEPTIBLE
-
-        # Seed node state and bookkeeping
-        nodeAttributes[0].loc[seedNodes.node.to_list(),'state']=np.less(
-                np.random.random(seedNodes.shape[0]),
-                seedNodes.probability).to_numpy()*INFECTIOUS
-        infectionCountTable.loc[seedNodes.node,0] += nodeAttributes[0].loc[
-                seedNodes.node.to_list(),'state'] == INFECTIOUS
-
-        #for value counts of number of nodes infected
-        numNodesInf.loc[simStep,0]=(nodeAttributes[0].state!=0).sum()
-
-        # Set time of infection to 0 if seed node, else infinity 
-        nodeAttributes[0].time_of_infection= \
-                (nodeAttributes[0].state!=INFECTIOUS)*INFINITY
+    simStep = -1
+    while pending:
+        clone = pending.popleft()
+        simStep += 1
+        if simStep==len(numNodesInf):
+            # More trajectories than simulations due to splitting
+            numNodesInf = pd.concat([numNodesInf,
+                numNodesInf*0], ignore_index=True)
+            weights = np.concatenate([weights, np.ones(len(weights))])
+            if args.trajectory_outpath is not None:
+                infectionTimes = np.concatenate([infectionTimes,
+                    np.full(infectionTimes.shape, INFINITY, dtype=np.int16)])
+
+        if clone is None:
+            logging.info(f'Iteration {simStep} ...')
+            splitLevel = 0
+            startStep = 0
+            # Flush (or reset) system state
+            nodeAttributes[0].state=SUSCEPTIBLE
+
+            # Seed node state and bookkeeping
+            nodeAttributes[0].loc[seedNodes.node.to_list(),'state']=np.less(
+                    np.random.random(seedNodes.shape[0]),
+                    seedNodes.probability).to_numpy()*INFECTIOUS
+            infectionCountTable.loc[seedNodes.node,0] += nodeAttributes[0].loc[
+                    seedNodes.node.to_list(),'state'] == INFECTIOUS
+
+            #for value counts of number of nodes infected
+            numNodesInf.loc[simStep,0]=(nodeAttributes[0].state!=0).sum()
+
+            # Set time of infection to 0 if seed node, else infinity 
+            nodeAttributes[0].time_of_infection= \
+                    (nodeAttributes[0].state!=INFECTIOUS)*INFINITY
+        else:
+            logging.info(f'Iteration {simStep} (clone at time step {clone["time_step"]}) ...')
+            splitLevel = clone['level']
+            startStep = clone['time_step']
+            weights[simStep] = clone['weight']
+            nodeAttributes[0]['state'] = clone['state']
+            nodeAttributes[0]['time_of_infection'] = clone['time_of_infection']
+            numNodesInf.loc[simStep,:startStep] = clone['new_infections']
+            np.random.seed(clone['seed'])
        
         # Simulating for the current iteration.
-        for timeStep in range(1,config['simulation_parameters']['time_steps']+1):
+        for timeStep in range(startStep+1,config['simulation_parameters']['time_steps']+1):
             
             if args.dag_type==1:
                 # nodeAttributes[0][ (nodeAttributes[0].state==EXPOSED) & (timeStep-nodeAttributes[0].time_of_infection-1 < model['exposure_delay'])]
@@ -425,8 +513,11 @@ def run_spread(network,
                     StoEL['event']="StoI"
 
             #--------- Long Distance human-mediated dispersal -------
-            currentEdgesLD=edgeAttributes['LD'].get_group(
-                    monthTimeStepMap[timeStep]).reset_index()
+            if monthTimeStepMap[timeStep] in edgeAttributes['LD'].groups:
+                currentEdgesLD=edgeAttributes['LD'].get_group(
+                        monthTimeStepMap[timeStep]).reset_index()
+            else:
+                currentEdgesLD=noEdgesLD.reset_index()
             # Computing edge probabilities
             compute_probability_LD(nodeAttributes,currentEdgesLD,model['alpha_LD'])
 
@@ -472,12 +563,32 @@ def run_spread(network,
             numNodesInf.loc[simStep,timeStep]=newInfectedNodes.sum()
             nodeAttributes[0].loc[newInfectedNodes,['state','time_of_infection']]=(EXPOSED,timeStep)
 
-            infectionCountTable.loc[newInfectedNodes,timeStep] +=1
+            infectionCountTable.loc[newInfectedNodes,timeStep] += \
+                    weights[simStep] if splitting else 1
 
             if args.dag_type==1:
                 timeExpandedTable=pd.concat(
                         [timeExpandedTable, EtoE, EtoI, ItoI, 
                             StoES, StoEL, StoELD])
+
+            if splitting:
+                infected=(nodeAttributes[0].state!=SUSCEPTIBLE).sum()
+                crossed=0
+                while splitLevel<len(thresholds) and infected>=thresholds[splitLevel]:
+                    splitLevel+=1
+                    crossed+=1
+                if crossed:
+                    copies=args.split_factor**crossed
+                    weights[simStep]/=copies
+                    for child in cloneSeeds.spawn(copies-1):
+                        pending.append({
+                            'time_step': timeStep,
+                            'level': splitLevel,
+                            'weight': weights[simStep],
+                            'state': nodeAttributes[0].state.to_numpy().copy(),
+                            'time_of_infection': nodeAttributes[0].time_of_infection.to_numpy().copy(),
+                            'new_infections': numNodesInf.loc[simStep,:timeStep].to_numpy().copy(),
+                            'seed': child.generate_state(1)[0]})
         if args.dag_type==1:
             timeExpandedTable['level_1_intervention']=\
                     timeExpandedTable.source.map(hierarchyTree)
@@ -494,12 +605,24 @@ def run_spread(network,
                 'pathway',
                 'event']].to_csv(dagFile,index=False,header=False,mode='a')
             timeExpandedTable=timeExpandedTable[0:0]
+        if args.trajectory_outpath is not None:
+            infectionTimes[simStep]=nodeAttributes[0].time_of_infection.to_numpy()
 
     logging.info('End of simulation. Collecting results ...')
+    numNodesInf = numNodesInf.iloc[:simStep+1]
+    weights = weights[:simStep+1]
+    if splitting:
+        logging.info(f'{simStep+1} trajectories from {simulation["number_of_simulations"]} simulations.')
+    if args.trajectory_outpath is not None:
+        infectionTimes = infectionTimes[:simStep+1]
+        trajectoryFile=f'{args.trajectory_outpath}/{simulationPrefix}_trajectories.npz'
+        logging.info(f"Writing trajectories to '{trajectoryFile}' ...")
+        write_trajectories(trajectoryFile, numNodesInf, infectionTimes, weights,
+                nodeAttributes[0], monthTimeStepMap, simulationPrefix)
     infectionCountTable = infectionCountTable/simulation['number_of_simulations']
 
     # Assign control variable to DAG.
-    return infectionCountTable,numNodesInf
+    return infectionCountTable,numNodesInf,weights
 
 if __name__ == "__main__":
 
@@ -523,6 +646,12 @@ if __name__ == "__main__":
             help="Default directory for DAG file output, if different")
     parser.add_argument("--summary_outpath",
             help="Default directory for summary file output")
+    parser.add_argument("--trajectory_outpath",
+            help="Write per-simulation, per-time step infection counts and per-cell infection times to this directory")
+    parser.add_argument("--split_thresholds", type=int, nargs="+",
+            help="Importance splitting: clone simulations when the number of infected cells crosses each of these values")
+    parser.add_argument("--split_factor", type=int, default=2,
+            help="Number of copies made of a simulation at each splitting threshold")
     parser.add_argument("--include_headers", action="store_true",
             help="Write headers in every summary file. If false, header is written in a separate file")
     parser.add_argument("--summary_table", default="summary", 
@@ -533,6 +662,10 @@ if __name__ == "__main__":
             help="This is just for book keeping in the database.")
     parser.add_argument("--suppress_outfile", action="store_true",
             help="Suppress output file generation.")
+    parser.add_argument("--timing_out",
+            help="Write time taken by each stage to this file (json).")
+    parser.add_argument("--validation_manifest",
+            help="Skip network validation if the network files are recorded as validated in this file (json); record them otherwise.")
     args = parser.parse_args()
     
     
@@ -559,7 +692,14 @@ if __name__ == "__main__":
             %config['network_specific_input']['network'])
     network=msc.MultiScaleNet()
 
-    network.read_from_folder(config['network_specific_input']['network'])
+    # Only the months of the simulation window are needed. Optionally, only
+    # a region (list of locality ids or countries) is read.
+    network.read_from_folder(config['network_specific_input']['network'],
+            manifest=args.validation_manifest,
+            localities=config['network_specific_input'].get('localities'),
+            countries=config['network_specific_input'].get('countries'),
+            months=msc.window_months(config['simulation_parameters']['start_month'],
+                config['simulation_parameters']['time_steps']))
     network.display_summary()
     # Read interventions
     interventions=None
@@ -577,6 +717,11 @@ if __name__ == "__main__":
         f"Reading seed file '{config['network_specific_input']['seeding']}' ..."
     )
     seedNodes = pd.read_csv(config['network_specific_input']['seeding'])
+    outside = ~seedNodes.node.isin(network.nodes[0].node)
+    if outside.any():
+        # e.g. when only a region of the network is read
+        logging.warning(f"Ignoring {outside.sum()} seed node(s) not in the network.")
+        seedNodes = seedNodes[~outside]
     # Set random seed for reproducibility
     try:
         logging.info("Setting random seed to %d ..." %config['random_seed'])
@@ -589,13 +734,15 @@ if __name__ == "__main__":
     logging.info(f"DAG type: {args.dag_type}.")
     
     # Run simulation
-    infectionProbability,numNodesInf=run_spread(
+    simStart=time()
+    infectionProbability,numNodesInf,weights=run_spread(
             network, 
             config['model_parameters'],
             config['simulation_parameters'],
             config['simulation_output_prefix'],
             seedNodes,
             interventions)
+    simTime=time()-simStart
     # Post processing simulation output.
     if args.suppress_outfile:
         logging.info("Skipping generation of infections file ...")
@@ -607,7 +754,10 @@ if __name__ == "__main__":
         # use pandas cumsum followed by regular sum
         # (time,value) pairs 0 - .5, 1 - 2.3, 2 - 4, ... (non-decreasing)
         accumulatedInfection = infectionProbability.sum().cumsum()
-        infectionStats=numNodesInf.cumsum(axis=1).describe()
+        if args.split_thresholds is None:
+            infectionStats=numNodesInf.cumsum(axis=1).describe()
+        else:
+            infectionStats=weighted_describe(numNodesInf.cumsum(axis=1),weights)
         #numNodesInf.cumsum(axis=1).to_csv('temp.csv',index=False)
         for timeStep,value in accumulatedInfection.items():
             if timeStep==0:
@@ -681,5 +831,12 @@ infections_max\n"
         else:
             print(header_string + out_string)
     totalTime=time()-start
+    if args.timing_out is not None:
+        with open(args.timing_out, 'w') as f:
+            dump({'setup': simStart-start,
+                'simulation': simTime,
+                'post_processing': totalTime-simTime-(simStart-start),
+                'total': totalTime,
+                'number_of_simulations': config['simulation_parameters']['number_of_simulations']}, f)
     if not args.no_time:
         logging.info(f"Done. {totalTime/3600: .0f} hours {(totalTime-int(totalTime/3600)*3600)/60: .0f} minutes {totalTime%60: .0f} seconds")
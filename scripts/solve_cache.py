@@ -0,0 +1,79 @@
+DESC="""Content-addressed cache of the results of the intervention algorithm.
+
+algorithm_groupint_general_v2.py --cache_path DIR stores the summary line,
+the metrics record and the intervention files (and, with --screening_path,
+the screening counts) of every budget/intervention time instance it solves
+under a key computed from the content of the DAG and hierarchy files, the
+budget, the intervention time and the options that change the result. When
+a pipeline is re-submitted, instances whose key is in the cache are written
+straight to the summary, intervention and screening folders (the DAG is not
+parsed, and not read at all if every instance is cached); only the others are
+solved. The runtime and work columns and the metrics file are those of the
+original solve (the metrics file marked "cached": true).
+
+Each entry is a folder DIR/<key> with summary.json and the output files.
+Entries are written to a temporary folder and renamed, so concurrent jobs can
+share a cache. Increase CACHE_VERSION when a change of the algorithm changes
+its results or what an entry holds, so that older entries are no longer
+used.
+
+Example:
+python algorithm_groupint_general_v2.py ../work/dags/BD_S100_24_dag.csv ../input/networks/BD/hierarchy.tree \\
+    -b 1 3 -i 6 --cache_path ../work/solve_cache
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+CACHE_VERSION = 3
+HASH_BLOCK = 1 << 20 # bytes read at a time when hashing a file
+
+def fileHash(filename):
+    """sha256 of the content of a file."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+class SolveCache:
+    """Cache folder for the instances of one DAG and hierarchy file. options:
+    dictionary of the options that change the result (JSON serializable)."""
+
+    def __init__(self, path, input_file, hierarchy_file, options):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.base = {'version': CACHE_VERSION, 'dag': fileHash(input_file),
+                     'hierarchy': fileHash(hierarchy_file), 'options': options}
+
+    def key(self, budget, int_time):
+        content = json.dumps({**self.base, 'budget': budget, 'int_time': int_time}, sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, budget, int_time):
+        """(folder, summary dictionary) of a cached instance, or None."""
+        folder = os.path.join(self.path, self.key(budget, int_time))
+        try:
+            with open(os.path.join(folder, 'summary.json')) as f:
+                return folder, json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, budget, int_time, summary, files):
+        """Stores an instance: summary (dictionary, JSON serializable) and
+        copies of its output files."""
+        folder = os.path.join(self.path, self.key(budget, int_time))
+        if os.path.isdir(folder):
+            return
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp')
+        for filename in files:
+            shutil.copy(filename, tmp)
+        with open(os.path.join(tmp, 'summary.json'), 'w') as f:
+            json.dump({**summary, 'files': [os.path.basename(f) for f in files]}, f)
+        try:
+            os.rename(tmp, folder)
+        except OSError: # stored by another job in the meantime
+            shutil.rmtree(tmp)
@@ -0,0 +1,157 @@
+DESC='''Queries full-resolution simulator output.
+
+run_spread_v2.py with --trajectory_outpath writes, for every simulation, the
+number of newly infected cells at every time step and the infection time of
+every cell (*_trajectories.npz). This script derives summaries from those
+files without re-running the simulator: the statistics of the simulation
+summary file at any set of time steps, quantiles of the cumulative number of
+infections at every time step (month), infection curves per locality, and
+per-cell infection probabilities. One of --summary (the default),
+--quantiles, --localities and --cells is output.
+
+Example:
+python trajectory_query.py ../work/trajectories/BD_S100_0_trajectories.npz --summary --every 1
+'''
+
+import argparse
+from glob import glob
+import numpy as np
+import pandas as pd
+from run_spread_v2 import weighted_describe # make sure run_spread_v2.py is in the same folder
+
+PERCENTILES=[.25,.5,.75]
+
+def weighted_quantile(values, weights, q):
+    '''Quantiles of weighted values, interpolated as in weighted_describe.'''
+    order = np.argsort(values.to_numpy(), kind='stable')
+    v = values.to_numpy()[order].astype(float)
+    w = weights[order]
+    position = (np.cumsum(w)-w)/(w.sum()-w[-1]) if w.sum()>w[-1] else np.zeros(len(w))
+    return pd.Series(np.interp(q, position, v), index=q)
+
+class Trajectories:
+    '''Full-resolution output of one or more simulator runs.'''
+
+    def __init__(self, files):
+        if isinstance(files, str):
+            files = sorted(glob(files))
+        if len(files)==0:
+            raise FileNotFoundError('No trajectory files found.')
+        newInfections = []
+        infectionTimes = []
+        weights = []
+        for f in files:
+            with np.load(f) as data:
+                if len(newInfections) and not np.array_equal(data['node'], self.node):
+                    raise ValueError(f'{f}: cells differ from the other trajectory files.')
+                self.node = data['node']
+                self.locality = data['locality']
+                self.month = data['month']
+                newInfections.append(data['new_infections'])
+                infectionTimes.append(data['infection_time'])
+                # Trajectories from importance splitting have weights
+                weights.append(data['weight'] if 'weight' in data.files
+                               else np.ones(len(data['new_infections'])))
+        self.files = files
+        # rows: simulations, columns: time steps
+        self.new_infections = np.concatenate(newInfections)
+        # rows: simulations, columns: cells
+        self.infection_time = np.concatenate(infectionTimes)
+        self.weight = np.concatenate(weights)
+        self.number_of_trajectories, self.time_steps = self.new_infections.shape
+        self.weighted = not np.all(self.weight==1)
+
+    def cumulative(self):
+        '''Cumulative number of infected cells; simulations x time steps.'''
+        return pd.DataFrame(self.new_infections.cumsum(axis=1))
+
+    def summary(self, time_steps=None, percentiles=PERCENTILES):
+        '''Same statistics as the simulator summary (infections_mean, ...),
+        one row per time step.'''
+        if self.weighted:
+            stats = weighted_describe(self.cumulative(), self.weight).T
+        else:
+            stats = self.cumulative().describe(percentiles=percentiles).T
+        stats.index.name = 'time_step'
+        if time_steps is not None:
+            stats = stats.loc[list(time_steps)]
+        return stats
+
+    def quantiles(self, q=PERCENTILES):
+        '''Quantiles of the cumulative number of infections at every time
+        step, along with the calendar month of the time step.'''
+        if self.weighted:
+            out = self.cumulative().apply(weighted_quantile, args=(self.weight, q)).T
+        else:
+            out = self.cumulative().quantile(q).T
+        out.index.name = 'time_step'
+        out.insert(0, 'month', self.month)
+        return out
+
+    def infected_by(self, time_step):
+        '''Boolean matrix of cells (columns) infected by time_step in each
+        simulation (rows).'''
+        return (self.infection_time>=0) & (self.infection_time<=time_step)
+
+    def locality_curves(self):
+        '''Mean cumulative number of infected cells per locality (rows) and
+        time step (columns). Cells outside of any locality are under -1.'''
+        infected = np.stack([np.average(self.infected_by(t), axis=0, weights=self.weight)
+                             for t in range(self.time_steps)], axis=1)
+        df = pd.DataFrame(infected)
+        return df.groupby(self.locality).sum()
+
+    def infection_probability(self, time_step=None):
+        '''Probability that each cell is infected by time_step (default: the
+        end of the run).'''
+        if time_step is None:
+            time_step = self.time_steps-1
+        return pd.Series(np.average(self.infected_by(time_step), axis=0, weights=self.weight),
+                         index=pd.Index(self.node, name='node'))
+
+def main():
+    parser=argparse.ArgumentParser(description=DESC,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('files', nargs='+',
+            help='Trajectory files (*_trajectories.npz); quoted glob patterns are expanded')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--summary', action='store_true',
+            help='Simulation summary statistics per time step (the default output)')
+    mode.add_argument('--quantiles', nargs='*', type=float,
+            help='Quantiles of cumulative infections at every time step (default: 0.25 0.5 0.75)')
+    mode.add_argument('--localities', action='store_true',
+            help='Mean infection curve per locality')
+    mode.add_argument('--cells', action='store_true',
+            help='Per-cell infection probability at the end of the run')
+    parser.add_argument('--every', type=int,
+            help='With --summary, keep every n-th time step (default 6, as in the simulator summary)')
+    parser.add_argument('-o', '--out', help='Write the result to this csv file instead of printing it')
+    args = parser.parse_args()
+    if not (args.quantiles is not None or args.localities or args.cells):
+        args.summary = True
+    if args.every is not None and not args.summary:
+        parser.error('--every only applies to --summary')
+
+    files = []
+    for f in args.files:
+        files.extend(sorted(glob(f)))
+    traj = Trajectories(files)
+
+    if args.summary:
+        every = 6 if args.every is None else args.every
+        out = traj.summary(time_steps=range(every, traj.time_steps, every))
+    elif args.quantiles is not None:
+        out = traj.quantiles(args.quantiles if len(args.quantiles) else PERCENTILES)
+    elif args.localities:
+        out = traj.locality_curves()
+    else:
+        out = traj.infection_probability()
+
+    if args.out is None:
+        print(out.to_string())
+    else:
+        out.to_csv(args.out)
+        print(args.out)
+
+if __name__ == '__main__':
+    main()